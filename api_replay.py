@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import gzip
+import time
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from fetch_stats import BASE_URL
+
+FIXTURES = 'api_fixtures' # Recorded API responses, one gzipped JSON file per endpoint and query
+
+
+class FixtureArchive:
+    '''Recorded API responses on disk, keyed by endpoint plus sorted query params, so the same request always finds
+    the same response whichever client made it. Bodies are kept exactly as the API sent them.'''
+
+    def __init__(self, directory=FIXTURES):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, endpoint, query):
+        '''Returns the address of a request. query is a list of (name, value) string pairs.'''
+
+        raw = json.dumps([endpoint, sorted(query)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def get(self, endpoint, query):
+        '''Returns the recorded body for a request as bytes, or None if it was never recorded.'''
+
+        try:
+            with gzip.open(self._path(self.key(endpoint, query)), 'rt') as f:
+                return json.load(f)['body'].encode()
+        except OSError:
+            return None
+
+    def put(self, endpoint, query, body):
+        '''Records the body of a response, writing to a temp file first so a replay never sees a partial fixture.'''
+
+        path = self._path(self.key(endpoint, query))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump({'endpoint': endpoint, 'query': sorted(query), 'body': body.decode()}, f)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return sum(name.endswith('.json.gz') for _, _, files in os.walk(self.directory) for name in files)
+
+
+class ReplayServer:
+    '''Local stand-in for api.collegefootballdata.com serving a FixtureArchive over HTTP on a background thread. Both
+    the cfbd API objects and fetch_stats can be pointed at url. Every response waits latency seconds first, so fetch
+    throughput can be measured against a realistic round trip without the network. With upstream set, requests
+    missing from the archive are forwarded there with the client's Authorization header and recorded; without it they
+    get a 404, so a replay never silently reaches the real API.'''
+
+    def __init__(self, archive=FIXTURES, latency=0.0, upstream=None, port=0):
+        self.archive = archive if isinstance(archive, FixtureArchive) else FixtureArchive(archive)
+        self.latency = latency
+        self.upstream = upstream
+        self.port = port
+        self.served = 0
+        self.recorded = 0
+        self.missing = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def respond(self, path, headers):
+        '''Returns the (status, body) for a request path with its query string.'''
+
+        parts = urlsplit(path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        body = self.archive.get(parts.path, query)
+        if body is not None:
+            with self._lock:
+                self.served += 1
+            return 200, body
+        if self.upstream is None:
+            with self._lock:
+                self.missing += 1
+            return 404, json.dumps({'message': 'No recorded response for ' + path}).encode()
+        response = requests.get(self.upstream + path, headers={'Authorization': headers.get('Authorization', '')})
+        if response.status_code == 200:
+            self.archive.put(parts.path, query, response.content)
+            with self._lock:
+                self.recorded += 1
+        return response.status_code, response.content
+
+    def start(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if replay.latency > 0:
+                    time.sleep(replay.latency)
+                status, body = replay.respond(self.path, self.headers)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # One line per request would drown out the pipeline's own output
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(served=self.served, recorded=self.recorded, missing=self.missing)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def replay_configuration(server, api_key=''):
+    '''Returns a cfbd Configuration whose API objects, and the stats fetches of update_game_data, go to server.'''
+
+    import cfbd
+    configuration = cfbd.Configuration()
+    configuration.host = server.url
+    configuration.api_key['Authorization'] = api_key
+    configuration.api_key_prefix['Authorization'] = 'Bearer'
+    return configuration
+
+
+def record(api_key, archive=FIXTURES):
+    '''Runs gather_game_data from an empty game store through a recording server, so every games, lines and stats
+    response an update needs ends up in archive. Responses already recorded aren't requested again.'''
+
+    from update_game_data import gather_game_data
+    from response_cache import ResponseCache
+    archive = os.path.abspath(archive)
+    with ReplayServer(archive, upstream=BASE_URL) as server, tempfile.TemporaryDirectory() as scratch:
+        cwd = os.getcwd()
+        os.chdir(scratch) # Game store and response cache start empty and are thrown away
+        try:
+            gather_game_data(replay_configuration(server, api_key), cache=ResponseCache('api_cache'))
+        finally:
+            os.chdir(cwd)
+        print('Recorded ', server.stats()['recorded'], ' responses, ', len(server.archive), ' in ', archive)
+
+
+def benchmark(archive=FIXTURES, latency=0.05):
+    '''Times a full gather_game_data from an empty game store and response cache against the recorded archive, with
+    latency seconds added to every response. Prints the stage timings, which only depend on the archive and
+    latency, so runs on any machine are comparable.'''
+
+    from update_game_data import gather_game_data
+    from response_cache import ResponseCache
+    from run_stats import STATS
+    archive = os.path.abspath(archive)
+    with ReplayServer(archive, latency=latency) as server, tempfile.TemporaryDirectory() as scratch:
+        cwd = os.getcwd()
+        os.chdir(scratch)
+        try:
+            start = time.perf_counter()
+            games = gather_game_data(replay_configuration(server), cache=ResponseCache('api_cache'))
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+        summary = STATS.summary()
+        print('Replayed ', server.stats()['served'], ' responses at ', latency, ' s latency: ', len(games), ' games in ',
+              round(seconds, 3), ' s')
+        for name, timing in sorted(summary['timers'].items()):
+            print(name, timing['calls'], timing['seconds'])
+        if server.stats()['missing'] > 0:
+            print(server.stats()['missing'], ' requests had no recorded response; record the archive again')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'record':
+        record(sys.argv[2])
+    else:
+        benchmark(latency=float(sys.argv[1]) if len(sys.argv) > 1 else 0.05)
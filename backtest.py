@@ -0,0 +1,131 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from game_store import load_games
+from inference import EXCLUDED, CAT_FEATURES
+
+THRESHOLDS = range(10) # Edges over the spread, in points, that the hit rate is reported at
+PREDICTION_COLUMNS = ['year', 'week', 'home_team', 'away_team', 'spread', 'margin', 'predicted']
+
+# Neural net settings from the notebook's manual fit
+NET_LAYERS = [35,35]
+NET_EMBED_P = 0.4
+NET_PS = 0.47
+NET_SCHEDULE = [(4, 0.05), (1, 0.01)] # (epochs, learning rate)
+
+_games = None # Each worker's copy of the games, loaded once by _init_worker
+
+
+def walk_forward_weeks(df, first_year=2016, last_year=None, min_week=4):
+    '''Returns the (year, week) pairs to backtest, in order. Weeks before min_week are skipped, as their stats cover
+    too few games.'''
+
+    weeks = df.loc[(df['year'] >= first_year) & (df['week'] >= min_week), ['year', 'week']].drop_duplicates()
+    if last_year is not None:
+        weeks = weeks[weeks['year'] <= last_year]
+    return [tuple(int(v) for v in row) for row in weeks.sort_values(['year', 'week']).to_numpy()]
+
+
+def hit_rate_table(predicted, spread, margin, thresholds=THRESHOLDS):
+    '''Returns the hit rate against the spread for picks whose edge, abs(predicted - spread), is over each threshold.
+    A pick is a hit when the game lands on the same side of the spread as the prediction, so pushes count as misses.'''
+
+    edge = np.asarray(predicted, dtype=float) - np.asarray(spread, dtype=float)
+    hit = np.sign(edge) == np.sign(np.asarray(margin, dtype=float) - np.asarray(spread, dtype=float))
+    thresholds = np.asarray(list(thresholds), dtype=float)
+    picked = np.abs(edge)[None, :] > thresholds[:, None] # thresholds x games
+    picks = picked.sum(axis=1)
+    hits = (picked & hit[None, :]).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = hits / picks
+    return pd.DataFrame({'threshold': thresholds, 'picks': picks, 'hits': hits, 'hit_rate': rate})
+
+
+def season_hit_rates(predictions, thresholds=THRESHOLDS):
+    '''Returns hit_rate_table for each season of a predictions DataFrame, stacked with a year column.'''
+
+    tables = [hit_rate_table(group['predicted'], group['spread'], group['margin'], thresholds).assign(year=year)
+              for year, group in predictions.groupby('year')]
+    return pd.concat(tables, ignore_index=True)[['year', 'threshold', 'picks', 'hits', 'hit_rate']]
+
+
+def fit_net(train_df, cat_features, cont_features, seed):
+    '''Fits the notebook's neural net on train_df and returns a TabularPredictor for it.'''
+
+    from fastai.tabular.all import TabularPandas, Categorify, Normalize, tabular_learner, tabular_config, set_seed
+    from inference import TabularPredictor
+
+    set_seed(seed, reproducible=True)
+    # Everything is training data, the week being predicted is the validation
+    to = TabularPandas(train_df, procs=[Categorify, Normalize],
+                        y_names="margin",
+                        cat_names = cat_features,
+                        cont_names = cont_features,
+                        splits=(list(range(len(train_df))), []))
+    dls = to.dataloaders(bs=64)
+    learn = tabular_learner(dls, layers=NET_LAYERS, config=tabular_config(embed_p=NET_EMBED_P, ps=NET_PS))
+    with learn.no_bar(), learn.no_logging():
+        for epochs, lr in NET_SCHEDULE:
+            learn.fit(epochs, lr=lr)
+    return TabularPredictor(learn, {c: (0., 1.) for c in cont_features}) # Training data isn't pre-scaled
+
+
+def _init_worker(columns, directory):
+    '''Loads the games once per worker process and keeps each worker to one thread, as the pool already uses every core.'''
+
+    global _games
+    import torch
+    torch.set_num_threads(1)
+    _games = load_games(columns=columns, directory=directory).dropna().reset_index(drop=True)
+
+
+def backtest_week(year, week, cat_features, cont_features, seed=0, min_week=4):
+    '''Trains on every game before the given week and predicts that week. Returns the week's games with a predicted
+    column.'''
+
+    df = _games
+    train_df = df[((df['year'] < year) | ((df['year'] == year) & (df['week'] < week))) & (df['week'] >= min_week)]
+    test_df = df[(df['year'] == year) & (df['week'] == week)]
+    predictor = fit_net(train_df.reset_index(drop=True), cat_features, cont_features, seed + year*100 + week)
+    predictions = test_df[[c for c in PREDICTION_COLUMNS if c != 'predicted']].copy()
+    predictions['predicted'] = predictor.predict(test_df)['predicted']
+    print('Backtested week, year: ', week, year)
+    return predictions
+
+
+def run_backtest(first_year=2016, last_year=None, min_week=4, max_workers=None, seed=0, directory='CFBGameData',
+                 features_path='features_for_cfb_model.dat', output='backtest_predictions.csv'):
+    '''Walk-forward backtest of the neural net: for every week from first_year on, trains through the week before and
+    predicts that week. Weeks are independent jobs on a process pool reading from the game store. Writes every
+    prediction to output and returns them with the overall and per season hit rate tables. Results only depend on
+    seed, not on the number of workers.'''
+
+    with open(features_path,'rb') as f:
+        selected_features = list(pickle.load(f))
+    cat_features = CAT_FEATURES
+    cont_features = [c for c in selected_features if c not in cat_features and c not in EXCLUDED]
+    columns = list(dict.fromkeys(['home_team', 'away_team', 'spread', 'margin'] + cat_features + cont_features))
+
+    weeks = walk_forward_weeks(load_games(columns=[], directory=directory), first_year, last_year, min_week)
+    print('Backtesting ', len(weeks), ' weeks')
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(columns, directory)) as pool:
+        futures = [pool.submit(backtest_week, year, week, cat_features, cont_features, seed, min_week)
+                   for year, week in weeks]
+        predictions = pd.concat([future.result() for future in futures], ignore_index=True)
+
+    if output is not None:
+        predictions.to_csv(output, index=False)
+    overall = hit_rate_table(predictions['predicted'], predictions['spread'], predictions['margin'])
+    by_season = season_hit_rates(predictions)
+    print('Analysis of neural net performance, by difference from spread')
+    print(overall.to_string(index=False))
+    print(by_season.to_string(index=False))
+    return predictions, overall, by_season
+
+
+if __name__ == '__main__':
+    run_backtest()
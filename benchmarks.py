@@ -0,0 +1,269 @@
+import os
+import io
+import sys
+import json
+import time
+import pickle
+import tempfile
+import tracemalloc
+import contextlib
+from types import SimpleNamespace
+import numpy as np
+
+from feature_schema import SEASON_STATS, ADVANCED_STATS
+from fetch_stats import PLACEHOLDER_PAIR
+from response_cache import normalize_params
+
+BASELINES = 'benchmark_baselines.json' # Last saved results, per stage
+TOLERANCE = 0.25 # Fractional drop in throughput, or growth in peak memory, that counts as a regression
+SINGLE_RUN = {'LassoCV'} # Stages too slow to repeat, timed on the run that traces memory
+N_TEAMS = 130
+N_CONFERENCES = 10
+WEEKS = range(1, 15)
+YEARS = [2021, 2022]
+
+
+class SyntheticSeasons:
+    '''Stands in for the response cache with made-up stats shaped like the API's: /stats/season rows of team,
+    conference, statName and statValue, and /stats/season/advanced rows with nested offense and defense objects.
+    Each team gets random per-week stats and a window is the sum of its weeks, so every window process_games asks
+    for has an answer. Responses are built on first request and kept, so a warm-up run leaves only feature assembly
+    to time.'''
+
+    def __init__(self, years=YEARS, n_teams=N_TEAMS, seed=0):
+        rng = np.random.default_rng(seed)
+        self.years = list(years)
+        self.teams = ['Team %d' % i for i in range(n_teams)]
+        self.conferences = ['Conference %d' % (i % N_CONFERENCES) for i in range(n_teams)]
+        weeks = max(WEEKS) + 1
+        # The placeholder request's season has to exist too, as week 1 games read it
+        self.season = {year: rng.gamma(2., 10., (weeks, n_teams, len(SEASON_STATS))) for year in [*years, PLACEHOLDER_PAIR[0].year, min(years) - 1]}
+        self.advanced = {year: rng.gamma(2., 1., (weeks, n_teams, len(ADVANCED_STATS))) for year in self.season}
+        self._responses = {}
+
+    def _window(self, stats, params):
+        week_stats = stats[params['year']]
+        start, end = params.get('startWeek', 1), params.get('endWeek', len(week_stats) - 1)
+        return week_stats[start:end + 1].sum(axis=0)
+
+    def _rows(self, endpoint, params):
+        teams = range(len(self.teams)) if 'team' not in params else [self.teams.index(params['team'])] if params['team'] in self.teams else [0]
+        if endpoint == '/stats/season':
+            window = self._window(self.season, params)
+            return [dict(season=params['year'], team=self.teams[i], conference=self.conferences[i], statName=name,
+                         statValue=float(window[i, j])) for i in teams for j, name in enumerate(SEASON_STATS)]
+        window = self._window(self.advanced, params)
+        rows = []
+        for i in teams:
+            row = dict(season=params['year'], team=self.teams[i], conference=self.conferences[i])
+            for j, path in enumerate(ADVANCED_STATS):
+                node = row
+                for key in path[:-1]:
+                    node = node.setdefault(key, {})
+                node[path[-1]] = float(window[i, j])
+            rows.append(row)
+        return rows
+
+    def get(self, endpoint, params):
+        key = (endpoint, json.dumps(normalize_params(params)))
+        if key not in self._responses:
+            self._responses[key] = self._rows(endpoint, params)
+        return self._responses[key]
+
+    def put(self, endpoint, params, data):
+        pass
+
+    def games(self, seed=0):
+        '''Returns a schedule of finished games shaped like iter_unsettled_games' output, every team playing once
+        a week, ordered by year and week.'''
+
+        rng = np.random.default_rng(seed)
+        games = []
+        for year in self.years:
+            for week in WEEKS:
+                order = rng.permutation(len(self.teams))
+                for home, away in zip(order[::2], order[1::2]):
+                    home_points, away_points = (int(p) for p in rng.integers(0, 50, 2))
+                    games.append(dict(gid=len(games), year=year, week=week, neutral_site=bool(rng.random() < 0.05),
+                                      home_team=self.teams[home], home_conference=self.conferences[home],
+                                      home_points=home_points, home_elo=float(rng.normal(1500, 200)),
+                                      away_team=self.teams[away], away_conference=self.conferences[away],
+                                      away_points=away_points, away_elo=float(rng.normal(1500, 200)),
+                                      margin=away_points - home_points))
+        return games
+
+
+def synthetic_lines(games, seed=0):
+    '''Returns betting lines for games, shaped like the GameLines objects of /lines: a few providers per game, in a
+    shuffled order, with some games missing a consensus line.'''
+
+    rng = np.random.default_rng(seed)
+    lines = []
+    for game in games:
+        providers = [p for p in ['consensus', 'Bovada', 'DraftKings', 'teamrankings'] if p != 'consensus' or rng.random() < 0.9]
+        spread = float(np.round(game['margin'] + rng.normal(0, 13) * 2) / 2)
+        lines.append(SimpleNamespace(id=game['gid'], home_team=game['home_team'], away_team=game['away_team'],
+                                     lines=[SimpleNamespace(provider=p, spread=spread + rng.choice([-0.5, 0, 0.5]))
+                                            for p in rng.permutation(providers)]))
+    return lines[::-1]
+
+
+def measure(stage, setup, repeats=3):
+    '''Runs stage(*setup()) repeats times and returns the best time in seconds and the peak memory, in bytes, that
+    one more run allocates on top of its inputs. Memory is traced on a separate run so it doesn't slow the timed
+    ones; with repeats of 0 the traced run is the only one, and is timed as well.'''
+
+    seconds = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        stage(*args)
+        seconds.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        stage(*args)
+        traced_seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return min(seconds) if len(seconds) > 0 else traced_seconds, peak
+
+
+def quiet(function):
+    '''Wraps a pipeline function so its progress prints don't land in the report.'''
+
+    def wrapper(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def build_stages(scratch, seed=0):
+    '''Returns the stages as a list of (name, games per run, stage, setup). Game store files go under scratch.'''
+
+    from update_game_data import process_games, add_spreads
+    from game_frame import games_frame
+
+    responses = SyntheticSeasons(seed=seed)
+    games = responses.games(seed)
+    lines = synthetic_lines(games, seed)
+    add_spreads(games, lines)
+    fresh_games = lambda: ([dict(game) for game in games],)
+    run_process_games = quiet(lambda games: process_games(games, {}, cache=responses))
+    run_rolling = quiet(lambda games: process_games(games, {}, cache=responses, rolling=True))
+    processed = run_process_games(*fresh_games()) # Warm-ups, which also build every response
+    run_rolling(*fresh_games())
+    df = games_frame(processed)
+
+    def selection_frame():
+        from game_frame import encode_categories
+        numeric = encode_categories(df.copy(deep=False), ['home_conference', 'away_conference', 'home_team', 'away_team'])
+        numeric = numeric.drop(columns=['gid', 'neutral_site']).fillna(0)
+        return ((numeric - numeric.mean()) / numeric.std().replace(0, 1),) # select_features gets z-scaled games
+
+    def prune(frame):
+        from select_features import prune_correlated
+        return prune_correlated(frame)
+
+    def lasso(frame):
+        # As select_features fits it, but on every feature rather than just those prune_correlated keeps
+        from select_features import parallel_lasso_cv, EXCLUDED
+        cont = [c for c in frame.columns if c not in EXCLUDED]
+        return parallel_lasso_cv(frame[cont].to_numpy(dtype=np.float32), frame['margin'].to_numpy(dtype=np.float64))
+
+    def save_store(directory):
+        from game_store import save_week
+        for (year, week), group in df.groupby(['year', 'week'], observed=True):
+            save_week(group.to_dict('records'), int(year), int(week), directory)
+
+    def load_store(directory):
+        from game_store import load_games
+        return load_games(directory=directory)
+
+    def stored():
+        directory = os.path.join(scratch, 'store')
+        if not os.path.isdir(directory):
+            save_store(directory)
+        return (directory,)
+
+    def score(predictor, frame):
+        return predictor.predict(frame)
+
+    def scorer():
+        from scoring_service import load_predictor
+        with open('cfb_feature_normalizations.dat', 'rb') as f:
+            normalizations = pickle.load(f)
+        return (load_predictor(normalizations), df)
+
+    stages = [('process_games', len(games), run_process_games, fresh_games),
+              ('process_games rolling', len(games), run_rolling, fresh_games),
+              ('line join', len(games), add_spreads, lambda: ([dict(game) for game in games], lines)),
+              ('prune_correlated', len(df), quiet(prune), selection_frame),
+              ('LassoCV', len(df), lasso, selection_frame),
+              ('game store save', len(df), save_store, lambda: (tempfile.mkdtemp(dir=scratch),)),
+              ('game store load', len(df), load_store, stored),
+              ('scoring', len(df), score, scorer)]
+    return stages
+
+
+def run_benchmarks(repeats=3, seed=0, stages=None):
+    '''Times every stage and returns {stage: {'seconds', 'games_per_second', 'peak_mb'}}. A stage that can't run
+    here, such as scoring without the model files, is reported with the reason instead.'''
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for name, n_games, stage, setup in build_stages(scratch, seed):
+            if stages is not None and name not in stages:
+                continue
+            try:
+                seconds, peak = measure(stage, setup, 0 if name in SINGLE_RUN else repeats)
+            except (ImportError, OSError) as error:
+                results[name] = dict(skipped=str(error))
+                print(name, ': skipped, ', error)
+                continue
+            results[name] = dict(seconds=round(seconds, 4), games_per_second=round(n_games / seconds, 1),
+                                 peak_mb=round(peak / 1024**2, 2))
+            print(name, ': ', results[name]['games_per_second'], ' games/s, ', results[name]['seconds'], ' s, peak ',
+                  results[name]['peak_mb'], ' MB')
+    return results
+
+
+def save_baselines(results, path=BASELINES):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('Baselines saved to ', path)
+
+
+def regressions(results, baselines, tolerance=TOLERANCE):
+    '''Returns a message for each stage that is slower, by throughput, or uses more memory than its baseline by more
+    than tolerance. Peak memory gets another 1 MB of slack so tiny stages don't trip on allocator noise.'''
+
+    messages = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None or 'skipped' in result or 'skipped' in baseline:
+            continue
+        if result['games_per_second'] < baseline['games_per_second'] * (1 - tolerance):
+            messages.append('%s: %.1f games/s, baseline %.1f' % (name, result['games_per_second'], baseline['games_per_second']))
+        if result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance) + 1:
+            messages.append('%s: peak %.2f MB, baseline %.2f MB' % (name, result['peak_mb'], baseline['peak_mb']))
+    return messages
+
+
+if __name__ == '__main__':
+    results = run_benchmarks()
+    if len(sys.argv) > 1 and sys.argv[1] == 'save':
+        save_baselines(results)
+    elif os.path.isfile(BASELINES):
+        with open(BASELINES) as f:
+            failed = regressions(results, json.load(f))
+        for message in failed:
+            print('REGRESSION ', message)
+        if len(failed) > 0:
+            sys.exit(1)
+        print('No regressions against ', BASELINES)
+    else:
+        print('No baselines yet; run `python benchmarks.py save` to keep these results as the baseline')
@@ -0,0 +1,109 @@
+import sys
+import argparse
+from run_stats import timed_import # Commands import what they need when they run, so --help loads none of it
+
+STARTUP_COMMANDS = [['--help'], ['cache-stats']] # Timed by `startup`, which should both stay well under a second
+
+
+def update_cache(args):
+    configuration = timed_import('make_predictions').make_configuration(args.api_key)
+    timed_import('update_game_data').gather_game_data(configuration, restatement_weeks=args.restatement_weeks,
+                                                      rolling=args.rolling)
+
+
+def predict(args):
+    make_predictions = timed_import('make_predictions')
+    configuration = make_predictions.make_configuration(args.api_key)
+    if args.lines:
+        timed_import('line_refresh').refresh_lines(configuration)
+    else:
+        make_predictions.predict(configuration)
+
+
+def select_features(args):
+    selection = timed_import('select_features')
+    df = selection.selection_data(args.directory)
+    selected = selection.select_features(df, selection.EXCLUDED, selection.CAT_FEATURES, args.threshold)
+    if args.output:
+        if selection.save_features(selected, args.output):
+            print('Selected features written to ', args.output)
+        else:
+            print('Selection unchanged, ', args.output, ' left as it is')
+
+
+def backtest(args):
+    timed_import('backtest').run_backtest(first_year=args.first_year, last_year=args.last_year,
+                                          max_workers=args.workers, directory=args.directory)
+
+
+def cache_stats(args):
+    '''Prints the size of the response cache and which weeks the game store has settled, reading only file sizes
+    and the manifest.'''
+
+    from response_cache import ResponseCache
+    from game_store import load_manifest
+    stats = ResponseCache(args.cache).stats()
+    print('Response cache: ', stats['entries'], ' entries, ', round(stats['bytes'] / 1024**2, 1), ' MB')
+    for year, weeks in sorted(load_manifest(args.directory).items()):
+        settled = sum(entry['settled'] for entry in weeks.values())
+        print(year, ': ', len(weeks), ' weeks stored, ', settled, ' settled')
+
+
+def startup(args):
+    '''Times fresh interpreters running the quick commands, and importing each command's modules on their own.'''
+
+    import time
+    import subprocess
+    runs = [[sys.executable, __file__] + command for command in STARTUP_COMMANDS]
+    runs += [[sys.executable, '-c', 'import ' + module] for module in
+             ['make_predictions', 'update_game_data', 'select_features', 'backtest']]
+    for command in runs:
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        print(' '.join(command[1:]), ': ', round(time.perf_counter() - start, 3), ' s')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='College football spread predictions.')
+    parser.add_argument('--api-key', default=None, help='cfb data api key, by default CFBD_API_KEY')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('update-cache', help='fetch and process every unsettled week into the game store')
+    command.add_argument('--restatement-weeks', type=int, default=3,
+                         help='weeks behind the latest played week that are still refetched')
+    command.add_argument('--rolling', action='store_true',
+                         help='derive windows of weeks from one stats request per week, for refilling many seasons')
+    command.set_defaults(handler=update_cache)
+
+    command = commands.add_parser('predict', help="predict the upcoming week's games and print the picks")
+    command.add_argument('--lines', action='store_true',
+                         help='only re-pull the saved slate\'s lines and rescore the games that moved')
+    command.set_defaults(handler=predict)
+
+    command = commands.add_parser('select-features', help='select model features from the game store with LASSO')
+    command.add_argument('--threshold', type=float, default=0.8, help='correlation above which a feature is pruned')
+    command.add_argument('--directory', default='CFBGameData')
+    command.add_argument('--output', default='features_for_cfb_model.dat',
+                         help='pickle the selected features here when they change; --output= to only print them')
+    command.set_defaults(handler=select_features)
+
+    command = commands.add_parser('backtest', help='walk-forward backtest of the neural net')
+    command.add_argument('--first-year', type=int, default=2016)
+    command.add_argument('--last-year', type=int, default=None)
+    command.add_argument('--workers', type=int, default=None)
+    command.add_argument('--directory', default='CFBGameData')
+    command.set_defaults(handler=backtest)
+
+    command = commands.add_parser('cache-stats', help='summarize the response cache and game store without loading them')
+    command.add_argument('--cache', default='api_cache')
+    command.add_argument('--directory', default='CFBGameData')
+    command.set_defaults(handler=cache_stats)
+
+    command = commands.add_parser('startup', help='time --help, cache-stats and each command\'s imports')
+    command.set_defaults(handler=startup)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    args.handler(args)
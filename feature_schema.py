@@ -0,0 +1,140 @@
+from collections import namedtuple
+import numpy as np
+
+# Stats reported by the /stats/season endpoint, one row per team and statName
+SEASON_STATS = ['rushingYards', 'rushingTDs', 'passAttempts', 'passingTDs', 'games', 'puntReturnTDs', 'firstDowns', 'sacks',
+                'interceptionTDs', 'kickReturnTDs', 'totalYards', 'fourthDownConversions', 'rushingAttempts', 'possessionTime',
+                'fourthDowns', 'tacklesForLoss', 'puntReturnYards', 'passCompletions', 'puntReturns', 'kickReturns',
+                'thirdDownConversions', 'fumblesRecovered', 'passesIntercepted', 'thirdDowns', 'kickReturnYards', 'interceptions',
+                'turnovers', 'penaltyYards', 'fumblesLost', 'netPassingYards', 'penalties', 'interceptionYards']
+
+
+def _advanced_paths(side):
+    play_types = {'standardDowns': ['rate', 'ppa', 'successRate', 'explosiveness'],
+                  'passingDowns': ['rate', 'ppa', 'totalPPA', 'successRate', 'explosiveness'] if side == 'defense'
+                                  else ['rate', 'ppa', 'successRate', 'explosiveness'],
+                  'rushingPlays': ['rate', 'ppa', 'totalPPA', 'successRate', 'explosiveness'],
+                  'passingPlays': ['rate', 'ppa', 'totalPPA', 'successRate', 'explosiveness']}
+    paths = [(side, name) for name in ['plays', 'drives', 'ppa', 'totalPPA', 'successRate', 'explosiveness', 'powerSuccess',
+                                       'stuffRate', 'lineYards', 'lineYardsTotal', 'secondLevelYards', 'secondLevelYardsTotal',
+                                       'openFieldYards', 'openFieldYardsTotal', 'totalOpportunies', 'pointsPerOpportunity']]
+    paths += [(side, 'fieldPosition', 'averageStart'), (side, 'fieldPosition', 'averagePredictedPoints')]
+    paths += [(side, 'havoc', name) for name in ['total', 'frontSeven', 'db']]
+    paths += [(side, play_type, name) for play_type, names in play_types.items() for name in names]
+    return paths
+
+
+# Stats reported in the offense and defense objects of the /stats/season/advanced endpoint, as paths into the row
+ADVANCED_STATS = _advanced_paths('defense') + _advanced_paths('offense')
+
+# Advanced stats that are totals, so are also reported per game and per drive
+TOTAL_STATS = [('defense', 'plays'),('defense', 'drives'),('defense', 'totalPPA'),('defense', 'lineYardsTotal'),('defense', 'secondLevelYardsTotal'),
+               ('defense', 'openFieldYardsTotal'),('defense', 'totalOpportunies'),('defense','passingDowns', 'totalPPA'),('defense','rushingPlays', 'totalPPA'),
+               ('defense', 'passingPlays', 'totalPPA'),('offense', 'plays'),('offense', 'drives'),('offense', 'totalPPA'),('offense', 'lineYardsTotal'),
+               ('offense', 'secondLevelYardsTotal'),('offense', 'openFieldYardsTotal'),('offense', 'totalOpportunies'),('offense','passingDowns', 'totalPPA'),
+               ('offense','rushingPlays', 'totalPPA'),('offense', 'passingPlays', 'totalPPA')]
+
+# One output feature. source is 'season' or 'advanced', key the statName or advanced path, and derivation one of
+# 'raw', 'per_game' (divided by games played) or 'per_drive' (divided by that side's drives).
+Feature = namedtuple('Feature', ['name', 'source', 'key', 'derivation'])
+
+
+def _build_schema():
+    schema = []
+    for name in SEASON_STATS:
+        schema.append(Feature(name, 'season', name, 'raw' if name == 'games' else 'per_game'))
+    for path in ADVANCED_STATS:
+        name = '_'.join(path)
+        if path in TOTAL_STATS:
+            schema.append(Feature(name, 'advanced', path, 'per_drive'))
+            schema.append(Feature(name, 'advanced', path, 'per_game'))
+        else:
+            schema.append(Feature(name, 'advanced', path, 'raw'))
+    return schema
+
+
+FEATURE_SCHEMA = _build_schema()
+
+_SEASON_INDEX = {name: j for j, name in enumerate(SEASON_STATS)}
+_GAMES = _SEASON_INDEX['games']
+_ADVANCED_INDEX = {path: j for j, path in enumerate(ADVANCED_STATS)}
+
+# Column positions of each derivation, and where each reads its value and divisor from
+_SEASON_RAW = np.array([i for i, f in enumerate(FEATURE_SCHEMA) if f.source == 'season' and f.derivation == 'raw'])
+_SEASON_PER_GAME = np.array([i for i, f in enumerate(FEATURE_SCHEMA) if f.source == 'season' and f.derivation == 'per_game'])
+_ADVANCED_RAW = np.array([i for i, f in enumerate(FEATURE_SCHEMA) if f.source == 'advanced' and f.derivation == 'raw'])
+_ADVANCED_PER_GAME = np.array([i for i, f in enumerate(FEATURE_SCHEMA) if f.source == 'advanced' and f.derivation == 'per_game'])
+_ADVANCED_PER_DRIVE = np.array([i for i, f in enumerate(FEATURE_SCHEMA) if f.source == 'advanced' and f.derivation == 'per_drive'])
+_SEASON_RAW_SRC = np.array([_SEASON_INDEX[FEATURE_SCHEMA[i].key] for i in _SEASON_RAW])
+_SEASON_PER_GAME_SRC = np.array([_SEASON_INDEX[FEATURE_SCHEMA[i].key] for i in _SEASON_PER_GAME])
+_ADVANCED_RAW_SRC = np.array([_ADVANCED_INDEX[FEATURE_SCHEMA[i].key] for i in _ADVANCED_RAW])
+_ADVANCED_PER_GAME_SRC = np.array([_ADVANCED_INDEX[FEATURE_SCHEMA[i].key] for i in _ADVANCED_PER_GAME])
+_ADVANCED_PER_DRIVE_SRC = np.array([_ADVANCED_INDEX[FEATURE_SCHEMA[i].key] for i in _ADVANCED_PER_DRIVE])
+_ADVANCED_DRIVES_SRC = np.array([_ADVANCED_INDEX[(FEATURE_SCHEMA[i].key[0], 'drives')] for i in _ADVANCED_PER_DRIVE])
+
+
+def feature_columns(location, suffix=''):
+    '''Returns the output column names for one team, e.g. home_defense_totalPPA_lastThree_perDrive for location 'home'
+    and suffix '_lastThree'.'''
+
+    return [location + '_' + f.name + suffix + ('_perDrive' if f.derivation == 'per_drive' else '') for f in FEATURE_SCHEMA]
+
+
+def stat_arrays(season_rows, advanced_rows):
+    '''Reads one window of /stats/season and /stats/season/advanced rows into arrays in a single pass. Returns a
+    dictionary of team to row index, a team x SEASON_STATS array and a team x ADVANCED_STATS array, with NaN for
+    missing stats.'''
+
+    teams = {}
+    for row in season_rows:
+        teams.setdefault(row['team'], len(teams))
+    for row in advanced_rows:
+        teams.setdefault(row['team'], len(teams))
+
+    season = np.full((len(teams), len(SEASON_STATS)), np.nan)
+    for row in season_rows:
+        j = _SEASON_INDEX.get(row['statName'])
+        if j is not None and row['statValue'] is not None:
+            season[teams[row['team']], j] = row['statValue']
+
+    advanced = np.full((len(teams), len(ADVANCED_STATS)), np.nan)
+    filled = set()
+    for row in advanced_rows:
+        if row['team'] in filled: # First row for a team wins
+            continue
+        filled.add(row['team'])
+        values = advanced[teams[row['team']]]
+        for j, path in enumerate(ADVANCED_STATS):
+            value = row
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is not None:
+                values[j] = value
+    return teams, season, advanced
+
+
+def derive_features(season, advanced):
+    '''Turns team x SEASON_STATS and team x ADVANCED_STATS arrays into the team x feature matrix.'''
+
+    matrix = np.empty((len(season), len(FEATURE_SCHEMA)))
+    games = season[:, _GAMES][:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix[:, _SEASON_RAW] = season[:, _SEASON_RAW_SRC]
+        matrix[:, _SEASON_PER_GAME] = season[:, _SEASON_PER_GAME_SRC] / games
+        matrix[:, _ADVANCED_RAW] = advanced[:, _ADVANCED_RAW_SRC]
+        matrix[:, _ADVANCED_PER_GAME] = advanced[:, _ADVANCED_PER_GAME_SRC] / games
+        matrix[:, _ADVANCED_PER_DRIVE] = advanced[:, _ADVANCED_PER_DRIVE_SRC] / advanced[:, _ADVANCED_DRIVES_SRC]
+    return matrix
+
+
+def extract_features(season_rows, advanced_rows):
+    '''Turns one window of /stats/season and /stats/season/advanced rows into a team x feature matrix in a single
+    pass over the responses. Returns a dictionary of team to row index and the matrix, with NaN for missing stats.'''
+
+    teams, season, advanced = stat_arrays(season_rows, advanced_rows)
+    return teams, derive_features(season, advanced)
+
+
+# Row used for teams without stats yet, such as before their first game of the season
+DEFAULT_ROW = np.zeros(len(FEATURE_SCHEMA))
+MISSING_ROW = np.full(len(FEATURE_SCHEMA), np.nan)
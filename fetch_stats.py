@@ -0,0 +1,154 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from run_stats import timer, count
+
+BASE_URL = 'https://api.collegefootballdata.com'
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+REQUEST_TIMEOUT = (10, 60) # Seconds to connect and between bytes of the response, so a stalled call can't hang a thread
+
+# One distinct call to a stats endpoint. Unused fields are None.
+StatRequest = namedtuple('StatRequest', ['endpoint', 'year', 'start_week', 'end_week', 'team'])
+
+
+def stat_request_pair(year, start_week=None, end_week=None, team=None):
+    '''Returns the (season, advanced) requests that together describe one window of team stats.'''
+
+    return (StatRequest('/stats/season', year, start_week, end_week, team),
+            StatRequest('/stats/season/advanced', year, start_week, end_week, team))
+
+
+# Site needs placeholder data that contains all the statistics for weeks without prior games
+PLACEHOLDER_PAIR = stat_request_pair(2022, end_week=5, team='Texas')
+
+
+def request_params(request):
+    '''Builds the query parameters the API expects for a StatRequest.'''
+
+    params = {'year': request.year}
+    if request.start_week is not None:
+        params['startWeek'] = request.start_week
+    if request.end_week is not None:
+        params['endWeek'] = request.end_week
+    if request.team is not None:
+        params['team'] = request.team
+    params['excludeGarbageTime'] = True
+    return params
+
+
+def iter_stat_plans(games):
+    '''Walks games in order and yields each game with the stats windows it uses, as a dictionary mapping 'current',
+    'last_three' and 'last_season' to a (season, advanced) request pair. Games are only read as they are needed, so
+    this works on a stream of games.'''
+
+    curr_week_year = (0,0)
+    current = last_three = last_season = None
+
+    for game in games:
+        year = game['year']
+        week = game['week']
+
+        old_week, old_year = curr_week_year
+        if old_year != year and year > 2013 and old_year > 0:
+            last_season = current
+        elif old_year == 0 and year > 2013:
+            last_season = stat_request_pair(year-1)
+
+        if (week,year) != curr_week_year and (year != 2014 or week != 2): # Site has an error for 2014 week 2
+            curr_week_year = (week,year)
+            if week > 1:
+                current = stat_request_pair(year, end_week=week-1)
+                last_three = stat_request_pair(year, start_week=max(week-3,1), end_week=week-1)
+            else:
+                current = PLACEHOLDER_PAIR
+                last_three = PLACEHOLDER_PAIR
+
+        yield game, dict(current=current, last_three=last_three, last_season=last_season)
+
+
+def plan_stat_requests(games):
+    '''Walks a list of games in the same order process_games does and works out which stats windows each game uses.
+    Returns the distinct requests in first-use order and a list with one plan per game. Each plan maps 'current',
+    'last_three' and 'last_season' to a (season, advanced) request pair.'''
+
+    requests_needed = {}
+    plans = []
+    for game, plan in iter_stat_plans(games):
+        for pair in plan.values():
+            if pair is not None:
+                for request in pair:
+                    requests_needed[request] = None
+        plans.append(plan)
+
+    return list(requests_needed), plans
+
+
+def make_session(headers, max_workers=8):
+    '''Returns a keep-alive session with a connection pool big enough for max_workers threads.'''
+
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_stat_request(session, request, base_url=BASE_URL, retries=3, backoff=1.0, timeout=REQUEST_TIMEOUT):
+    '''Fetches a single StatRequest, retrying with exponential backoff on connection errors, timeouts, responses cut
+    off mid-transfer and throttling or server errors. Returns the decoded JSON.'''
+
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            count('retries ' + request.endpoint)
+        try:
+            with timer('http ' + request.endpoint):
+                response = session.get(f"{base_url}{request.endpoint}", params=request_params(request), timeout=timeout)
+        except RETRY_EXCEPTIONS:
+            if attempt == retries:
+                raise
+        else:
+            count('bytes ' + request.endpoint, len(response.content))
+            if response.status_code == 200:
+                with timer('json ' + request.endpoint):
+                    return response.json()
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                print('Stats request failed: ', response.status_code, ' ', request)
+                response.raise_for_status()
+                raise requests.exceptions.HTTPError('Unexpected status %d for %s' % (response.status_code, request),
+                                                    response=response)
+        time.sleep(backoff * 2**attempt)
+
+
+def fetch_stat_requests(stat_requests, headers, max_workers=8, retries=3, backoff=1.0, base_url=BASE_URL, cache=None,
+                        timeout=REQUEST_TIMEOUT):
+    '''Fetches every StatRequest concurrently on a bounded thread pool sharing one keep-alive session. Requests found
+    in the optional ResponseCache are served from disk and fresh responses are stored in it.
+    Returns a dictionary of request to decoded JSON.'''
+
+    stat_requests = list(stat_requests)
+    responses = {}
+    if cache is not None:
+        for request in stat_requests:
+            data = cache.get(request.endpoint, request_params(request))
+            if data is not None:
+                responses[request] = data
+                count('cache hits ' + request.endpoint)
+    missing = [r for r in stat_requests if r not in responses]
+
+    def fetch(request):
+        data = fetch_stat_request(session, request, base_url, retries, backoff, timeout)
+        if cache is not None:
+            cache.put(request.endpoint, request_params(request), data)
+        return data
+
+    print('Fetching ', len(missing), ' stats responses, ', len(responses), ' found in cache')
+    if len(missing) > 0:
+        with make_session(headers, max_workers) as session:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                responses.update(zip(missing, pool.map(fetch, missing)))
+    return {r: responses[r] for r in stat_requests}
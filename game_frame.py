@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+# In-memory dtypes of the wide game frame. Every column not listed here is a stat and is held as float32, which is
+# exact for points, counts and Elo and plenty for the rates.
+CATEGORICAL_COLUMNS = ['home_team', 'away_team', 'home_conference', 'away_conference', 'neutral_site']
+INTEGER_COLUMNS = {'gid': 'int64', 'year': 'int16', 'week': 'int8'}
+STAT_DTYPE = 'float32'
+
+
+def column_dtype(name):
+    '''Returns the dtype a game frame column is held as.'''
+
+    if name in CATEGORICAL_COLUMNS:
+        return 'category'
+    return INTEGER_COLUMNS.get(name, STAT_DTYPE)
+
+
+def typed_frame(df):
+    '''Returns a game frame with its stats as float32 and year and week as small ints. The stats are converted as one
+    block rather than column by column, which is what keeps this fast on a frame this wide. The categorical columns
+    are left as they are; categorize turns them into categories once the weeks are combined.'''
+
+    stats = [c for c in df.columns if column_dtype(c) == STAT_DTYPE]
+    integers = {c: dtype for c, dtype in INTEGER_COLUMNS.items() if c in df.columns}
+    typed = pd.concat([df.drop(columns=stats).astype(integers), df[stats].astype(STAT_DTYPE)], axis=1)
+    return typed[df.columns]
+
+
+def categorize(df, columns=CATEGORICAL_COLUMNS):
+    '''Converts the team, conference and neutral site columns of a game frame to categories in place. Returns df.'''
+
+    for name in columns:
+        if name in df.columns and not isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].astype('category')
+    return df
+
+
+def games_frame(games):
+    '''Builds a typed DataFrame from a list of game dictionaries. Unlike DataFrame.from_records, which first makes a
+    float64 block of every column, each column goes straight to its dtype.'''
+
+    names = list(dict.fromkeys(key for game in games for key in game))
+    columns = {}
+    for name in names:
+        values = [game.get(name) for game in games]
+        dtype = column_dtype(name)
+        if dtype == 'category':
+            columns[name] = pd.Categorical(values)
+        elif dtype == STAT_DTYPE or any(v is None for v in values):
+            columns[name] = np.array(values, dtype=STAT_DTYPE) # None becomes NaN
+        else:
+            columns[name] = np.array(values, dtype=dtype)
+    return pd.DataFrame(columns, columns=names)
+
+
+def encode_categories(df, columns=CATEGORICAL_COLUMNS):
+    '''Replaces categorical columns with their integer codes in place, leaving the categories themselves untouched.
+    Returns df.'''
+
+    for name in columns:
+        if name in df.columns:
+            df[name] = df[name].astype('category').cat.codes
+    return df
+
+
+def scale_columns(df, columns, normalizations=None):
+    '''Z-scales columns in place. normalizations is a dictionary of column to (mean, std), as saved in
+    cfb_feature_normalizations.dat; columns missing from it are scaled by their own mean and std. Returns the
+    normalizations used.'''
+
+    normalizations = dict(normalizations or {})
+    for name in columns:
+        if name not in normalizations:
+            normalizations[name] = (float(df[name].mean()), float(df[name].std()))
+        mean, std = normalizations[name]
+        values = df[name].to_numpy(dtype=STAT_DTYPE)
+        df[name] = (values - np.float32(mean)) / np.float32(std)
+    return normalizations
+
+
+def benchmark_memory(directory='CFBGameData'):
+    '''Reports how much loading the whole game store and preparing it for feature selection adds to peak RSS, with
+    the old float64 and object layout and with the typed layout, each in a fresh interpreter.'''
+
+    import subprocess
+    import sys
+    setup = ("import time, resource; from game_store import load_games; from game_frame import encode_categories; "
+             "from sklearn.preprocessing import LabelEncoder; base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss; ")
+    snippets = {'float64 frame': ("df = load_games(directory=%r, typed=False); sel = df.copy(); "
+                                  "[sel.__setitem__(c, LabelEncoder().fit_transform(sel[c])) for c in "
+                                  "['home_conference','away_conference','home_team','away_team']]" % directory),
+                'typed frame': ("df = load_games(directory=%r); sel = encode_categories(df.copy(deep=False), "
+                                "['home_conference','away_conference','home_team','away_team'])" % directory)}
+    for name, snippet in snippets.items():
+        code = (setup + "t = time.perf_counter(); " + snippet + "; print(time.perf_counter() - t, "
+                "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base, df.memory_usage(deep=True).sum())")
+        seconds, rss, size = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                            check=True).stdout.split()[-3:]
+        print(name, ': ', round(float(seconds), 3), ' s, frame ', int(size) // 1024**2, ' MB, peak RSS increase ',
+              int(rss) // 1024, ' MB')
+
+
+if __name__ == '__main__':
+    benchmark_memory()
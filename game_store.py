@@ -0,0 +1,165 @@
+import os
+import json
+import pickle
+import hashlib
+
+from response_cache import season_is_complete
+from run_stats import count
+
+GAME_STORE = 'CFBGameData' # One Parquet file per week, in one directory per year
+MANIFEST = 'manifest.json' # Per-week watermark: content hash, game count and whether the week is settled
+
+
+def partition_path(year, week, directory=GAME_STORE):
+    '''Returns the file holding one week of games.'''
+
+    return os.path.join(directory, str(year), str(week) + '.parquet')
+
+
+def stored_partitions(directory=GAME_STORE):
+    '''Returns a dictionary of year to sorted list of weeks that have been written, without reading any game data.'''
+
+    partitions = {}
+    if not os.path.isdir(directory):
+        return partitions
+    for year in os.listdir(directory):
+        if not year.isdigit():
+            continue
+        weeks = [int(name[:-len('.parquet')]) for name in os.listdir(os.path.join(directory, year))
+                 if name.endswith('.parquet') and name[:-len('.parquet')].isdigit()]
+        if len(weeks) > 0:
+            partitions[int(year)] = sorted(weeks)
+    return partitions
+
+
+def cached_partitions(directory=GAME_STORE, legacy_pickle='CFBGameData.dat'):
+    '''Returns stored_partitions, first migrating the old pickle if the store is still empty. An empty store starts
+    from 2013 week 0.'''
+
+    partitions = stored_partitions(directory)
+    if len(partitions) == 0 and os.path.isfile(legacy_pickle):
+        migrate_pickle(legacy_pickle, directory)
+        partitions = stored_partitions(directory)
+    if len(partitions) == 0:
+        partitions = {2013:[0]}
+    return partitions
+
+
+def atomic_write(path, data):
+    '''Writes bytes to a temp file next to path and renames it into place, so a crash never leaves a partial file.'''
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_week(games, year, week, directory=GAME_STORE, previous_hash=None):
+    '''Writes one week of games, a list of game dictionaries, to its own partition. Other weeks are untouched, and
+    the partition itself is only rewritten when its content hash differs from previous_hash. Returns the hash.'''
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # The pandas metadata block is as big as the data for a week this wide and isn't needed for plain columns
+    table = pa.Table.from_pandas(pd.DataFrame.from_records(games), preserve_index=False).replace_schema_metadata(None)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    data = sink.getvalue().to_pybytes()
+    digest = hashlib.sha256(data).hexdigest()
+    path = partition_path(year, week, directory)
+    if digest != previous_hash or not os.path.isfile(path):
+        atomic_write(path, data)
+        count('bytes written', len(data))
+    return digest
+
+
+def load_manifest(directory=GAME_STORE):
+    '''Returns the week watermarks as {year: {week: {'hash', 'games', 'settled'}}}. Stores written before the manifest
+    existed get one built from their partitions, with every week of a completed season counted as settled.'''
+
+    path = os.path.join(directory, MANIFEST)
+    if os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        return {int(year): {int(week): entry for week, entry in weeks.items()} for year, weeks in manifest.items()}
+    return {year: {week: dict(hash=None, games=None, settled=season_is_complete(year)) for week in weeks}
+            for year, weeks in stored_partitions(directory).items()}
+
+
+def save_manifest(manifest, directory=GAME_STORE):
+    '''Atomically rewrites the manifest.'''
+
+    data = json.dumps({str(year): {str(week): entry for week, entry in sorted(weeks.items())}
+                       for year, weeks in sorted(manifest.items())}, indent=1)
+    atomic_write(os.path.join(directory, MANIFEST), data.encode())
+
+
+def week_is_settled(manifest, year, week):
+    '''Returns True if a stored week is final and never needs reprocessing.'''
+
+    return manifest.get(year, {}).get(week, {}).get('settled', False)
+
+
+def first_unsettled_year(manifest, current_year, first_year=2013):
+    '''Returns the earliest season that still has weeks that may change, which is where an update has to start.'''
+
+    if len(manifest) == 0:
+        return first_year
+    unsettled = [year for year, weeks in manifest.items() if not all(entry['settled'] for entry in weeks.values())]
+    if len(unsettled) > 0:
+        return min(unsettled)
+    return min(max(manifest.keys()) + 1, current_year)
+
+
+def load_games(columns=None, years=None, weeks=None, directory=GAME_STORE, typed=True):
+    '''Loads stored games into one DataFrame. Only the listed columns are read from disk, along with year and week.
+    years and weeks optionally restrict which partitions are read. With typed, each week is converted to the
+    game_frame dtypes as it is read, so the float64 copy of the whole store never exists.'''
+
+    # pandas and pyarrow are only loaded once games are, so manifest and partition lookups stay cheap
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from game_frame import typed_frame, categorize
+    if columns is not None:
+        columns = list(dict.fromkeys(['year', 'week', *columns]))
+    frames = []
+    for year, stored_weeks in sorted(stored_partitions(directory).items()):
+        if years is not None and year not in years:
+            continue
+        for week in stored_weeks:
+            if weeks is not None and week not in weeks:
+                continue
+            partition = pq.ParquetFile(partition_path(year, week, directory))
+            if columns is not None:
+                # Partitions written before a stat existed won't have its column
+                names = partition.schema_arrow.names
+                frame = partition.read(columns=[c for c in columns if c in names]).to_pandas()
+            else:
+                frame = partition.read().to_pandas()
+            if typed:
+                frame = typed_frame(frame)
+            if len(frame) > 0:
+                frames.append(frame)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    del frames
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    return categorize(df) if typed else df # Categories are made after the concat so every week shares them
+
+
+def migrate_pickle(pickle_path='CFBGameData.dat', directory=GAME_STORE):
+    '''Converts the old nested {year: {week: {gid: {stat: value}}}} pickle into the partitioned store.'''
+
+    with open(pickle_path, 'rb') as f:
+        cached_games = pickle.load(f)
+    for year in cached_games.keys():
+        for week in cached_games[year].keys():
+            games = [dict(gid=gid, **game) for gid, game in cached_games[year][week].items()]
+            save_week(games, year, week, directory)
+    print('Migrated ', pickle_path, ' to ', directory)
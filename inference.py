@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# Columns make_predictions.py leaves unscaled
+EXCLUDED = ['gid','year','home_team','away_team', 'home_points','margin', 'away_points','home_wins','home_interceptions','away_interceptions','home_interceptionYards','away_interceptionYards','home_fumblesLost','away_fumblesLost','home_fumblesRecovered','away_fumblesRecovered','home_interceptions_lastSeason','away_interceptions_lastSeason','home_interceptionYards_lastSeason','away_interceptionYards_lastSeason','home_fumblesLost_lastSeason','away_fumblesLost_lastSeason','home_fumblesRecovered_lastSeason','away_fumblesRecovered_lastSeason','home_interceptions_lastThree','away_interceptions_lastThree','home_interceptionYards_lastThree','away_interceptionYards_lastThree','home_fumblesLost_lastThree','away_fumblesLost_lastThree','home_fumblesRecovered_lastThree','away_fumblesRecovered_lastThree']
+# spread included
+CAT_FEATURES = ['home_conference','away_conference','neutral_site']
+
+RESULT_DTYPE = [('home_team', 'U64'), ('away_team', 'U64'), ('predicted', 'f4'), ('spread', 'f4'), ('edge', 'f4')]
+
+
+def normalization_arrays(normalizations, columns, excluded=()):
+    '''Turns the normalizations dictionary of column to (mean, std) into mean and std arrays aligned with columns.
+    Columns in excluded are left unscaled.'''
+
+    means = np.array([0. if c in excluded else normalizations[c][0] for c in columns], dtype=np.float32)
+    stds = np.array([1. if c in excluded else normalizations[c][1] for c in columns], dtype=np.float32)
+    return means, stds
+
+
+def build_results(df, predicted):
+    '''Packs predicted margins for a DataFrame of games into a structured array with home_team, away_team, the
+    predicted margin, the spread and the edge of the prediction over the spread.'''
+
+    results = np.empty(len(df), dtype=RESULT_DTYPE)
+    results['home_team'] = df['home_team'].to_numpy()
+    results['away_team'] = df['away_team'].to_numpy()
+    results['predicted'] = predicted
+    results['spread'] = df['spread'].to_numpy(dtype=np.float32) if 'spread' in df else np.nan
+    results['edge'] = results['predicted'] - results['spread']
+    return results
+
+
+def encode_games(df, cat_names, vocabs, cont_names, means, stds):
+    '''Returns the categorical codes and scaled continuous values for a DataFrame of games as arrays. Unknown
+    categories get code 0, fastai's #na# category.'''
+
+    x_cat = np.zeros((len(df), len(cat_names)), dtype=np.int64)
+    for j, name in enumerate(cat_names):
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Look up each category once and index by the codes, missing values (code -1) landing on #na#
+            lookup = np.array([vocabs[name].get(c, 0) for c in column.cat.categories] + [0], dtype=np.int64)
+            x_cat[:, j] = lookup[column.cat.codes.to_numpy()]
+        else:
+            x_cat[:, j] = column.map(vocabs[name]).fillna(0).to_numpy(dtype=np.int64)
+    x_cont = (df[cont_names].to_numpy(dtype=np.float32) - means) / stds
+    return x_cat, x_cont
+
+
+class TabularPredictor:
+    '''Scores games with a trained fastai tabular learner without going through its DataLoaders. The z-scaling from
+    cfb_feature_normalizations.dat and the learner's own Normalize step are folded into one mean and std per
+    continuous column, categorical columns are encoded with the learner's vocabularies, and the model runs on a
+    single tensor batch.'''
+
+    def __init__(self, learn, normalizations, excluded=()):
+        self.model = learn.model.eval().cpu()
+        self.cat_names = list(learn.dls.cat_names)
+        self.cont_names = list(learn.dls.cont_names)
+        self.vocabs = {name: learn.dls.classes[name].o2i for name in self.cat_names}
+        normalize = next(p for p in learn.dls.train_ds.procs.fs if hasattr(p, 'means') and hasattr(p, 'stds'))
+        means, stds = normalization_arrays(normalizations, self.cont_names, excluded)
+        learner_means = np.array([normalize.means[c] for c in self.cont_names], dtype=np.float32)
+        learner_stds = np.array([normalize.stds[c] for c in self.cont_names], dtype=np.float32)
+        # ((x - m1)/s1 - m2)/s2 == (x - (m1 + m2*s1)) / (s1*s2)
+        self.means = means + learner_means * stds
+        self.stds = stds * learner_stds
+
+    def encode(self, df):
+        '''Returns the categorical codes and scaled continuous values for a DataFrame of games as arrays.'''
+
+        return encode_games(df, self.cat_names, self.vocabs, self.cont_names, self.means, self.stds)
+
+    def predict_margins(self, x_cat, x_cont):
+        '''Runs the model on encoded arrays and returns the predicted away minus home margin for each game.'''
+
+        import torch # Deferred so slim predictors can share this module without loading torch
+        with torch.inference_mode():
+            out = self.model(torch.from_numpy(x_cat), torch.from_numpy(np.ascontiguousarray(x_cont)))
+        return out.numpy().ravel()
+
+    def predict(self, df):
+        '''Scores a DataFrame of unscaled games. Returns a structured array with home_team, away_team, the predicted
+        margin, the spread and the edge of the prediction over the spread.'''
+
+        return build_results(df, self.predict_margins(*self.encode(df)))
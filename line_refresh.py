@@ -0,0 +1,96 @@
+import pickle
+import numpy as np
+import pandas as pd
+from inference import build_results, EXCLUDED, CAT_FEATURES
+from run_stats import run, timer, count
+
+SLATE = 'upcoming_slate.parquet' # The last predicted week's assembled games, with their predicted margins
+
+
+def save_slate(df, results, path=SLATE):
+    '''Keeps the upcoming week's assembled game rows and their predicted margins, so a moved line can be picked up
+    without gathering and processing the week again.'''
+
+    slate = df.copy(deep=False)
+    slate['predicted'] = results['predicted']
+    slate.to_parquet(path)
+
+
+def load_slate(path=SLATE):
+    return pd.read_parquet(path)
+
+
+def fetch_lines(configuration, year, week):
+    '''Pulls the current betting lines for one week. This skips the response cache on purpose: a line refresh wants
+    the line as it is now, not as it was when the cache entry was stored.'''
+
+    import cfbd
+    betting_api = cfbd.BettingApi(cfbd.ApiClient(configuration))
+    with timer('api /lines'):
+        return betting_api.get_lines(year=year, week=week)
+
+
+def patch_spreads(slate, lines, provider_priority=('consensus',)):
+    '''Sets the spread column of slate from fresh lines, matched on home and away team. Games without a usable line
+    keep their spread. Returns a boolean array of the games whose spread moved.'''
+
+    from update_game_data import select_spread
+    spreads = {}
+    for game_lines in lines:
+        spreads.setdefault((game_lines.home_team, game_lines.away_team), select_spread(game_lines, provider_priority))
+    new = np.array([spreads.get(teams) for teams in zip(slate['home_team'], slate['away_team'])], dtype=np.float32)
+    old = slate['spread'].to_numpy(dtype=np.float32) if 'spread' in slate else np.full(len(slate), np.nan, dtype=np.float32)
+    new = np.where(np.isnan(new), old, new)
+    moved = ~((new == old) | (np.isnan(new) & np.isnan(old)))
+    slate['spread'] = new
+    return moved
+
+
+def rescore(slate, moved, cont_features, score_local=None):
+    '''Updates the predicted margins of the games whose spread moved and returns results for the whole slate. The
+    model only runs, on just those games, when spread is one of its inputs; otherwise a moved line only changes the
+    edge. Games go to a running scoring service first, then to score_local, a function of a DataFrame of games.'''
+
+    if 'spread' in cont_features and moved.any():
+        from scoring_service import score_remote
+        games = slate[moved].drop(columns='predicted')
+        results = score_remote(games.to_dict('records'))
+        if results is None:
+            results = score_local(games)
+        slate.loc[moved, 'predicted'] = results['predicted']
+        count('games rescored', int(moved.sum()))
+    return build_results(slate, slate['predicted'].to_numpy(dtype=np.float32))
+
+
+def refresh_lines(configuration, path=SLATE, provider_priority=('consensus',)):
+    '''Line-refresh mode of make_predictions.py: one /lines request for the saved slate's week, the spread column
+    patched in place and only the games whose line moved rescored. Prints the moved games and saves the slate.'''
+
+    with run('refresh_lines'):
+        slate = load_slate(path)
+        year, week = int(slate['year'].iloc[0]), int(slate['week'].iloc[0])
+        with open('features_for_cfb_model.dat', 'rb') as f:
+            selected_features = pickle.load(f)
+        cont_features = [c for c in selected_features if c not in CAT_FEATURES and c not in EXCLUDED]
+
+        lines = fetch_lines(configuration, year, week)
+        with timer('patch spreads'):
+            moved = patch_spreads(slate, lines, provider_priority)
+
+        def score_local(games):
+            from scoring_service import load_predictor
+            with open('cfb_feature_normalizations.dat', 'rb') as f:
+                normalizations = pickle.load(f)
+            return load_predictor(normalizations, EXCLUDED).predict(games)
+
+        with timer('rescore'):
+            results = rescore(slate, moved, cont_features, score_local)
+        slate.to_parquet(path)
+        count('lines moved', int(moved.sum()))
+
+        print(int(moved.sum()), ' of ', len(slate), ' lines moved for week ', week, ', ', year)
+        for hometeam, awayteam, prediction, spread, edge in results[moved]:
+            pick = ' (pick)' if abs(edge) > 3 else '' # Same cutoff as make_predictions.py
+            print(awayteam + ' at ' + hometeam + ': spread ' + str(round(float(spread), 1)) + ', predicted ' +
+                  str(round(float(prediction), 2)) + ', edge ' + str(round(float(edge), 2)) + pick)
+        return results
@@ -0,0 +1,159 @@
+import json
+import numpy as np
+from inference import build_results, encode_games
+
+MODEL_ARTIFACT = 'neural_net_for_spread_cfb.npz'
+ARTIFACT_VERSION = 1
+
+
+def _to_json_value(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def export_model(learn, normalizations, selected_features, excluded=(), path=MODEL_ARTIFACT):
+    '''Saves only what inference needs from a fastai tabular learner: the layer weights with batch norm folded into
+    a scale and shift, the embedding vocabularies, the feature order and the combined normalization vectors.
+    Everything goes in one .npz file with a JSON header.'''
+
+    from inference import TabularPredictor # Reuses its folding of the two normalization steps
+
+    predictor = TabularPredictor(learn, normalizations, excluded)
+    model = predictor.model
+    arrays = {'cont_means': predictor.means, 'cont_stds': predictor.stds}
+    for j, embed in enumerate(model.embeds):
+        arrays['embed_%d' % j] = embed.weight.detach().numpy()
+    if model.bn_cont is not None:
+        arrays['bn_cont_scale'], arrays['bn_cont_shift'] = _fold_batchnorm(model.bn_cont)
+
+    ops = []
+    for module in _leaf_modules(model.layers):
+        kind = type(module).__name__
+        i = len(ops)
+        if kind == 'Linear':
+            arrays['op_%d_weight' % i] = module.weight.detach().numpy().T
+            arrays['op_%d_bias' % i] = (module.bias.detach().numpy() if module.bias is not None
+                                        else np.zeros(module.out_features, dtype=np.float32))
+            ops.append('linear')
+        elif kind == 'BatchNorm1d':
+            arrays['op_%d_scale' % i], arrays['op_%d_shift' % i] = _fold_batchnorm(module)
+            ops.append('batchnorm')
+        elif kind == 'ReLU':
+            ops.append('relu')
+        elif kind == 'SigmoidRange':
+            arrays['op_%d_range' % i] = np.array([module.low, module.high], dtype=np.float32)
+            ops.append('sigmoid_range')
+        elif kind != 'Dropout': # Dropout does nothing at inference
+            raise ValueError('Cannot export layer type ' + kind)
+
+    header = dict(version=ARTIFACT_VERSION, ops=ops, cat_names=predictor.cat_names, cont_names=predictor.cont_names,
+                  vocabs={name: [_to_json_value(v) for v in learn.dls.classes[name]] for name in predictor.cat_names},
+                  selected_features=list(selected_features), excluded=list(excluded))
+    arrays = {name: np.asarray(value, dtype=np.float32) for name, value in arrays.items()}
+    np.savez(path, header=np.array(json.dumps(header)), **arrays)
+    print('Exported model to ', path)
+
+
+def _leaf_modules(module):
+    '''Yields the leaf layers of a module in execution order. Unlike Module.modules this repeats shared layers, as
+    fastai reuses one activation instance across all its blocks.'''
+
+    children = list(module.children())
+    if len(children) == 0:
+        yield module
+    for child in children:
+        yield from _leaf_modules(child)
+
+
+def _fold_batchnorm(bn):
+    '''Returns the scale and shift equivalent to a batch norm layer in eval mode.'''
+
+    scale = bn.weight.detach().numpy() / np.sqrt(bn.running_var.detach().numpy() + bn.eps)
+    shift = bn.bias.detach().numpy() - bn.running_mean.detach().numpy() * scale
+    return scale, shift
+
+
+class SlimPredictor:
+    '''Runs an exported tabular model with NumPy alone, so neither fastai nor torch has to be imported.
+    Has the same predict interface as inference.TabularPredictor.'''
+
+    def __init__(self, path=MODEL_ARTIFACT):
+        with np.load(path) as artifact:
+            header = json.loads(str(artifact['header']))
+            if header['version'] != ARTIFACT_VERSION:
+                raise ValueError('Model artifact version %s is not supported' % header['version'])
+            arrays = {name: artifact[name] for name in artifact.files if name != 'header'}
+        self.ops = header['ops']
+        self.cat_names = header['cat_names']
+        self.cont_names = header['cont_names']
+        self.selected_features = header['selected_features']
+        self.vocabs = {name: {value: i for i, value in enumerate(values)} for name, values in header['vocabs'].items()}
+        self.means = arrays['cont_means']
+        self.stds = arrays['cont_stds']
+        self.embeds = [arrays['embed_%d' % j] for j in range(len(self.cat_names))]
+        self.bn_cont = (arrays['bn_cont_scale'], arrays['bn_cont_shift']) if 'bn_cont_scale' in arrays else None
+        self.arrays = arrays
+
+    def encode(self, df):
+        '''Returns the categorical codes and scaled continuous values for a DataFrame of games as arrays.'''
+
+        return encode_games(df, self.cat_names, self.vocabs, self.cont_names, self.means, self.stds)
+
+    def predict_margins(self, x_cat, x_cont):
+        '''Runs the model on encoded arrays and returns the predicted away minus home margin for each game.'''
+
+        if self.bn_cont is not None:
+            x_cont = x_cont * self.bn_cont[0] + self.bn_cont[1]
+        x = np.concatenate([embed[x_cat[:, j]] for j, embed in enumerate(self.embeds)] + [x_cont], axis=1)
+        for i, op in enumerate(self.ops):
+            if op == 'linear':
+                x = x @ self.arrays['op_%d_weight' % i] + self.arrays['op_%d_bias' % i]
+            elif op == 'batchnorm':
+                x = x * self.arrays['op_%d_scale' % i] + self.arrays['op_%d_shift' % i]
+            elif op == 'relu':
+                x = np.maximum(x, 0)
+            elif op == 'sigmoid_range':
+                low, high = self.arrays['op_%d_range' % i]
+                x = low + (high - low) / (1 + np.exp(-x))
+        return x.ravel()
+
+    def predict(self, df):
+        '''Scores a DataFrame of unscaled games. Returns a structured array with home_team, away_team, the predicted
+        margin, the spread and the edge of the prediction over the spread.'''
+
+        return build_results(df, self.predict_margins(*self.encode(df)))
+
+
+def load_model(path=MODEL_ARTIFACT):
+    '''Loads an exported model for inference.'''
+
+    return SlimPredictor(path)
+
+
+def benchmark_cold_start():
+    '''Times a fresh interpreter loading the pickled learner and the slim artifact, and reports their peak RSS.'''
+
+    import subprocess
+    import sys
+    snippets = {'pickled learner': "import pickle; pickle.load(open('neural_net_for_spread_cfb.dat','rb'))",
+                'slim artifact': "from model_artifact import load_model; load_model()"}
+    for name, snippet in snippets.items():
+        code = ("import time, resource; t = time.perf_counter(); " + snippet +
+                "; print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+        seconds, rss = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()[-2:]
+        print(name, ': ', round(float(seconds), 3), ' s, peak RSS ', int(rss) // 1024, ' MB')
+
+
+if __name__ == '__main__':
+    import sys
+    import pickle
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark_cold_start()
+    else:
+        from inference import EXCLUDED
+        with open('neural_net_for_spread_cfb.dat','rb') as f:
+            learn = pickle.load(f)
+        with open('features_for_cfb_model.dat','rb') as f:
+            selected_features = pickle.load(f)
+        with open("cfb_feature_normalizations.dat",'rb') as f:
+            normalizations = pickle.load(f)
+        export_model(learn, normalizations, selected_features, EXCLUDED)
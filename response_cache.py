@@ -0,0 +1,135 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+from datetime import datetime
+
+from run_stats import timer, count
+
+
+def season_is_complete(year, now=None):
+    '''Returns True once a season's data has stopped changing. Bowl games run into January and the site keeps
+    updating stats for a few weeks after games, so a season only counts as complete from March of the next year.'''
+
+    now = now or datetime.now()
+    return year < now.year - 1 or (year == now.year - 1 and now.month > 2)
+
+
+def normalize_params(params):
+    '''Returns the params as a sorted list of string pairs so equivalent queries share a cache key.'''
+
+    return sorted((str(key), json.dumps(value) if isinstance(value, bool) else str(value))
+                  for key, value in params.items() if value is not None)
+
+
+class ResponseCache:
+    '''Content-addressed on-disk cache of raw API JSON, keyed by endpoint plus normalized params. Responses for
+    completed seasons never expire; responses for the current season expire after ttl seconds. Once the cache
+    grows past max_bytes the least recently used entries are evicted.'''
+
+    def __init__(self, directory='api_cache', ttl=6*60*60, max_bytes=1024**3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {}
+        self._total = 0
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.json.gz'):
+                    path = os.path.join(root, name)
+                    self._sizes[path] = os.path.getsize(path)
+                    self._total += self._sizes[path]
+
+    def key(self, endpoint, params):
+        '''Returns the content address for an endpoint and its params.'''
+
+        raw = json.dumps([endpoint, normalize_params(params)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def _expired(self, params, stored):
+        year = params.get('year')
+        if year is not None and season_is_complete(int(year)):
+            return False
+        return time.time() - stored > self.ttl
+
+    def get(self, endpoint, params):
+        '''Returns the cached JSON for a request, or None on a miss or an expired entry.'''
+
+        path = self._path(self.key(endpoint, params))
+        try:
+            with gzip.open(path, 'rt') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or self._expired(params, entry['stored']):
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path) # Access time drives eviction order
+        with self._lock:
+            self.hits += 1
+        return entry['data']
+
+    def put(self, endpoint, params, data):
+        '''Stores the JSON for a request, writing to a temp file first so readers never see a partial entry.'''
+
+        path = self._path(self.key(endpoint, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump({'endpoint': endpoint, 'params': normalize_params(params), 'stored': time.time(), 'data': data}, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total += os.path.getsize(path) - self._sizes.get(path, 0)
+            self._sizes[path] = os.path.getsize(path)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        '''Drops least recently used entries until the cache is back under max_bytes. Caller holds the lock.'''
+
+        by_age = sorted(self._sizes, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in by_age:
+            if self._total <= self.max_bytes:
+                break
+            self._total -= self._sizes.pop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def stats(self):
+        '''Returns hit, miss and eviction counts plus the current size of the cache.'''
+
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        entries=len(self._sizes), bytes=self._total)
+
+
+def cached_api_call(cache, api_client, method, endpoint, response_type, **params):
+    '''Calls a cfbd API method through the response cache. The raw JSON is stored on a miss and deserialized back
+    into cfbd models on a hit, so callers get the same objects either way.'''
+
+    if cache is None:
+        with timer('api ' + endpoint):
+            return method(**params)
+    data = cache.get(endpoint, params)
+    if data is not None:
+        count('cache hits ' + endpoint)
+        return api_client.deserialize(SimpleNamespace(data=json.dumps(data)), response_type)
+    with timer('api ' + endpoint):
+        result = method(**params)
+    cache.put(endpoint, params, api_client.sanitize_for_serialization(result))
+    return result
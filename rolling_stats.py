@@ -0,0 +1,143 @@
+import numpy as np
+from fetch_stats import stat_request_pair
+from feature_schema import SEASON_STATS, ADVANCED_STATS, TOTAL_STATS, FEATURE_SCHEMA, stat_arrays, derive_features
+
+PLAY_TYPES = ['standardDowns', 'passingDowns', 'rushingPlays', 'passingPlays']
+RUSHING_RATES = ['powerSuccess', 'stuffRate', 'lineYards', 'secondLevelYards', 'openFieldYards']
+
+_ADVANCED_INDEX = {path: j for j, path in enumerate(ADVANCED_STATS)}
+_ADDITIVE = np.array([path in TOTAL_STATS for path in ADVANCED_STATS]) # Totals add across weeks, rates are averaged
+
+
+def _weights(advanced):
+    '''Returns what each advanced rate is an average over, for a team x ADVANCED_STATS array of one week: plays for
+    per play rates, the play type's share of plays for play type rates, successful plays for explosiveness, drives
+    for field position and scoring opportunities for points per opportunity. Rushing line stats are weighted by
+    rushing plays, which the API doesn't report directly, so their windows are close to the API's but not exact.
+    Totals get a weight of 1 and are summed instead.'''
+
+    def column(*path):
+        return advanced[:, _ADVANCED_INDEX[path]]
+
+    weights = np.ones_like(advanced)
+    for j, path in enumerate(ADVANCED_STATS):
+        if _ADDITIVE[j]:
+            continue
+        side, name = path[0], path[1]
+        plays = column(side, 'plays')
+        if name in PLAY_TYPES:
+            type_plays = column(side, name, 'rate') * plays
+            if path[2] == 'rate':
+                weights[:, j] = plays
+            elif path[2] == 'explosiveness':
+                weights[:, j] = type_plays * column(side, name, 'successRate')
+            else:
+                weights[:, j] = type_plays
+        elif name == 'fieldPosition':
+            weights[:, j] = column(side, 'drives')
+        elif name == 'pointsPerOpportunity':
+            weights[:, j] = column(side, 'totalOpportunies')
+        elif name == 'explosiveness':
+            weights[:, j] = plays * column(side, 'successRate')
+        elif name in RUSHING_RATES:
+            weights[:, j] = column(side, 'rushingPlays', 'rate') * plays
+        else:
+            weights[:, j] = plays
+    return weights
+
+
+class RollingStats:
+    '''Per-team, per-week stat increments for one season, kept as running totals so the stats for any window of weeks
+    are one difference of two cumulative sums. Season stats are counts and add across weeks. Advanced totals add too;
+    advanced rates are stored multiplied by what they're averaged over (see _weights), and divided back out for a
+    window. Weeks can be added all at once or one at a time as they arrive.'''
+
+    def __init__(self, weekly=None):
+        '''weekly is an optional dictionary of week to that week's (/stats/season rows, /stats/season/advanced rows).'''
+
+        self.teams = {}
+        self.last_week = 0
+        # Week 0 holds zeros, so week w's running total minus week s-1's is the window s..w
+        self.played = np.zeros((1, 0))
+        self.season = np.zeros((1, 0, len(SEASON_STATS)))
+        self.season_seen = np.zeros((1, 0, len(SEASON_STATS)))
+        self.advanced = np.zeros((1, 0, len(ADVANCED_STATS)))
+        self.advanced_weight = np.zeros((1, 0, len(ADVANCED_STATS)))
+        for week in sorted(weekly or {}):
+            self.add_week(week, *weekly[week])
+
+    def add_week(self, week, season_rows, advanced_rows):
+        '''Adds one week's /stats/season and /stats/season/advanced rows. Weeks are added in order; weeks skipped over
+        count as no games.'''
+
+        if week < 1:
+            return
+        if week <= self.last_week:
+            raise ValueError('Week %d added after week %d' % (week, self.last_week))
+        teams, season, advanced = stat_arrays(season_rows, advanced_rows)
+        for team in teams:
+            self.teams.setdefault(team, len(self.teams))
+
+        # Extend the running totals to this week, and to any new teams, carrying the last totals forward
+        new_weeks, new_teams = week - self.last_week, len(self.teams) - self.played.shape[1]
+        for name in ['played', 'season', 'season_seen', 'advanced', 'advanced_weight']:
+            totals = getattr(self, name)
+            if new_teams > 0:
+                totals = np.concatenate([totals, np.zeros((len(totals), new_teams) + totals.shape[2:])], axis=1)
+            totals = np.concatenate([totals, np.repeat(totals[-1:], new_weeks, axis=0)])
+            setattr(self, name, totals)
+        self.last_week = week
+
+        rows = np.array([self.teams[team] for team in teams], dtype=np.int64)
+        weights = _weights(advanced)
+        weighted = np.where(_ADDITIVE, advanced, advanced * weights)
+        usable = ~np.isnan(weighted) & ~np.isnan(weights)
+        self.played[week, rows] += 1
+        self.season[week, rows] += np.nan_to_num(season)
+        self.season_seen[week, rows] += ~np.isnan(season)
+        self.advanced[week, rows] += np.where(usable, weighted, 0)
+        self.advanced_weight[week, rows] += np.where(usable, weights, 0)
+
+    def window(self, start_week, end_week):
+        '''Returns the stats for weeks start_week through end_week in the form extract_features does: a dictionary of
+        team to row index and the team x feature matrix. Only teams that played in the window are included.'''
+
+        end = min(end_week, self.last_week)
+        start = max(start_week, 1) - 1
+        if end <= start:
+            return {}, np.empty((0, len(FEATURE_SCHEMA)))
+        played = self.played[end] - self.played[start] > 0
+        rows = np.flatnonzero(played)
+        season = self.season[end, rows] - self.season[start, rows]
+        season[self.season_seen[end, rows] - self.season_seen[start, rows] == 0] = np.nan
+        advanced = self.advanced[end, rows] - self.advanced[start, rows]
+        weight = self.advanced_weight[end, rows] - self.advanced_weight[start, rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            advanced = np.where(_ADDITIVE, advanced, advanced / weight)
+        advanced[weight == 0] = np.nan
+        names = list(self.teams)
+        return {names[row]: i for i, row in enumerate(rows)}, derive_features(season, advanced)
+
+    def last_n(self, week, n):
+        '''Returns the stats for the n weeks before week, as window does.'''
+
+        return self.window(max(week - n, 1), week - 1)
+
+
+def is_rolling_pair(pair):
+    '''Returns True if a (season, advanced) request pair is a league-wide window of weeks, so it can be derived from
+    weekly increments instead of being requested.'''
+
+    return pair[0].team is None and pair[0].end_week is not None
+
+
+def plan_increments(pairs):
+    '''Returns the single-week request pairs needed to derive every rolling window among a collection of stats request
+    pairs, as a dictionary of year to {week: pair}.'''
+
+    last_weeks = {}
+    for pair in pairs:
+        if pair is not None and is_rolling_pair(pair):
+            last_weeks[pair[0].year] = max(last_weeks.get(pair[0].year, 0), pair[0].end_week)
+    return {year: {week: stat_request_pair(year, start_week=week, end_week=week) for week in range(1, last_week + 1)}
+            for year, last_week in last_weeks.items()}
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import functools
+import importlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+RUN_LOG = 'run_stats.jsonl' # One JSON line per finished run
+PROFILE_ENV = 'CFB_PROFILE' # 'cprofile' or 'sample' to profile whole runs
+
+
+class RunStats:
+    '''Timers, counters and values collected over one run. Safe to update from the fetch threads.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {} # Name to [calls, seconds]
+            self.counters = {}
+            self.values = {}
+
+    @contextmanager
+    def timer(self, name):
+        '''Times the enclosed block, adding it to the named timer.'''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                entry = self.timers.setdefault(name, [0, 0.])
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, value):
+        '''Stores a JSON-serializable value, such as the response cache stats, replacing any earlier one.'''
+
+        with self._lock:
+            self.values[name] = value
+
+    def summary(self):
+        with self._lock:
+            return dict(timers={name: dict(calls=calls, seconds=round(seconds, 6)) for name, (calls, seconds) in self.timers.items()},
+                        counters=dict(self.counters), values=dict(self.values))
+
+
+STATS = RunStats()
+_active_run = None
+_imports = {} # Module name to seconds its first import took, kept across runs
+
+
+def timed_import(name):
+    '''Imports a module by name, noting how long the first import took. Every run logs the imports timed so far in
+    the process, so the cost of loading heavy libraries shows up next to the stage timings.'''
+
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    _imports[name] = round(time.perf_counter() - start, 6)
+    return module
+
+
+def timer(name):
+    return STATS.timer(name)
+
+
+def count(name, n=1):
+    STATS.count(name, n)
+
+
+def record(name, value):
+    STATS.record(name, value)
+
+
+@contextmanager
+def run(name, log_path=RUN_LOG, profile=None):
+    '''Marks the enclosed block as one run. The counters start from zero, and on exit the run's summary is appended to
+    log_path as one JSON line so runs can be compared. A run started inside another is only timed as a stage of the
+    outer one. profile, or the CFB_PROFILE environment variable, is 'cprofile' to save a cProfile dump to
+    <name>.prof or 'sample' to save a pyinstrument report to <name>.html.'''
+
+    global _active_run
+    if _active_run is not None:
+        with timer(name):
+            yield
+        return
+
+    _active_run = name
+    STATS.reset()
+    profiler = _start_profiler(profile or os.environ.get(PROFILE_ENV))
+    started = datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        seconds = time.perf_counter() - start
+        _active_run = None
+        if profiler is not None:
+            _stop_profiler(profiler, name)
+        entry = dict(run=name, started=started, seconds=round(seconds, 6), failed=failed, imports=dict(_imports), **STATS.summary())
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        print('Run stats for ', name, ' written to ', log_path)
+
+
+def recorded_run(name):
+    '''Decorator that makes each call of a function a run, as run(name) does.'''
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with run(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _start_profiler(kind):
+    if not kind:
+        return None
+    if kind == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif kind == 'sample':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print('pyinstrument is needed for sampling profiles: pip install pyinstrument')
+            return None
+        profiler = Profiler()
+        profiler.start()
+    else:
+        raise ValueError('Unknown profiler ' + kind)
+    return profiler
+
+
+def _stop_profiler(profiler, name):
+    if hasattr(profiler, 'dump_stats'):
+        profiler.disable()
+        profiler.dump_stats(name + '.prof')
+        print('cProfile dump written to ', name + '.prof')
+    else:
+        profiler.stop()
+        with open(name + '.html', 'w') as f:
+            f.write(profiler.output_html())
+        print('Sampling profile written to ', name + '.html')
+
+
+def compare_runs(name, log_path=RUN_LOG):
+    '''Prints each timer and timed import of the last two runs with the given name side by side.'''
+
+    with open(log_path) as f:
+        runs = [entry for entry in map(json.loads, f) if entry['run'] == name]
+    if len(runs) < 2:
+        print('Need two runs of ', name, ' to compare')
+        return
+    before, after = runs[-2], runs[-1]
+    print('total', before['seconds'], after['seconds'])
+    for timer_name in sorted(set(before['timers']) | set(after['timers'])):
+        print(timer_name, before['timers'].get(timer_name, {}).get('seconds'), after['timers'].get(timer_name, {}).get('seconds'))
+    for module in sorted(set(before.get('imports', {})) | set(after.get('imports', {}))):
+        print('import ' + module, before.get('imports', {}).get(module), after.get('imports', {}).get(module))
+
+
+if __name__ == '__main__':
+    compare_runs(sys.argv[1] if len(sys.argv) > 1 else 'gather_game_data')
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import pickle
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from inference import TabularPredictor, EXCLUDED, RESULT_DTYPE, normalization_arrays
+from model_artifact import load_model, MODEL_ARTIFACT
+
+SERVICE_PORT = 8765
+SERVICE_URL = 'http://127.0.0.1:%d' % SERVICE_PORT
+NEURAL_NET = 'neural_net_for_spread_cfb.dat'
+XGBOOST_MODEL = 'XGBoost_for_spread_cfb.dat'
+EDGE_THRESHOLD = 3. # Points the net has to differ from the spread by
+COVER_BAND = (0.45, 0.55) # XGBoost has to be outside this band to agree with the net
+
+ENSEMBLE_DTYPE = RESULT_DTYPE + [('cover_prob', 'f4'), ('pick', 'i1')]
+
+
+def load_predictor(normalizations, excluded=EXCLUDED):
+    '''Loads the neural net, preferring the slim export when it exists so fastai doesn't need to be imported.'''
+
+    if os.path.isfile(MODEL_ARTIFACT):
+        return load_model(MODEL_ARTIFACT)
+    with open(NEURAL_NET, 'rb') as f:
+        learn = pickle.load(f)
+    return TabularPredictor(learn, normalizations, excluded=excluded)
+
+
+class CoverClassifier:
+    '''The notebook's XGBoost classifier of whether the margin beats the spread. It was trained on the same z-scaled
+    features as the net, so inputs get the cfb_feature_normalizations.dat scaling with the excluded columns left
+    as they are. Predictions go straight to the booster, skipping the DMatrix a scikit-learn predict_proba builds.'''
+
+    def __init__(self, model, normalizations, excluded=EXCLUDED):
+        self.booster = model.get_booster()
+        self.feature_names = list(self.booster.feature_names)
+        self.means, self.stds = normalization_arrays(normalizations, self.feature_names, excluded)
+
+    def predict_proba(self, x):
+        '''Returns the probability the margin beats the spread for each row of unscaled features.'''
+
+        return np.asarray(self.booster.inplace_predict((x - self.means) / self.stds), dtype=np.float32)
+
+
+def load_classifier(normalizations, excluded=EXCLUDED, path=XGBOOST_MODEL):
+    with open(path, 'rb') as f:
+        return CoverClassifier(pickle.load(f), normalizations, excluded)
+
+
+class EnsembleScorer:
+    '''Scores batches of games with the neural net and the XGBoost classifier together, and combines them the way
+    the notebook's best rule does: a pick is made when the net's edge over the spread is beyond edge_threshold and
+    XGBoost agrees, being above the cover band for a positive edge or below it for a negative one.'''
+
+    def __init__(self, predictor, classifier, edge_threshold=EDGE_THRESHOLD, cover_band=COVER_BAND):
+        self.predictor = predictor
+        self.classifier = classifier
+        self.edge_threshold = edge_threshold
+        self.cover_band = cover_band
+        # Both models read from one matrix of the raw columns either of them uses
+        self.columns = list(dict.fromkeys(list(predictor.cont_names) + classifier.feature_names + ['spread']))
+        index = {name: j for j, name in enumerate(self.columns)}
+        self.net_columns = np.array([index[name] for name in predictor.cont_names], dtype=np.int64)
+        self.classifier_columns = np.array([index[name] for name in classifier.feature_names], dtype=np.int64)
+        self.spread_column = index['spread']
+
+    def encode(self, games):
+        '''Turns a list of game dictionaries into the net's categorical codes and one float32 matrix of raw columns.
+        Missing values become NaN and unknown categories fastai's #na# code.'''
+
+        x_cat = np.array([[self.predictor.vocabs[name].get(game.get(name), 0) for name in self.predictor.cat_names]
+                          for game in games], dtype=np.int64).reshape(len(games), len(self.predictor.cat_names))
+        raw = np.array([[game.get(name) for name in self.columns] for game in games],
+                       dtype=np.float32).reshape(len(games), len(self.columns))
+        return x_cat, raw
+
+    def score(self, games):
+        '''Scores a list of unscaled game dictionaries, as gather_new_game_data returns them. Returns a structured
+        array with both models' outputs and the combined pick: 1 when both expect the margin to beat the spread, -1
+        when both expect it to fall short and 0 otherwise.'''
+
+        x_cat, raw = self.encode(games)
+        x_cont = (raw[:, self.net_columns] - self.predictor.means) / self.predictor.stds
+        results = np.empty(len(games), dtype=ENSEMBLE_DTYPE)
+        results['home_team'] = [game.get('home_team') for game in games]
+        results['away_team'] = [game.get('away_team') for game in games]
+        results['predicted'] = self.predictor.predict_margins(x_cat, x_cont) if len(games) > 0 else []
+        results['spread'] = raw[:, self.spread_column]
+        results['edge'] = results['predicted'] - results['spread']
+        results['cover_prob'] = self.classifier.predict_proba(raw[:, self.classifier_columns]) if len(games) > 0 else []
+        low, high = self.cover_band
+        results['pick'] = np.where((results['edge'] > self.edge_threshold) & (results['cover_prob'] > high), 1,
+                                   np.where((results['edge'] < -self.edge_threshold) & (results['cover_prob'] < low), -1, 0))
+        return results
+
+
+class ServiceMetrics:
+    '''Request counts, games scored, and latency percentiles over the most recent requests.'''
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.games = 0
+        self.errors = 0
+        self.scoring_seconds = 0.
+        self.latencies = deque(maxlen=window)
+
+    def add(self, games, seconds):
+        with self._lock:
+            self.requests += 1
+            self.games += games
+            self.scoring_seconds += seconds
+            self.latencies.append(seconds)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.time() - self.started
+            return dict(uptime_seconds=round(uptime, 3), requests=self.requests, games=self.games, errors=self.errors,
+                        games_per_second=round(self.games / self.scoring_seconds, 1) if self.scoring_seconds > 0 else None,
+                        requests_per_second=round(self.requests / uptime, 3),
+                        latency_ms={'p%d' % p: round(float(np.percentile(latencies, p)), 3) if len(latencies) else None
+                                    for p in (50, 95, 99)})
+
+
+def results_to_json(results):
+    return [{name: (results[name][i].item() if name not in ('home_team', 'away_team') else str(results[name][i]))
+             for name in results.dtype.names} for i in range(len(results))]
+
+
+def results_from_json(rows, dtype=ENSEMBLE_DTYPE):
+    results = np.empty(len(rows), dtype=dtype)
+    for name in results.dtype.names:
+        results[name] = [row[name] for row in rows]
+    return results
+
+
+def serve(scorer, port=SERVICE_PORT):
+    '''Serves scorer on localhost until interrupted. POST /score takes a JSON list of games and returns their
+    results; sending the same games again with a different spread is a what-if query. GET /metrics returns
+    ServiceMetrics.summary().'''
+
+    metrics = ServiceMetrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self.reply(200, metrics.summary())
+            else:
+                self.reply(404, {'message': 'Unknown path ' + self.path})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.reply(404, {'message': 'Unknown path ' + self.path})
+                return
+            try:
+                games = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                start = time.perf_counter()
+                results = scorer.score(games)
+                seconds = time.perf_counter() - start
+            except (ValueError, KeyError, TypeError) as e:
+                metrics.error()
+                self.reply(400, {'message': str(e)})
+                return
+            metrics.add(len(games), seconds)
+            self.reply(200, {'results': results_to_json(results), 'milliseconds': round(seconds * 1000, 3)})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    print('Scoring service listening on ', 'http://127.0.0.1:%d' % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def score_remote(games, url=SERVICE_URL, timeout=5.):
+    '''Scores games with a running scoring service. Returns the results, or None if no service is listening or it
+    fails to answer in time or with results, so the caller scores the games itself.'''
+
+    import requests
+    try:
+        response = requests.post(url + '/score', data=json.dumps(games), timeout=timeout)
+        response.raise_for_status()
+        return results_from_json(response.json()['results'])
+    except requests.exceptions.ConnectionError:
+        return None
+    except (requests.exceptions.RequestException, KeyError, ValueError, TypeError) as error:
+        print('Scoring service failed, scoring locally: ', error)
+        return None
+
+
+if __name__ == '__main__':
+    with open('cfb_feature_normalizations.dat', 'rb') as f:
+        normalizations = pickle.load(f)
+    scorer = EnsembleScorer(load_predictor(normalizations), load_classifier(normalizations))
+    serve(scorer, int(sys.argv[1]) if len(sys.argv) > 1 else SERVICE_PORT)
@@ -0,0 +1,201 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from concurrent.futures import ProcessPoolExecutor
+
+from game_store import load_games
+from game_frame import games_frame
+from inference import EXCLUDED
+from run_stats import timer, recorded_run
+
+N_SIMS = 20000
+CHUNK_SIMS = 2000 # Simulations per task; games x CHUNK_SIMS booleans stay a few MB
+SCHEDULE_COLUMNS = ['home_team', 'home_conference', 'away_team', 'away_conference']
+
+
+def margin_sd(directory='CFBGameData'):
+    '''Returns the standard deviation of game margins around the spread across the game store. The spread is the
+    market's predicted margin, so this is how far real margins land from a good prediction.'''
+
+    df = load_games(columns=['margin', 'spread'], directory=directory).dropna(subset=['margin', 'spread'])
+    return float(np.std(df['margin'].to_numpy(dtype=np.float64) - df['spread'].to_numpy(dtype=np.float64)))
+
+
+def home_win_probabilities(predicted, sd):
+    '''Turns predicted away minus home margins into the probability the home team wins, taking the real margin as
+    normal around the prediction with standard deviation sd.'''
+
+    return ndtr(-np.asarray(predicted, dtype=np.float64) / sd)
+
+
+class Schedule:
+    '''The remaining games of a season as index arrays into a team list, with each team's conference and the wins
+    it already has, which is everything a simulation needs.'''
+
+    def __init__(self, remaining, played=None):
+        # Before the first game, or after the last, a frame may have no rows and so no columns
+        remaining = remaining.reindex(columns=SCHEDULE_COLUMNS)
+        played = (played if played is not None else pd.DataFrame()).reindex(columns=SCHEDULE_COLUMNS + ['margin'])
+        teams = pd.unique(pd.concat([remaining['home_team'], remaining['away_team'], played['home_team'],
+                                     played['away_team']]).astype(str))
+        self.teams = list(teams)
+        index = {team: i for i, team in enumerate(self.teams)}
+        conferences = {}
+        for frame in [played, remaining]:
+            for side in ['home', 'away']:
+                conferences.update(zip(frame[side + '_team'].astype(str), frame[side + '_conference'].astype(str)))
+        self.conferences = np.array([conferences.get(team, '') for team in self.teams])
+        self.home = remaining['home_team'].astype(str).map(index).to_numpy(dtype=np.int64)
+        self.away = remaining['away_team'].astype(str).map(index).to_numpy(dtype=np.int64)
+        self.conference_game = (remaining['home_conference'].astype(str).to_numpy() ==
+                                remaining['away_conference'].astype(str).to_numpy())
+
+        # Results so far: margin is away minus home, so the home team won when it's negative
+        home_won = played['margin'].to_numpy(dtype=np.float64) < 0
+        played_home = played['home_team'].astype(str).map(index).to_numpy(dtype=np.int64)
+        played_away = played['away_team'].astype(str).map(index).to_numpy(dtype=np.int64)
+        played_conference = (played['home_conference'].astype(str).to_numpy() ==
+                             played['away_conference'].astype(str).to_numpy())
+        self.wins = np.bincount(np.where(home_won, played_home, played_away), minlength=len(self.teams))
+        self.conference_wins = np.bincount(np.where(home_won, played_home, played_away)[played_conference],
+                                           minlength=len(self.teams))
+
+
+def simulate_chunk(schedule, p_home, n_sims, seed):
+    '''Plays the remaining games n_sims times at once. Returns, per team, a histogram of final win totals, a
+    histogram of conference win totals and the expected number of conference titles, ties for the most conference
+    wins splitting a title evenly.'''
+
+    rng = np.random.default_rng(seed)
+    n_teams, n_games = len(schedule.teams), len(p_home)
+    home_won = rng.random((n_sims, n_games)) < p_home # sims x games
+    winners = np.where(home_won, schedule.home, schedule.away)
+    # Offsetting each simulation's team indices turns its win totals into one slice of a single bincount
+    offsets = np.arange(n_sims, dtype=np.int64)[:, None] * n_teams
+
+    def totals(winners):
+        return np.bincount((winners + offsets).ravel(), minlength=n_sims * n_teams).reshape(n_sims, n_teams)
+
+    wins = schedule.wins + totals(winners) # sims x teams
+    conference_wins = schedule.conference_wins + totals(winners[:, schedule.conference_game])
+
+    titles = np.zeros(n_teams)
+    for name in np.unique(schedule.conferences):
+        members = np.flatnonzero(schedule.conferences == name)
+        best = conference_wins[:, members] == conference_wins[:, members].max(axis=1, keepdims=True)
+        titles[members] += (best / best.sum(axis=1, keepdims=True)).sum(axis=0)
+
+    max_wins = int(wins.max()) + 1 if n_sims > 0 else 1
+    offsets = np.arange(n_teams) * (max_wins + 1)
+    win_counts = np.bincount((wins + offsets).ravel(), minlength=n_teams * (max_wins + 1)).reshape(n_teams, -1)
+    conference_counts = np.bincount((conference_wins + offsets).ravel(), minlength=n_teams * (max_wins + 1)).reshape(n_teams, -1)
+    return win_counts, conference_counts, titles
+
+
+def _add_counts(total, counts):
+    if total is None:
+        return counts
+    width = max(total.shape[1], counts.shape[1])
+    total = np.pad(total, ((0, 0), (0, width - total.shape[1])))
+    return total + np.pad(counts, ((0, 0), (0, width - counts.shape[1])))
+
+
+def simulate_season(schedule, p_home, n_sims=N_SIMS, seed=0, max_workers=None, chunk_sims=CHUNK_SIMS):
+    '''Runs n_sims simulations of the remaining games in chunks spread over a process pool. Each chunk gets its own
+    stream from one SeedSequence, so results depend only on seed and chunk_sims, not on the number of workers.
+    Returns a DataFrame with each team's conference, expected wins and conference wins, its probability of a
+    conference title, and the probability of each win total.'''
+
+    if len(p_home) == 0: # Season over: every simulation ends on the current records, so one stands for all
+        win_counts, conference_counts, titles = (n_sims * result for result in simulate_chunk(schedule, p_home, 1, seed))
+    else:
+        sizes = [min(chunk_sims, n_sims - start) for start in range(0, n_sims, chunk_sims)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        win_counts = conference_counts = None
+        titles = np.zeros(len(schedule.teams))
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            for counts, conference, chunk_titles in pool.map(simulate_chunk, [schedule] * len(sizes),
+                                                              [p_home] * len(sizes), sizes, seeds):
+                win_counts = _add_counts(win_counts, counts)
+                conference_counts = _add_counts(conference_counts, conference)
+                titles += chunk_titles
+
+    totals = np.arange(win_counts.shape[1])
+    projection = pd.DataFrame({'team': schedule.teams, 'conference': schedule.conferences,
+                               'wins': win_counts @ totals / n_sims,
+                               'conference_wins': conference_counts @ np.arange(conference_counts.shape[1]) / n_sims,
+                               'conference_title': titles / n_sims})
+    for k in totals:
+        projection['p_%d_wins' % k] = win_counts[:, k] / n_sims
+    return projection.sort_values(['conference', 'conference_wins'], ascending=[True, False]).reset_index(drop=True)
+
+
+def season_games(configuration, year, cache=None):
+    '''Returns a season's played games and its remaining scheduled games with their stats, as two DataFrames. The
+    remaining games all get the stats as of the next week to be played, the latest there are.'''
+
+    import cfbd
+    from response_cache import ResponseCache, cached_api_call
+    from season_table import SeasonTable
+    from update_game_data import add_spreads, process_games
+    if cache is None:
+        cache = ResponseCache()
+    api_config = cfbd.ApiClient(configuration)
+    headers = {'Authorization': configuration.api_key_prefix['Authorization'] + ' ' + configuration.api_key['Authorization']}
+    games = cached_api_call(cache, api_config, cfbd.GamesApi(api_config).get_games, '/games', 'list[Game]', year=year)
+    lines = cached_api_call(cache, api_config, cfbd.BettingApi(api_config).get_lines, '/lines', 'list[GameLines]', year=year)
+
+    rows = [dict(gid=g.id, year=g.season, week=g.week, neutral_site=g.neutral_site, home_team=g.home_team,
+                 home_conference=g.home_conference, home_points=g.home_points, home_elo=g.home_pregame_elo,
+                 away_team=g.away_team, away_conference=g.away_conference, away_points=g.away_points,
+                 away_elo=g.away_pregame_elo) for g in games]
+    played = [row for row in rows if row['home_points'] is not None and row['away_points'] is not None]
+    for row in played:
+        row['margin'] = row['away_points'] - row['home_points']
+    remaining = [row for row in rows if row['home_points'] is None and row['away_points'] is None]
+    add_spreads(remaining, lines) # Lines only exist for the next week or so; later games get no spread
+
+    as_of = max([row['week'] for row in played], default=0) + 1
+    weeks = [row['week'] for row in remaining]
+    for row in remaining:
+        row['week'] = as_of
+    remaining = process_games(remaining, headers, cache=cache, base_url=configuration.host, seasons=SeasonTable())
+    for row, week in zip(remaining, weeks):
+        row['week'] = week
+    played = pd.DataFrame(played, columns=['gid', 'year', 'week', 'neutral_site', 'home_team', 'home_conference',
+                                           'home_points', 'home_elo', 'away_team', 'away_conference', 'away_points',
+                                           'away_elo', 'margin']) # Columns too before the first game is played
+    return played, games_frame(remaining)
+
+
+@recorded_run('project_season')
+def project_season(configuration, year, n_sims=N_SIMS, seed=0, max_workers=None):
+    '''Projects the rest of a season: scores every remaining game with the neural net in one batch, turns the
+    predicted margins into win probabilities with the margin spread of the game store, and simulates the season
+    n_sims times. Returns the projection DataFrame of simulate_season.'''
+
+    from scoring_service import load_predictor
+    with timer('gather games'):
+        played, remaining = season_games(configuration, year)
+    with timer('predict'):
+        with open('cfb_feature_normalizations.dat', 'rb') as f:
+            normalizations = pickle.load(f)
+        if len(remaining) > 0:
+            predicted = load_predictor(normalizations, EXCLUDED).predict(remaining)['predicted']
+            p_home = home_win_probabilities(np.nan_to_num(predicted), margin_sd()) # No prediction counts as a toss-up
+        else:
+            p_home = np.zeros(0)
+    with timer('simulate'):
+        return simulate_season(Schedule(remaining, played), p_home, n_sims, seed, max_workers)
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime
+    from make_predictions import make_configuration
+    configuration = make_configuration()
+    projection = project_season(configuration, datetime.now().year, int(sys.argv[1]) if len(sys.argv) > 1 else N_SIMS)
+    projection.to_csv('season_projection.csv', index=False)
+    print(projection[['team', 'conference', 'wins', 'conference_wins', 'conference_title']].to_string(index=False))
@@ -0,0 +1,71 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from feature_schema import feature_columns
+from response_cache import season_is_complete
+from game_store import atomic_write
+
+SEASON_TABLES = 'season_stats' # One memory-mapped team x feature matrix per completed stats window
+
+
+class SeasonTable:
+    '''Persistent store of team x feature matrices for stats windows of completed seasons, which never change once
+    the season is over. Each window is extracted from its responses once by whichever run needs it first, saved as
+    an .npy matrix with a JSON list of teams beside it, and memory-mapped by every later run, so the _lastSeason
+    features of a finished year cost no requests and no extraction.'''
+
+    def __init__(self, directory=SEASON_TABLES):
+        self.directory = directory
+        self._loaded = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pair):
+        request = pair[0]
+        name = str(request.year)
+        if request.start_week is not None or request.end_week is not None:
+            name += '.weeks%s-%s' % (request.start_week or 1, request.end_week or '')
+        if request.team is not None:
+            name += '.' + request.team
+        return os.path.join(self.directory, name)
+
+    def stores(self, pair):
+        '''Returns True if a (season, advanced) request pair is a window this table keeps.'''
+
+        return pair is not None and season_is_complete(pair[0].year)
+
+    def get(self, pair):
+        '''Returns the (team index, matrix) of a stored window, as extract_features does, or None if it isn't
+        stored. The matrix is memory-mapped read-only.'''
+
+        if pair in self._loaded:
+            return self._loaded[pair]
+        path = self._path(pair)
+        try:
+            with open(path + '.teams.json') as f:
+                teams = json.load(f)
+            matrix = np.load(path + '.npy', mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        self._loaded[pair] = ({team: i for i, team in enumerate(teams)}, matrix)
+        return self._loaded[pair]
+
+    def put(self, pair, window):
+        '''Stores a window's (team index, matrix). The matrix goes in first, so a stored team list always has its
+        matrix.'''
+
+        team_index, matrix = window
+        path = self._path(pair)
+        tmp_path = path + '.%d.tmp.npy' % os.getpid()
+        np.save(tmp_path, np.asarray(matrix))
+        os.replace(tmp_path, path + '.npy')
+        atomic_write(path + '.teams.json', json.dumps(sorted(team_index, key=team_index.get)).encode())
+        self._loaded[pair] = window
+
+    def team_frame(self, pair, suffix='_lastSeason'):
+        '''Returns a stored window as a DataFrame indexed by team, with the feature column names of a home team
+        minus the home_ prefix, ready to join onto games by team.'''
+
+        team_index, matrix = self.get(pair)
+        columns = [name[len('home_'):] for name in feature_columns('home', suffix)]
+        return pd.DataFrame(np.asarray(matrix), index=sorted(team_index, key=team_index.get), columns=columns)
@@ -1,68 +1,216 @@
-from sklearn import preprocessing
-from fastai.tabular import *
-from fastai.tabular.all import *
-from sklearn.linear_model import Lasso
-from sklearn.linear_model import LassoCV
-from sklearn.feature_selection import SelectFromModel
-from bayes_opt import BayesianOptimization
-
-def select_features(df_z_scaled, excluded=[],cat_features=[], threshold=0.8):
-    '''For feature selection. Returns an array of features to be used in the model, selected using the LASSO method.
-    Takes as arguments a normalized data frame. Rejects features listed under excluded and takes as categorical
-    those listed in cat_features. Rejection of correlated features occurs at the given threshold.'''
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from game_frame import encode_categories
+from game_store import atomic_write
+from inference import EXCLUDED as MODEL_EXCLUDED, CAT_FEATURES
+
+SELECTION_CACHE = 'feature_selection_cache.json' # Selected features by hash of the training matrix and parameters
+# The notebook's list: the model's unscaled columns, plus the betting line and whether it was covered, which must
+# never be selected as features
+EXCLUDED = ['spread', 'covers'] + MODEL_EXCLUDED
 
-    
-    cont_features = [c for c in df.columns.to_list() if c not in cat_features and c not in excluded]
+def prune_correlated(df, threshold=0.8, target='margin', keep=()):
+    '''Drops correlated features one at a time, always dropping the member of a pair above threshold that is less
+    correlated with target, and stops once a pass finds no more than two correlated pairs. Returns the kept columns.
+    Columns in keep, like target, are never paired, so they are neither dropped nor the reason for a drop.
+    Correlations between the remaining columns don't change when one is dropped, so the matrix is computed once and
+    dropped columns are masked out.'''
 
-    df_feature_sel = df_z_scaled.copy()
+    columns = df.columns
+    corr = df.corr().to_numpy()
+    target_idx = columns.get_loc(target)
+    target_corr = np.abs(corr[:, target_idx])
+
+    correlated = np.abs(corr) > threshold
+    np.fill_diagonal(correlated, False)
+    for idx in [target_idx] + [columns.get_loc(name) for name in keep if name in columns]:
+        correlated[idx, :] = False
+        correlated[:, idx] = False
+    kept = np.ones(len(columns), dtype=bool)
+    pair_counts = correlated.sum(axis=1) # Correlated pairs each kept column is the first member of
 
-    first = True
     count = 0
-    correlated_points = {}
-
-    le = LabelEncoder()
-    # These encoded labels aren't actually used, but they're needed for proper indexing of the correlation matrix
-    df_feature_sel['home_conference'] = le.fit_transform(df_feature_sel['home_conference'])
-    df_feature_sel['away_conference'] = le.fit_transform(df_feature_sel['away_conference'])
-    df_feature_sel['home_team'] = le.fit_transform(df_feature_sel['home_team'])
-    df_feature_sel['away_team'] = le.fit_transform(df_feature_sel['away_team'])
-
-    while len(correlated_points.keys()) > 2 or first:
-        first = False
-        margin_idx = df_feature_sel.columns.get_loc("margin")
-        filter_data = df_feature_sel.corr().to_numpy()
-        correlated_points = {}
-
-        for i, row in enumerate(filter_data):
-            for j, data in enumerate(row):
-                if abs(data) > threshold and i != j and i != margin_idx and j != margin_idx:
-                    correlated_points[(i,j)] = abs(filter_data[i][margin_idx])
-
-        i,j = min(correlated_points, key=correlated_points.get)
-        
-        print('Dropped ', df_feature_sel.columns[i], ' due to collision with ', df_feature_sel.columns[j])
-        print('Correlation ', filter_data[i][j])
+    n_pairs = pair_counts.sum()
+    while n_pairs > 0:
+        # Pairs are ranked by the first member's correlation with target, ties going to the first pair in row order
+        rows = np.flatnonzero(pair_counts)
+        i = rows[0]
+        for row in rows[1:]:
+            if target_corr[row] < target_corr[i]:
+                i = row
+        j = np.flatnonzero(correlated[i] & kept)[0]
+
+        print('Dropped ', columns[i], ' due to collision with ', columns[j])
+        print('Correlation ', corr[i][j])
         count += 1
         print('Drop count: ', count)
 
-        df_feature_sel = df_feature_sel.iloc[:, [j for j, c in enumerate(df_feature_sel.columns) if j != i]]
+        kept[i] = False
+        pair_counts -= correlated[:, i] & kept
+        pair_counts[i] = 0
+        if n_pairs <= 2:
+            break
+        n_pairs = pair_counts.sum()
+
+    return list(columns[kept])
+
+
+def tabular_split(df, cat_features, cont_features, target='margin', valid_pct=0.2, seed=0):
+    '''Splits games into training and validation sets the way the notebook's TabularPandas with Categorify and
+    Normalize does, without loading fastai. Categories are coded from the training rows' sorted values, with 0 for
+    values they don't have, and continuous columns are scaled by the training rows' mean and population std.
+    Returns X_train, y_train, X_valid and y_valid, with X as float32 design matrices whose columns are cat_features
+    then cont_features, built column by column from the frame.'''
+
+    order = np.random.default_rng(seed).permutation(len(df))
+    cut = int(valid_pct * len(df))
+    train, valid = df.iloc[order[cut:]], df.iloc[order[:cut]]
+    means = train[cont_features].mean()
+    stds = train[cont_features].std(ddof=0) + 1e-7
+
+    def encode(rows):
+        X = np.empty((len(rows), len(cat_features) + len(cont_features)), dtype=np.float32)
+        for j, name in enumerate(cat_features):
+            X[:, j] = pd.Categorical(rows[name], categories=sorted(train[name].dropna().unique())).codes + 1
+        for j, name in enumerate(cont_features, len(cat_features)):
+            X[:, j] = (rows[name].to_numpy(dtype=np.float32) - np.float32(means[name])) / np.float32(stds[name])
+        return X
+
+    return encode(train), train[target].to_numpy(dtype=np.float64), encode(valid), valid[target].to_numpy(dtype=np.float64)
+
+
+def parallel_lasso_cv(X, y, n_folds=5, n_alphas=100, eps=1e-3, tol=1e-4, max_iter=1000, max_workers=None):
+    '''Cross-validated lasso, giving the same alpha and coefficients as LassoCV(cv=n_folds) with its default
+    unshuffled folds. X^T X and X^T y are summed once per fold, in float64, and each fold's centered training Gram
+    matrix is the total minus that fold's block, so no fold copies the design matrix. Folds run on a thread pool,
+    as the Gram solver releases the GIL, and each walks the alpha path warm-started from the previous alpha. Returns
+    the chosen alpha, its coefficients, the alphas and the folds x alphas held-out mean squared errors.'''
+
+    from sklearn.linear_model import lasso_path
+
+    n, p = X.shape
+    bounds = np.cumsum([0] + [len(fold) for fold in np.array_split(np.arange(n), n_folds)])
+    blocks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        X_k = X[start:stop].astype(np.float64)
+        blocks.append((X_k.T @ X_k, X_k.sum(axis=0), X_k.T @ y[start:stop], y[start:stop].sum()))
+        del X_k
+    gram = sum(block[0] for block in blocks)
+    sums = sum(block[1] for block in blocks)
+    xy = sum(block[2] for block in blocks)
+
+    def centered(gram, sums, xy, y_sum, n_rows):
+        mean, y_mean = sums / n_rows, y_sum / n_rows
+        return np.ascontiguousarray(gram - n_rows * np.outer(mean, mean)), xy - n_rows * mean * y_mean, mean, y_mean
+
+    def path(gram, xy, y_centered, alphas):
+        # With the Gram matrix supplied and checks off, lasso_path only reads the shape and dtype of X, so a
+        # zero-strided stand-in avoids materializing the fold's rows
+        stand_in = np.lib.stride_tricks.as_strided(np.zeros(1, dtype=X.dtype), (len(y_centered), p), (0, 0))
+        return lasso_path(stand_in, y_centered.astype(X.dtype), alphas=alphas, precompute=gram.astype(X.dtype),
+                          Xy=xy.astype(X.dtype), tol=tol, max_iter=max_iter, check_input=False)[1]
+
+    full_gram, full_xy, _, y_mean = centered(gram, sums, xy, y.sum(), n)
+    alpha_max = np.abs(full_xy).max() / n # LassoCV's grid, from the whole training set
+    alphas = np.geomspace(alpha_max, alpha_max * eps, num=n_alphas)
+
+    def fold_errors(k):
+        start, stop = bounds[k], bounds[k + 1]
+        fold_gram, fold_sums, fold_xy, fold_y_sum = blocks[k]
+        n_rows = n - (stop - start)
+        train_gram, train_xy, mean, train_y_mean = centered(gram - fold_gram, sums - fold_sums, xy - fold_xy,
+                                                            y.sum() - fold_y_sum, n_rows)
+        y_train = np.concatenate([y[:start], y[stop:]]) - train_y_mean
+        coefs = path(train_gram, train_xy, y_train, alphas)
+        predicted = X[start:stop] @ coefs + (train_y_mean - mean @ coefs)
+        return ((y[start:stop, None] - predicted)**2).mean(axis=0)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers or os.cpu_count(), n_folds)) as pool:
+        mse_path = np.array(list(pool.map(fold_errors, range(n_folds))))
+    best = int(np.argmin(mse_path.mean(axis=0)))
+    # The refit on every row walks the same path down to the chosen alpha; lasso_path needs at least two alphas
+    coef = path(full_gram, full_xy, y - y_mean, alphas[:max(best + 1, 2)])[:, best]
+    return alphas[best], coef, alphas, mse_path
+
+
+def selection_key(X, y, names, **params):
+    '''Returns a content hash of a design matrix, its target, its column names and the selection parameters.'''
+
+    digest = hashlib.sha256()
+    for array in [np.ascontiguousarray(X), np.ascontiguousarray(y)]:
+        digest.update(str(array.dtype).encode() + str(array.shape).encode())
+        digest.update(array.data)
+    digest.update(json.dumps([list(names), params], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def select_features(df_z_scaled, excluded=[],cat_features=[], threshold=0.8, seed=0, cache_path=SELECTION_CACHE):
+    '''For feature selection. Returns an array of features to be used in the model, selected using the LASSO method.
+    Takes as arguments a normalized data frame. Rejects features listed under excluded and takes as categorical
+    those listed in cat_features. Rejection of correlated features occurs at the given threshold. The validation
+    split is drawn from seed, and selections are kept in cache_path by a hash of the training matrix and the
+    parameters, so a rerun on unchanged data skips the lasso.'''
+
+    # gid is an id, not a stat, so like the notebook it's dropped before the correlations. The encoded labels aren't
+    # actually used, but they're needed for proper indexing of the correlation matrix
+    df_feature_sel = encode_categories(df_z_scaled.drop(columns=['gid'], errors='ignore'), ['home_conference', 'away_conference', 'home_team', 'away_team'])
+
+    # year and week pick the training rows below
+    df_feature_sel = df_feature_sel[prune_correlated(df_feature_sel, threshold, keep=['year', 'week'])]
 
     train_df = df_feature_sel.query("2015 < year < 2023 and week != 1")
+    cat_features = [c for c in cat_features if c in df_feature_sel.columns]
     cont_features = [c for c in df_feature_sel.columns.to_list() if c not in cat_features and c not in excluded]
-    splits = RandomSplitter(valid_pct=0.2)(range_of(train_df))
-    to = TabularPandas(train_df, procs=[Categorify, Normalize],
-                        y_names="margin",
-                        cat_names = cat_features,
-                        cont_names = cont_features,
-                       splits=splits)
-
-    X_train, y_train = to.train.xs, to.train.ys.values.ravel()
-    X_test, y_test = to.valid.xs, to.valid.ys.values.ravel()
-    lasso_cv = LassoCV(cv=5, random_state=0).fit(X_train, y_train)
-    sfm = SelectFromModel(lasso_cv, prefit=True) 
-    selected_feature_indices = np.where(sfm.get_support())[0] 
-    selected_features = X_train.columns[selected_feature_indices] 
-    coefficients = lasso_cv.coef_ 
+    X_train, y_train, X_test, y_test = tabular_split(train_df, cat_features, cont_features, seed=seed)
+    names = pd.Index(cat_features + cont_features)
+
+    key = selection_key(X_train, y_train, names, threshold=threshold, seed=seed)
+    cache = {}
+    if cache_path is not None and os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if key in cache:
+        print('Selection unchanged since the last run on this data, read from ', cache_path)
+        return pd.Index(cache[key])
+
+    alpha, coefficients, _, _ = parallel_lasso_cv(X_train, y_train)
+    selected_features = names[np.abs(coefficients) >= 1e-5] # SelectFromModel's default threshold for a lasso
     print("Selected Features:", selected_features) 
     print("Feature Coefficients:", coefficients) 
+    if cache_path is not None:
+        cache[key] = list(selected_features)
+        atomic_write(cache_path, json.dumps(cache, indent=1).encode())
     return selected_features
+
+
+def save_features(selected_features, path='features_for_cfb_model.dat'):
+    '''Pickles the selected features to path, the file the model reads, unless it already holds the same features,
+    so its timestamp only moves when the selection does. Returns True if the file was written.'''
+
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            if list(pickle.load(f)) == list(selected_features):
+                return False
+    atomic_write(path, pickle.dumps(selected_features))
+    return True
+
+
+def selection_data(directory='CFBGameData', excluded=EXCLUDED, cat_features=CAT_FEATURES):
+    '''Loads the stored games the notebook selects features on, the input select_features expects: games after 2015
+    and past week 3, whose stats are complete, with every stat z-scaled by its mean and std over all stored games.
+    Games missing any stat are dropped, as LassoCV can't fit on them.'''
+
+    from game_store import load_games
+    from game_frame import scale_columns
+    df = load_games(directory=directory).drop(columns='gid').dropna()
+    stats = [c for c in df.columns if c not in excluded and c not in cat_features and c != 'week'
+             and pd.api.types.is_numeric_dtype(df[c])]
+    normalizations = {name: (float(df[name].mean()), float(df[name].std())) for name in stats}
+    df = df.query('year > 2015 and week > 3').copy()
+    scale_columns(df, stats, normalizations)
+    return df
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from benchmarks import SyntheticSeasons
+from feature_schema import FEATURE_SCHEMA, TOTAL_STATS, extract_features
+from rolling_stats import RollingStats
+
+# Features built only from counts and totals, which a window has to reproduce exactly
+SUMMED = np.array([f.source == 'season' or f.key in TOTAL_STATS for f in FEATURE_SCHEMA])
+
+
+def api_window(seasons, year, start_week, end_week):
+    params = dict(year=year, startWeek=start_week, endWeek=end_week)
+    return extract_features(seasons.get('/stats/season', params), seasons.get('/stats/season/advanced', params))
+
+
+@pytest.fixture(scope='module')
+def seasons():
+    return SyntheticSeasons(years=[2021], n_teams=12)
+
+
+@pytest.fixture(scope='module')
+def rolling(seasons):
+    stats = RollingStats()
+    for week in range(1, 9):
+        stats.add_week(week, *[seasons.get(endpoint, dict(year=2021, startWeek=week, endWeek=week))
+                               for endpoint in ['/stats/season', '/stats/season/advanced']])
+    return stats
+
+
+@pytest.mark.parametrize('start_week, end_week', [(1, 1), (1, 8), (3, 5), (6, 8)])
+def test_window_matches_summed_api_window(seasons, rolling, start_week, end_week):
+    teams, matrix = rolling.window(start_week, end_week)
+    api_teams, api_matrix = api_window(seasons, 2021, start_week, end_week)
+    assert teams.keys() == api_teams.keys()
+    rows = [teams[team] for team in api_teams]
+    np.testing.assert_allclose(matrix[rows][:, SUMMED], api_matrix[:, SUMMED], rtol=1e-9)
+
+
+def test_last_n_is_the_weeks_before(rolling):
+    teams, matrix = rolling.last_n(6, 3)
+    window_teams, window_matrix = rolling.window(3, 5)
+    assert teams == window_teams
+    np.testing.assert_array_equal(matrix, window_matrix)
+
+
+def test_rates_are_averaged_over_plays():
+    weekly = {week: ([dict(team='A', statName='games', statValue=1)],
+                     [dict(team='A', offense=dict(plays=plays, successRate=rate))])
+              for week, (plays, rate) in enumerate([(60, 0.5), (40, 0.25), (80, 0.4)], 1)}
+    teams, matrix = RollingStats(weekly).window(1, 3)
+    column = [f.key for f in FEATURE_SCHEMA].index(('offense', 'successRate'))
+    assert matrix[teams['A'], column] == pytest.approx((60 * 0.5 + 40 * 0.25 + 80 * 0.4) / 180)
+
+
+def test_weeks_must_arrive_in_order(rolling):
+    with pytest.raises(ValueError):
+        rolling.add_week(rolling.last_week, [], [])
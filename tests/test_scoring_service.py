@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from scoring_service import EnsembleScorer, results_to_json, score_remote
+
+
+class FixedPredictor:
+    '''Predicts each game's 'predicted' column as its margin.'''
+
+    cat_names = []
+    cont_names = ['predicted_margin']
+    vocabs = {}
+    means = np.zeros(1, dtype=np.float32)
+    stds = np.ones(1, dtype=np.float32)
+
+    def predict_margins(self, x_cat, x_cont):
+        return x_cont[:, 0]
+
+
+class FixedClassifier:
+    '''Returns each game's 'probability' column as its cover probability.'''
+
+    feature_names = ['probability']
+
+    def predict_proba(self, x):
+        return x[:, 0]
+
+
+def games(*rows):
+    return [dict(home_team='Home %d' % i, away_team='Away %d' % i, spread=-7., predicted_margin=-7. + edge,
+                 probability=probability) for i, (edge, probability) in enumerate(rows)]
+
+
+@pytest.mark.parametrize('edge, probability, pick', [
+    (4, 0.6, 1), (-4, 0.4, -1), # Both models agree beyond the threshold and the band
+    (4, 0.5, 0), (-4, 0.5, 0), # XGBoost inside the band
+    (4, 0.4, 0), (-4, 0.6, 0), # XGBoost disagrees
+    (2, 0.9, 0), (-2, 0.1, 0), # Edge inside 3 points
+    (3, 0.9, 0), (4, 0.55, 0), (-4, 0.45, 0)]) # Both bounds are strict
+def test_pick_needs_edge_and_agreeing_cover_probability(edge, probability, pick):
+    results = EnsembleScorer(FixedPredictor(), FixedClassifier()).score(games((edge, probability)))
+    assert results['edge'][0] == pytest.approx(edge)
+    assert results['pick'][0] == pick
+
+
+def test_score_handles_an_empty_batch():
+    assert len(EnsembleScorer(FixedPredictor(), FixedClassifier()).score([])) == 0
+
+
+@pytest.fixture
+def service():
+    '''A local stand-in for the scoring service, answering POST /score with whatever reply is set to.'''
+
+    state = SimpleNamespace(reply=None)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            status, body = state.reply
+            if status is None: # Hang past the client's timeout
+                time.sleep(1)
+                status = 200
+            data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state.url = 'http://127.0.0.1:%d' % server.server_port
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_score_remote_returns_the_service_results(service):
+    expected = EnsembleScorer(FixedPredictor(), FixedClassifier()).score(games((4, 0.6), (-1, 0.5)))
+    service.reply = (200, {'results': results_to_json(expected)})
+    results = score_remote(games((4, 0.6), (-1, 0.5)), service.url)
+    np.testing.assert_array_equal(results['pick'], expected['pick'])
+    np.testing.assert_array_equal(results['home_team'], expected['home_team'])
+
+
+@pytest.mark.parametrize('reply', [
+    (None, {}), # Timeout
+    (500, {'message': 'failed'}),
+    (200, 'not json'),
+    (200, {'milliseconds': 1.}), # No results
+    (200, {'results': [{'home_team': 'Home 0'}]}), # Results missing fields
+    (200, {'results': [None]})])
+def test_score_remote_falls_back_when_the_service_fails(service, reply):
+    service.reply = reply
+    assert score_remote(games((4, 0.6)), service.url, timeout=0.2) is None
+
+
+def test_score_remote_falls_back_without_a_service():
+    assert score_remote(games((4, 0.6)), 'http://127.0.0.1:1', timeout=0.2) is None
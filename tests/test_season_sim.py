@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from season_sim import Schedule, home_win_probabilities, simulate_season
+
+TEAMS = ['Team %d' % i for i in range(8)]
+CONFERENCES = {team: 'Conference %d' % (i % 2) for i, team in enumerate(TEAMS)}
+
+
+def schedule_frame(pairs, margins=None):
+    df = pd.DataFrame({'home_team': [home for home, _ in pairs], 'away_team': [away for _, away in pairs]})
+    df['home_conference'] = df['home_team'].map(CONFERENCES)
+    df['away_conference'] = df['away_team'].map(CONFERENCES)
+    if margins is not None:
+        df['margin'] = margins
+    return df
+
+
+PLAYED = schedule_frame([(TEAMS[0], TEAMS[2]), (TEAMS[1], TEAMS[3]), (TEAMS[4], TEAMS[5])], [-7, 3, -10])
+REMAINING = schedule_frame([(TEAMS[0], TEAMS[4]), (TEAMS[2], TEAMS[6]), (TEAMS[3], TEAMS[7]), (TEAMS[5], TEAMS[1])])
+
+
+def test_home_win_probabilities_are_the_normal_cdf():
+    predicted = np.array([-14., -3., 0., 3., 14.])
+    expected = [0.5 * (1 + math.erf(-margin / (10 * math.sqrt(2)))) for margin in predicted]
+    np.testing.assert_allclose(home_win_probabilities(predicted, 10.), expected)
+    assert home_win_probabilities([0.], 10.)[0] == 0.5
+
+
+def test_schedule_counts_wins_so_far():
+    schedule = Schedule(REMAINING, PLAYED)
+    wins = dict(zip(schedule.teams, schedule.wins))
+    # Negative margins are home wins
+    assert [wins[team] for team in TEAMS[:6]] == [1, 0, 0, 1, 1, 0]
+    conference_wins = dict(zip(schedule.teams, schedule.conference_wins))
+    assert conference_wins[TEAMS[0]] == 1 and conference_wins[TEAMS[4]] == 0
+
+
+@pytest.mark.parametrize('played', [None, pd.DataFrame([])])
+def test_preseason_projection(played):
+    schedule = Schedule(REMAINING, played)
+    assert schedule.wins.sum() == 0
+    p_home = np.array([0.9, 0.5, 0.2, 0.6])
+    projection = simulate_season(schedule, p_home, n_sims=4000, max_workers=1).set_index('team')
+    expected = np.zeros(len(schedule.teams))
+    np.add.at(expected, schedule.home, p_home)
+    np.add.at(expected, schedule.away, 1 - p_home)
+    np.testing.assert_allclose(projection.loc[schedule.teams, 'wins'], expected, atol=0.05)
+    assert projection['conference_title'].sum() == pytest.approx(2)
+
+
+def test_season_over_projection_is_the_current_records():
+    schedule = Schedule(pd.DataFrame([]), PLAYED)
+    projection = simulate_season(schedule, np.zeros(0), n_sims=1000).set_index('team')
+    np.testing.assert_array_equal(projection.loc[schedule.teams, 'wins'], schedule.wins)
+    for team, wins in zip(schedule.teams, schedule.wins):
+        assert projection.loc[team, 'p_%d_wins' % wins] == 1
+    assert projection['conference_title'].sum() == pytest.approx(2)
+
+
+def test_results_depend_on_seed_not_workers():
+    schedule = Schedule(REMAINING, PLAYED)
+    p_home = np.array([0.9, 0.5, 0.2, 0.6])
+    one = simulate_season(schedule, p_home, n_sims=3000, seed=5, max_workers=1, chunk_sims=500)
+    two = simulate_season(schedule, p_home, n_sims=3000, seed=5, max_workers=2, chunk_sims=500)
+    pd.testing.assert_frame_equal(one, two)
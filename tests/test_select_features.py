@@ -0,0 +1,89 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from select_features import prune_correlated
+
+
+def notebook_prune(df, threshold=0.8):
+    '''The notebook's pruning loop: recomputes the correlation matrix after every drop, and drops the first member
+    of the pair whose first member is least correlated with margin. Returns the (dropped, collided with) pairs.'''
+
+    df = df.copy()
+    drops = []
+    first = True
+    correlated_points = {}
+    while len(correlated_points.keys()) > 2 or first:
+        first = False
+        margin_idx = df.columns.get_loc('margin')
+        filter_data = df.corr().to_numpy()
+        correlated_points = {}
+        for i, row in enumerate(filter_data):
+            for j, data in enumerate(row):
+                if abs(data) > threshold and i != j and i != margin_idx and j != margin_idx:
+                    correlated_points[(i, j)] = abs(filter_data[i][margin_idx])
+        i, j = min(correlated_points, key=correlated_points.get)
+        drops.append((df.columns[i], df.columns[j]))
+        df = df.iloc[:, [k for k in range(len(df.columns)) if k != i]]
+    return drops
+
+
+def clustered_frame(seed, n_rows=400, n_clusters=6, cluster_size=4):
+    '''Clusters of noisy copies of one factor, so columns within a cluster are correlated, and a margin that
+    depends on some of the factors.'''
+
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(size=(n_rows, n_clusters))
+    columns = {}
+    for c in range(n_clusters):
+        for k in range(cluster_size):
+            columns['stat_%d_%d' % (c, k)] = factors[:, c] + rng.normal(scale=rng.uniform(0.1, 0.6), size=n_rows)
+    columns['margin'] = factors @ rng.normal(size=n_clusters) + rng.normal(size=n_rows)
+    return pd.DataFrame(columns)
+
+
+def printed_drops(output):
+    return re.findall(r'Dropped +(\S+) +due to collision with +(\S+)', output)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_drop_order_matches_the_notebook(seed, capsys):
+    df = clustered_frame(seed)
+    expected = notebook_prune(df)
+    capsys.readouterr()
+    kept = prune_correlated(df)
+    assert printed_drops(capsys.readouterr().out) == expected
+    assert kept == [c for c in df.columns if c not in {dropped for dropped, _ in expected}]
+
+
+def test_kept_columns_are_never_dropped_or_collided_with(capsys):
+    df = clustered_frame(0)
+    df['year'] = df['stat_0_0'] * 2 + 2020 # Perfectly correlated with a stat
+    df['week'] = df['stat_1_0'] + 8
+    kept = prune_correlated(df, keep=['year', 'week'])
+    drops = printed_drops(capsys.readouterr().out)
+    assert 'year' in kept and 'week' in kept
+    assert all('year' not in pair and 'week' not in pair for pair in drops)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_parallel_lasso_cv_selects_what_lasso_cv_does(seed):
+    from sklearn.linear_model import LassoCV
+    from select_features import parallel_lasso_cv
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(600, 40)).astype(np.float32)
+    X[:, 1] = X[:, 0] + rng.normal(scale=0.3, size=600) # A correlated pair, so the path isn't trivial
+    true_coef = np.zeros(40)
+    true_coef[rng.choice(40, 8, replace=False)] = rng.normal(scale=2, size=8)
+    y = X @ true_coef + 3 + rng.normal(scale=2, size=600)
+
+    alpha, coef, alphas, mse_path = parallel_lasso_cv(X, y, max_workers=2)
+    lasso_cv = LassoCV(cv=5).fit(X, y)
+    assert alpha == pytest.approx(lasso_cv.alpha_, rel=1e-5)
+    np.testing.assert_allclose(alphas, lasso_cv.alphas_, rtol=1e-5)
+    np.testing.assert_array_equal(np.abs(coef) >= 1e-5, np.abs(lasso_cv.coef_) >= 1e-5)
+    np.testing.assert_allclose(coef, lasso_cv.coef_, atol=1e-3)
+    assert mse_path.shape == (5, len(alphas))
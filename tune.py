@@ -0,0 +1,256 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+from game_store import load_games
+from inference import EXCLUDED, CAT_FEATURES
+
+TRIAL_STORE = 'tuning_trials.jsonl' # One JSON line per finished trial
+
+# Search space from the notebook's fit_with
+HYPERPARAMETER_BOUNDS = {'lr': (1e-05, 1e-01),
+                         'wd': (4e-4, 0.5),
+                         'dp': (0.01, 0.5),
+                         'n_layers': (1,3),
+                         'layer_1': (5, 200),
+                         'layer_2': (5, 100),
+                         'layer_3': (1, 200),
+                         'num_steps': (5,50)}
+
+_dls = None # Each worker's DataLoaders, built once by _init_worker
+
+
+def net_config(params):
+    '''Turns a point in HYPERPARAMETER_BOUNDS into the network fit_with trains: layer sizes, learning rate, dropouts
+    and epochs. As in the notebook, wd is used as the layer dropout and dp as the embedding dropout.'''
+
+    n_layers = int(params['n_layers'])
+    if n_layers == 2:
+        layers = [int(params['layer_1']), int(params['layer_2'])]
+    elif n_layers == 3:
+        layers = [int(params['layer_1']), int(params['layer_2']), int(params['layer_3'])]
+    else:
+        layers = [int(params['layer_1'])]
+    return dict(layers=layers, lr=float(params['lr']), ps=float(params['wd']), embed_p=float(params['dp']),
+                epochs=int(params['num_steps']))
+
+
+def trial_key(study, params):
+    '''Returns the store key for a trial: the study plus the network the point trains. Points that give the same
+    network, such as ones differing only in the size of an unused layer, share a key.'''
+
+    raw = json.dumps([study, sorted(net_config(params).items())])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def study_key(df, cat_features, cont_features, valid_pct, seed):
+    '''Returns a fingerprint of the training data and split, so trials are only reused for the data they were run on.'''
+
+    content = int(pd.util.hash_pandas_object(df[cat_features + cont_features + ['margin']], index=False).sum())
+    raw = json.dumps([cat_features, cont_features, valid_pct, seed, len(df), content])
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+class TrialStore:
+    '''Append-only store of finished trials in a JSON lines file. Each line holds the trial key, the study, the params,
+    the validation MAE, the epochs run and whether the trial was stopped early. Only the parent process writes to it,
+    and a line cut short by a crash is skipped on load.'''
+
+    def __init__(self, path=TRIAL_STORE):
+        self.path = path
+        self.trials = []
+        self.results = {} # Trial key to its first result
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        trial = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.trials.append(trial)
+                    self.results.setdefault(trial['key'], trial)
+
+    def get(self, key):
+        '''Returns the stored result for a trial key, or None if that network hasn't been trained.'''
+
+        return self.results.get(key)
+
+    def study_trials(self, study):
+        '''Returns the trials run on a study's data, in the order they were stored.'''
+
+        return [trial for trial in self.trials if trial['study'] == study]
+
+    def add(self, trial):
+        '''Records a trial and appends it to the file straight away, so an interrupted search keeps it.'''
+
+        self.trials.append(trial)
+        self.results.setdefault(trial['key'], trial)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(trial) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _training_games(df):
+    '''Games the notebook tunes on: complete data from 2016 on, past the first three weeks.'''
+
+    return df.query('year > 2015 & week > 3').reset_index(drop=True)
+
+
+def _init_worker(columns, directory, cat_features, cont_features, valid_pct, seed, cores, threads):
+    '''Builds the DataLoaders once per worker process. Each worker takes its own block of cores from the cores queue
+    and limits torch to that many threads, so the pool never runs more threads than there are cores.'''
+
+    global _dls
+    block = cores.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, block)
+    import torch
+    torch.set_num_threads(threads)
+    from fastai.tabular.all import TabularPandas, Categorify, Normalize, RandomSplitter, range_of
+
+    df = load_games(columns=columns, directory=directory).dropna().reset_index(drop=True)
+    df = _training_games(df)
+    # The same seed gives every worker, and every session, the same validation split
+    splits = RandomSplitter(valid_pct=valid_pct, seed=seed)(range_of(df))
+    to = TabularPandas(df, procs=[Categorify, Normalize],
+                        y_names="margin",
+                        cat_names = cat_features,
+                        cont_names = cont_features,
+                        splits=splits)
+    _dls = to.dataloaders(bs=64)
+
+
+def run_trial(params, seed, prune_above=None, min_epochs=3):
+    '''Trains the network for one point and returns its validation MAE, the epochs run and whether it was stopped
+    early. A trial whose validation MAE is still above prune_above after min_epochs is stopped there.'''
+
+    from fastai.tabular.all import tabular_learner, tabular_config, mae, set_seed, Callback, CancelFitException
+
+    class PruneBadTrial(Callback):
+        order = 100 # After the Recorder has the epoch's metrics
+        stopped = False
+
+        def after_epoch(self):
+            if prune_above is None or self.epoch + 1 < min_epochs:
+                return
+            if self.recorder.values[-1][-1] > prune_above:
+                self.stopped = True
+                raise CancelFitException()
+
+    config = net_config(params)
+    set_seed(seed, reproducible=True)
+    prune = PruneBadTrial()
+    learn = tabular_learner(_dls, layers=config['layers'], metrics=mae,
+                            config=tabular_config(embed_p=config['embed_p'], ps=config['ps']), cbs=[prune])
+    with learn.no_bar(), learn.no_logging():
+        learn.fit(config['epochs'], lr=config['lr'])
+    epochs = len(learn.recorder.values)
+    return dict(mae=float(learn.recorder.values[-1][-1]), epochs=epochs, stopped=prune.stopped)
+
+
+def _suggest_batch(trials, bounds, batch_size, init_points, seed):
+    '''Returns batch_size new points. Until init_points trials exist the points are random. After that, each point
+    is suggested by a Gaussian process fit to every stored trial plus a placeholder result, the mean so far, for
+    the points already picked in this batch, so the batch spreads out instead of repeating one suggestion.'''
+
+    rng = np.random.default_rng(seed + len(trials))
+    points = []
+    while len(points) < batch_size and len(trials) + len(points) < init_points:
+        points.append({name: float(rng.uniform(low, high)) for name, (low, high) in bounds.items()})
+    if len(points) == batch_size:
+        return points
+
+    from bayes_opt import BayesianOptimization
+    optim = BayesianOptimization(f=None, pbounds=bounds, random_state=int(rng.integers(2**31)),
+                                 allow_duplicate_points=True, verbose=0)
+    for trial in trials:
+        optim.register(params=trial['params'], target=-trial['mae'])
+    placeholder = -float(np.mean([trial['mae'] for trial in trials])) if len(trials) > 0 else 0.
+    for point in points:
+        optim.register(params=point, target=placeholder)
+    try:
+        from bayes_opt import UtilityFunction # bayes_opt 1.x takes the acquisition function per call
+        utility = UtilityFunction(kind='ucb', kappa=2.576, xi=0.0)
+        suggest = lambda: optim.suggest(utility)
+    except ImportError:
+        suggest = optim.suggest
+    while len(points) < batch_size:
+        point = {name: float(value) for name, value in suggest().items()}
+        optim.register(params=point, target=placeholder)
+        points.append(point)
+    return points
+
+
+def run_search(n_iter=10, init_points=5, batch_size=None, max_workers=None, seed=0, valid_pct=0.2, prune_ratio=1.25,
+               min_epochs=3, bounds=HYPERPARAMETER_BOUNDS, directory='CFBGameData',
+               features_path='features_for_cfb_model.dat', store_path=TRIAL_STORE):
+    '''Bayesian search over the neural net's hyperparameters, minimizing validation MAE. Points are suggested in
+    batches of batch_size, one per worker by default, and trained in parallel. Every trial is kept in store_path, so
+    a repeated or interrupted search reuses finished trials instead of retraining them, and n_iter counts only new
+    points. A trial more than prune_ratio times the best MAE so far after min_epochs epochs is stopped early. Returns
+    the best trial and a DataFrame of all trials on this data.'''
+
+    with open(features_path,'rb') as f:
+        selected_features = list(pickle.load(f))
+    cat_features = CAT_FEATURES
+    cont_features = [c for c in selected_features if c not in cat_features and c not in EXCLUDED]
+    columns = list(dict.fromkeys(['margin'] + cat_features + cont_features))
+
+    df = _training_games(load_games(columns=columns, directory=directory).dropna().reset_index(drop=True))
+    study = study_key(df, cat_features, cont_features, valid_pct, seed)
+    del df
+    store = TrialStore(store_path)
+    print('Resuming with ', len(store.study_trials(study)), ' stored trials')
+
+    max_workers = max_workers or os.cpu_count()
+    batch_size = batch_size or max_workers
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    threads = max(1, len(cpus) // max_workers)
+    cores = mp.Queue() # Handed to the workers as they start, so each gets a different block
+    for w in range(max_workers):
+        cores.put(set(cpus[(w*threads) % len(cpus):(w*threads) % len(cpus) + threads]))
+
+    total = len(store.study_trials(study)) + n_iter
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(columns, directory, cat_features, cont_features, valid_pct, seed, cores,
+                                       threads)) as pool:
+        while len(store.study_trials(study)) < total:
+            trials = store.study_trials(study)
+            batch = _suggest_batch(trials, bounds, min(batch_size, total - len(trials)), init_points, seed)
+            best = min((trial['mae'] for trial in trials if not trial['stopped']), default=None)
+            prune_above = best * prune_ratio if best is not None else None
+
+            futures = []
+            for params in batch:
+                key = trial_key(study, params)
+                stored = store.get(key)
+                if stored is not None:
+                    # Same network as a stored trial, so the point is recorded with its result instead of retrained
+                    store.add(dict(key=key, study=study, params=params, mae=stored['mae'], epochs=stored['epochs'],
+                                   stopped=stored['stopped']))
+                else:
+                    futures.append((key, params, pool.submit(run_trial, params, seed, prune_above, min_epochs)))
+            for key, params, future in futures:
+                stored = store.get(key) # Two points in one batch can give the same network
+                result = future.result() if stored is None else dict(mae=stored['mae'], epochs=stored['epochs'],
+                                                                     stopped=stored['stopped'])
+                store.add(dict(key=key, study=study, params=params, **result))
+                print('Trial MAE ', result['mae'], ' after ', result['epochs'], ' epochs',
+                      ' (stopped early)' if result['stopped'] else '')
+
+    trials = pd.DataFrame([dict(trial['params'], mae=trial['mae'], epochs=trial['epochs'], stopped=trial['stopped'])
+                           for trial in store.study_trials(study)])
+    best = trials[~trials['stopped']].sort_values('mae').iloc[0]
+    print('Best validation MAE ', best['mae'])
+    print(net_config(best))
+    return best, trials
+
+
+if __name__ == '__main__':
+    run_search()
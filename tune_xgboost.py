@@ -0,0 +1,219 @@
+import os
+import time
+import pickle
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+from game_store import load_games, atomic_write
+from inference import EXCLUDED, CAT_FEATURES, normalization_arrays
+from scoring_service import XGBOOST_MODEL
+from run_stats import recorded_run, timer, record
+
+# Grid from the notebook's RandomizedSearchCV
+PARAM_GRID = {'learning_rate': [0.01, 0.05, 0.10, 0.20],
+              'min_child_weight': [1, 5, 10],
+              'gamma': [0.5, 1, 5],
+              'subsample': [0.6, 0.8, 1.0],
+              'colsample_bytree': [0.6, 0.8, 1.0],
+              'max_depth': [2, 3, 4],
+              'reg_lambda': [0.5, 1, 1.5, 2],
+              'reg_alpha': [0, 0.5, 1]}
+MAX_BIN = 256
+
+_folds = None # Each worker's quantized training folds and validation arrays, built once by _init_worker
+_threads = 1
+
+
+def training_data(directory='CFBGameData', features_path='features_for_cfb_model.dat',
+                  normalizations_path='cfb_feature_normalizations.dat'):
+    '''Returns the notebook's XGBoost training data: the z-scaled features the classifier reads, as one float32
+    matrix, whether the margin beat the spread, and the feature names. Only complete games from 2016 on, past the
+    first three weeks, are used.'''
+
+    with open(features_path, 'rb') as f:
+        selected_features = list(pickle.load(f))
+    with open(normalizations_path, 'rb') as f:
+        normalizations = pickle.load(f)
+    features = [c for c in selected_features if c not in CAT_FEATURES and c not in EXCLUDED]
+    columns = list(dict.fromkeys(['margin', 'spread'] + features))
+    df = load_games(columns=columns, directory=directory).dropna().query('year > 2015 & week > 3')
+    means, stds = normalization_arrays(normalizations, features, EXCLUDED)
+    X = (df[features].to_numpy(dtype=np.float32) - means) / stds
+    y = (df['margin'].to_numpy() > df['spread'].to_numpy()).astype(np.int32)
+    return X, y, features
+
+
+def monotone_constraints(X, y, threshold=0.4):
+    '''Returns the notebook's monotonicity vector, 1 or -1 for features whose correlation with covering is beyond
+    threshold and 0 otherwise, from one pass over the matrix instead of a .corr call per feature.'''
+
+    Xc = X - X.mean(axis=0)
+    yc = y - y.mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (Xc * yc[:, None]).sum(axis=0) / np.sqrt((Xc**2).sum(axis=0) * (yc**2).sum())
+    return tuple(int(c) for c in np.where(corr > threshold, 1, np.where(corr < -threshold, -1, 0)))
+
+
+def sample_candidates(n_candidates, seed=0, grid=PARAM_GRID):
+    '''Returns n_candidates distinct points of the grid, drawn at random like RandomizedSearchCV does.'''
+
+    from sklearn.model_selection import ParameterSampler
+    return list(ParameterSampler(grid, n_iter=n_candidates, random_state=seed))
+
+
+def booster_params(candidate, monotonicity, seed=0):
+    return dict(candidate, objective='binary:logistic', eval_metric='logloss', tree_method='hist', max_bin=MAX_BIN,
+                monotone_constraints='(' + ','.join(map(str, monotonicity)) + ')', nthread=_threads, seed=seed)
+
+
+def _init_worker(X, y, folds, cores, threads):
+    '''Quantizes each fold's training rows into a QuantileDMatrix once per worker, so candidates only pay for
+    boosting. Each worker takes its own block of cores and gives XGBoost that many threads.'''
+
+    global _folds, _threads
+    block = cores.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, block)
+    import xgboost as xgb
+    _threads = threads
+    _folds = [(xgb.QuantileDMatrix(X[train], label=y[train], max_bin=MAX_BIN, nthread=threads), X[valid], y[valid])
+              for train, valid in folds]
+
+
+def train_rung(candidate, monotonicity, rounds, states, seed=0):
+    '''Boosts one candidate on every fold until it has rounds trees, continuing from states, the fold boosters of
+    the previous rung as raw bytes, if it has them. Returns the mean validation accuracy and log loss, and the
+    new states.'''
+
+    import xgboost as xgb
+    params = booster_params(candidate, monotonicity, seed)
+    accuracies, losses, new_states = [], [], []
+    for k, (dtrain, X_valid, y_valid) in enumerate(_folds):
+        booster = xgb.Booster(model_file=bytearray(states[k])) if states is not None else None
+        done = booster.num_boosted_rounds() if booster is not None else 0
+        booster = xgb.train(params, dtrain, num_boost_round=rounds - done, xgb_model=booster)
+        p = np.clip(booster.inplace_predict(X_valid), 1e-7, 1 - 1e-7)
+        accuracies.append(float(np.mean((p > 0.5) == y_valid)))
+        losses.append(float(-np.mean(y_valid * np.log(p) + (1 - y_valid) * np.log(1 - p))))
+        new_states.append(bytes(booster.save_raw()))
+    return float(np.mean(accuracies)), float(np.mean(losses)), new_states
+
+
+def successive_halving(X, y, candidates, monotonicity, n_folds=5, min_rounds=20, max_rounds=540, factor=3,
+                       max_workers=None, seed=0):
+    '''Cross-validates candidates with successive halving. Every candidate gets min_rounds trees; the best
+    1/factor by validation accuracy, log loss breaking ties, go on with factor times as many trees, carrying their
+    boosters over, until one candidate is left or max_rounds is reached. Candidates in a rung train in parallel on
+    a process pool, with the cores split evenly between workers. Returns the rungs as lists of
+    (candidate index, rounds, accuracy, log loss).'''
+
+    from sklearn.model_selection import StratifiedKFold
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=11).split(X, y)) # Notebook's folds
+
+    max_workers = min(max_workers or os.cpu_count(), len(candidates))
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    threads = max(1, len(cpus) // max_workers)
+    cores = mp.Queue()
+    for w in range(max_workers):
+        cores.put(set(cpus[(w*threads) % len(cpus):(w*threads) % len(cpus) + threads]))
+
+    alive = list(range(len(candidates)))
+    states = {i: None for i in alive}
+    rounds = min_rounds
+    rungs = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(X, y, folds, cores, threads)) as pool:
+        while True:
+            with timer('rung of %d rounds' % rounds):
+                futures = {i: pool.submit(train_rung, candidates[i], monotonicity, rounds, states[i], seed) for i in alive}
+                rung = []
+                for i, future in futures.items():
+                    accuracy, loss, states[i] = future.result()
+                    rung.append((i, rounds, accuracy, loss))
+            rungs.append(rung)
+            record('rung of %d rounds' % rounds, dict(candidates=len(rung), best_accuracy=max(r[2] for r in rung)))
+            if len(alive) == 1 or rounds * factor > max_rounds:
+                break
+            keep = max(1, len(alive) // factor)
+            alive = [r[0] for r in sorted(rung, key=lambda r: (-r[2], r[3]))[:keep]]
+            for i in set(states) - set(alive):
+                del states[i] # Pruned candidates' boosters aren't needed any more
+            rounds *= factor
+    return rungs
+
+
+@recorded_run('tune_xgboost')
+def run_search(n_candidates=100, seed=0, valid_pct=0.2, max_workers=None, min_rounds=20, max_rounds=540, factor=3,
+               directory='CFBGameData', path=XGBOOST_MODEL):
+    '''Searches the notebook's grid with successive halving, refits the best candidate on all training games and
+    pickles it to path as an XGBClassifier, the form XGBoost_for_spread_cfb.dat and scoring_service.py use. The file
+    is replaced in one rename, so the scoring service never reads a partly written model. Returns the fitted model,
+    its candidate and its accuracy on the held-out games.'''
+
+    from sklearn.model_selection import train_test_split
+    from xgboost import XGBClassifier
+    import pandas as pd
+
+    with timer('load games'):
+        X, y, features = training_data(directory)
+    X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=valid_pct, random_state=seed)
+    monotonicity = monotone_constraints(X_train, y_train)
+    candidates = sample_candidates(n_candidates, seed)
+    rungs = successive_halving(X_train, y_train, candidates, monotonicity, min_rounds=min_rounds,
+                               max_rounds=max_rounds, factor=factor, max_workers=max_workers, seed=seed)
+    # More trees can do worse, so the best number of rounds is taken from any rung, not just the last
+    best_index, rounds, accuracy, loss = sorted((r for rung in rungs for r in rung), key=lambda r: (-r[2], r[3]))[0]
+    best = candidates[best_index]
+    record('best candidate', dict(best, rounds=rounds, cv_accuracy=accuracy))
+
+    with timer('refit'):
+        model = XGBClassifier(objective='binary:logistic', monotone_constraints=monotonicity, n_estimators=rounds,
+                              tree_method='hist', max_bin=MAX_BIN, random_state=seed, **best)
+        model.fit(pd.DataFrame(X_train, columns=features), y_train) # Named columns, so the booster knows its features
+    holdout = float(np.mean(model.predict(pd.DataFrame(X_valid, columns=features)) == y_valid))
+    record('held-out accuracy', holdout)
+    atomic_write(path, pickle.dumps(model))
+    return model, best, holdout
+
+
+def benchmark(n_candidates=20, seed=0, max_workers=None, directory='CFBGameData'):
+    '''Times the notebook's search, RandomizedSearchCV over XGBClassifier on a DataFrame with a .corr loop for the
+    monotonicity, against successive_halving on the same number of candidates and folds.'''
+
+    import pandas as pd
+    from sklearn.model_selection import RandomizedSearchCV, StratifiedKFold
+    from xgboost import XGBClassifier
+
+    X, y, features = training_data(directory)
+    train_df = pd.DataFrame(X, columns=features)
+    train_df['covers'] = y
+
+    start = time.perf_counter()
+    monotonicity = []
+    for feature in features:
+        corr = train_df[feature].corr(train_df['covers'])
+        monotonicity.append(-1 if corr < -.4 else 1 if corr > .4 else 0)
+    skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=11)
+    grid = RandomizedSearchCV(XGBClassifier(objective='binary:logistic', monotone_constraints=tuple(monotonicity)),
+                              PARAM_GRID, n_jobs=1, cv=skf.split(train_df[features], train_df['covers']),
+                              scoring='accuracy', refit=True, n_iter=n_candidates, random_state=seed)
+    grid.fit(train_df[features], train_df['covers'])
+    old_seconds = time.perf_counter() - start
+    print('RandomizedSearchCV: ', round(old_seconds, 2), ' s, best CV accuracy ', round(grid.best_score_, 4))
+
+    start = time.perf_counter()
+    rungs = successive_halving(X, y, sample_candidates(n_candidates, seed), monotone_constraints(X, y),
+                               max_workers=max_workers, seed=seed)
+    new_seconds = time.perf_counter() - start
+    print('Successive halving: ', round(new_seconds, 2), ' s, best CV accuracy ',
+          round(max(r[2] for rung in rungs for r in rung), 4), ' (', round(old_seconds / new_seconds, 1), 'x faster)')
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        model, best, holdout = run_search()
+        print('Best candidate ', best, ', held-out accuracy ', holdout)
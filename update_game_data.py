@@ -1,136 +1,90 @@
-import os.path
-import pickle
 from datetime import datetime
-import cfbd
-from cfbd.rest import ApiException
-import requests
-import numpy as np
-
-def gather_game_data(configuration):
+from itertools import groupby, islice
+from fetch_stats import BASE_URL, iter_stat_plans, fetch_stat_requests
+from rolling_stats import RollingStats, plan_increments, is_rolling_pair
+from feature_schema import feature_columns, extract_features, DEFAULT_ROW, MISSING_ROW
+from response_cache import ResponseCache, cached_api_call, season_is_complete
+from run_stats import recorded_run, timer, count, record
+from season_table import SeasonTable
+from game_store import cached_partitions, save_week, load_games, load_manifest, save_manifest, week_is_settled, first_unsettled_year
+
+@recorded_run('gather_game_data')
+def gather_game_data(configuration, cache=None, provider_priority=('consensus',), restatement_weeks=3, seasons=None, rolling=False):
     '''Takes in the configuration for the cfb data api and returns statistics organized by college football game for use
-    in the model. Also backs up gathered data for faster processing.'''
+    in the model as a DataFrame with one row per game. Gathered data is backed up week by week in the game store for
+    faster processing. Raw API responses go through a ResponseCache, so rebuilding the game data only needs network
+    calls for data not already on disk. Spreads are taken from the betting providers in provider_priority order.
+    Updates are incremental: weeks are marked settled once they are more than restatement_weeks behind the latest
+    played week, or their season is over, and settled weeks are never fetched or processed again. Every request goes
+    to configuration.host, which api_replay points at a local stand-in for offline runs. With rolling, windows of weeks
+    are derived from one stats request per week, as in process_games, which cuts the requests of a refill of many
+    seasons.'''
     
+    import cfbd
+    if cache is None:
+        cache = ResponseCache()
+    if seasons is None:
+        seasons = SeasonTable()
     api_config = cfbd.ApiClient(configuration)
     headers = {'Authorization': configuration.api_key_prefix['Authorization'] + ' ' + configuration.api_key['Authorization']} 
 
-    # Some useful shortcuts
-    teams_api = cfbd.TeamsApi(api_config)
-    ratings_api = cfbd.RatingsApi(api_config)
     games_api = cfbd.GamesApi(api_config)
-    stats_api = cfbd.StatsApi(api_config)
     betting_api = cfbd.BettingApi(api_config)
 
-    if os.path.isfile('CFBGameData.dat'):
-        with open("CFBGameData.dat",'rb') as f:
-            cached_games = pickle.load(f) # Multi-level dictionary. 
-                                        #Outer level is year of game, then week, then game id keying a dictionary of game data
-    else:
-        cached_games = {2013:{0:{}}}
-
+    cached_partitions() # Migrates an old CFBGameData.dat if the game store is empty
+    manifest = load_manifest() # Dictionary of year to week to that week's watermark
 
     current_year = datetime.now().year
-    max_year_in_cache = max(cached_games.keys())
-    max_week_in_cache = max(cached_games[max_year_in_cache].keys())
-
-    lines = []
-    games = []
-
-    if current_year != max_year_in_cache:
-        add = 1
-    else:
-        add = 0
-
-    for year in range(max_year_in_cache, current_year + add):
-        print('Gathering games from ', year)
-        response = games_api.get_games(year=year)
-        games = [*games, *response]
-
-        response = betting_api.get_lines(year=year)
-        lines = [*lines, *response]
-
-    games2 = [
-        dict(
-            gid = g.id,
-            year = g.season,
-            week = g.week,
-            neutral_site = g.neutral_site,
-            home_team = g.home_team,
-            home_conference = g.home_conference,
-            home_points = g.home_points,
-            home_elo = g.home_pregame_elo,
-            away_team = g.away_team,
-            away_conference = g.away_conference,
-            away_points = g.away_points,
-            away_elo = g.away_pregame_elo
-        ) for g in games if g.home_points is not None and g.away_points is not None]
-
-    for game in games2:
-        game['margin'] = game['away_points'] - game['home_points'] # Create margin of victory statistic
-
-    for game in games2:
-        # This loop finds game betting data for games that have it
-        game_lines = [l for l in lines if l.id == game['gid']]
-        if len(game_lines) > 0:
-            game_line = [l for l in game_lines[0].lines if l.provider == 'consensus']
-            if len(game_line) == 0 or game_line[0].spread is None:
-                if len(game_lines[0].lines) > 0:
-                    game_line = [game_lines[0].lines[0]]
-            if len(game_line) > 0 and game_line[0].spread is not None:
-                game['spread'] = float(game_line[0].spread)
-
-    headers = {'Authorization': configuration.api_key_prefix['Authorization'] + ' ' + configuration.api_key['Authorization']} 
-    games2 = process_games(games2, headers)
-
-    max_year_in_games2 = max([games2[i]['year'] for i in range(len(games2))])
-    
-    stat_keys = ['year', 'week', 'neutral_site', 'home_team', 'home_conference', 'home_points', 'home_elo', 'away_team', 'away_conference', 'away_points', 'away_elo', 'margin', 'spread', ('home', 'rushingYards'), ('home', 'rushingTDs'), ('home', 'passAttempts'), ('home', 'passingTDs'), ('home', 'games'), ('home', 'puntReturnTDs'), ('home', 'firstDowns'), ('home', 'sacks'), ('home', 'interceptionTDs'), ('home', 'kickReturnTDs'), ('home', 'totalYards'), ('home', 'fourthDownConversions'),('home', 'rushingAttempts'),('home', 'possessionTime'),('home', 'fourthDowns'),('home', 'tacklesForLoss'),('home', 'puntReturnYards'),('home', 'passCompletions'),('home', 'puntReturns'),('home', 'kickReturns'),('home', 'thirdDownConversions'),('home', 'fumblesRecovered'),('home', 'passesIntercepted'),('home', 'thirdDowns'),('home', 'kickReturnYards'),('home', 'interceptions'),('home', 'turnovers'),('home', 'penaltyYards'),('home', 'fumblesLost'),('home', 'netPassingYards'),('home', 'penalties'),('home', 'interceptionYards'),('home', 'defense', 'plays', 'perPlay'),('home', 'defense', 'plays'),('home', 'defense', 'drives', 'perPlay'),('home', 'defense', 'drives'),('home', 'defense', 'ppa'),('home', 'defense', 'totalPPA', 'perPlay'),('home', 'defense', 'totalPPA'),('home', 'defense', 'successRate'),('home', 'defense', 'explosiveness'),('home', 'defense', 'powerSuccess'),('home', 'defense', 'stuffRate'),('home', 'defense', 'lineYards'),('home', 'defense', 'lineYardsTotal', 'perPlay'),('home', 'defense', 'lineYardsTotal'),('home', 'defense', 'secondLevelYards'),('home', 'defense', 'secondLevelYardsTotal', 'perPlay'),('home', 'defense', 'secondLevelYardsTotal'),('home', 'defense', 'openFieldYards'),('home', 'defense', 'openFieldYardsTotal', 'perPlay'),('home', 'defense', 'openFieldYardsTotal'),('home', 'defense', 'totalOpportunies', 'perPlay'),('home', 'defense', 'totalOpportunies'),('home', 'defense', 'pointsPerOpportunity'),('home', 'defense', 'fieldPosition', 'averageStart'),('home', 'defense', 'fieldPosition', 'averagePredictedPoints'),('home', 'defense', 'havoc', 'total'),('home', 'defense', 'havoc', 'frontSeven'),('home', 'defense', 'havoc', 'db'),('home', 'defense', 'standardDowns', 'rate'),('home', 'defense', 'standardDowns', 'ppa'),('home', 'defense', 'standardDowns', 'successRate'),('home', 'defense', 'standardDowns', 'explosiveness'),('home', 'defense', 'passingDowns', 'rate'),('home', 'defense', 'passingDowns', 'ppa'),('home', 'defense', 'passingDowns', 'totalPPA', 'perPlay'),('home', 'defense', 'passingDowns', 'totalPPA'),('home', 'defense', 'passingDowns', 'successRate'),('home', 'defense', 'passingDowns', 'explosiveness'),('home', 'defense', 'rushingPlays', 'rate'),('home', 'defense', 'rushingPlays', 'ppa'),('home', 'defense', 'rushingPlays', 'totalPPA', 'perPlay'),('home', 'defense', 'rushingPlays', 'totalPPA'),('home', 'defense', 'rushingPlays', 'successRate'),('home', 'defense', 'rushingPlays', 'explosiveness'),('home', 'defense', 'passingPlays', 'rate'),('home', 'defense', 'passingPlays', 'ppa'),('home', 'defense', 'passingPlays', 'totalPPA', 'perPlay'),('home', 'defense', 'passingPlays', 'totalPPA'),('home', 'defense', 'passingPlays', 'successRate'),('home', 'defense', 'passingPlays', 'explosiveness'),('home', 'offense', 'plays', 'perPlay'),('home', 'offense', 'plays'),('home', 'offense', 'drives', 'perPlay'),('home', 'offense', 'drives'),('home', 'offense', 'ppa'),('home', 'offense', 'totalPPA', 'perPlay'),('home', 'offense', 'totalPPA'),('home', 'offense', 'successRate'),('home', 'offense', 'explosiveness'),('home', 'offense', 'powerSuccess'),('home', 'offense', 'stuffRate'),('home', 'offense', 'lineYards'),('home', 'offense', 'lineYardsTotal', 'perPlay'),('home', 'offense', 'lineYardsTotal'),('home', 'offense', 'secondLevelYards'),('home', 'offense', 'secondLevelYardsTotal', 'perPlay'),('home', 'offense', 'secondLevelYardsTotal'),('home', 'offense', 'openFieldYards'),('home', 'offense', 'openFieldYardsTotal', 'perPlay'),('home', 'offense', 'openFieldYardsTotal'),('home', 'offense', 'totalOpportunies', 'perPlay'),('home', 'offense', 'totalOpportunies'),('home', 'offense', 'pointsPerOpportunity'),('home', 'offense', 'fieldPosition', 'averageStart'),('home', 'offense', 'fieldPosition', 'averagePredictedPoints'),('home', 'offense', 'havoc', 'total'),('home', 'offense', 'havoc', 'frontSeven'),('home', 'offense', 'havoc', 'db'),('home', 'offense', 'standardDowns', 'rate'),('home', 'offense', 'standardDowns', 'ppa'),('home', 'offense', 'standardDowns', 'successRate'),('home', 'offense', 'standardDowns', 'explosiveness'),('home', 'offense', 'passingDowns', 'rate'),('home', 'offense', 'passingDowns', 'ppa'),('home', 'offense', 'passingDowns', 'successRate'),('home', 'offense', 'passingDowns', 'explosiveness'),('home', 'offense', 'rushingPlays', 'rate'),('home', 'offense', 'rushingPlays', 'ppa'),('home', 'offense', 'rushingPlays', 'totalPPA', 'perPlay'),('home', 'offense', 'rushingPlays', 'totalPPA'),('home', 'offense', 'rushingPlays', 'successRate'),('home', 'offense', 'rushingPlays', 'explosiveness'),('home', 'offense', 'passingPlays', 'rate'),('home', 'offense', 'passingPlays', 'ppa'),('home', 'offense', 'passingPlays', 'totalPPA', 'perPlay'),('home', 'offense', 'passingPlays', 'totalPPA'),('home', 'offense', 'passingPlays', 'successRate'),('home', 'offense', 'passingPlays', 'explosiveness'),('away', 'rushingYards'),('away', 'rushingTDs'),('away', 'passAttempts'),('away', 'passingTDs'),('away', 'games'),('away', 'puntReturnTDs'),('away', 'firstDowns'),('away', 'sacks'),('away', 'interceptionTDs'),('away', 'kickReturnTDs'),('away', 'totalYards'),('away', 'fourthDownConversions'),('away', 'rushingAttempts'),('away', 'possessionTime'),('away', 'fourthDowns'),('away', 'tacklesForLoss'),('away', 'puntReturnYards'),('away', 'passCompletions'),('away', 'puntReturns'),('away', 'kickReturns'),('away', 'thirdDownConversions'),('away', 'fumblesRecovered'),('away', 'passesIntercepted'),('away', 'thirdDowns'),('away', 'kickReturnYards'),('away', 'interceptions'),('away', 'turnovers'),('away', 'penaltyYards'),('away', 'fumblesLost'),('away', 'netPassingYards'),('away', 'penalties'),('away', 'interceptionYards'),('away', 'defense', 'plays', 'perPlay'),('away', 'defense', 'plays'),('away', 'defense', 'drives', 'perPlay'),('away', 'defense', 'drives'),('away', 'defense', 'ppa'),('away', 'defense', 'totalPPA', 'perPlay'),('away', 'defense', 'totalPPA'),('away', 'defense', 'successRate'),('away', 'defense', 'explosiveness'),('away', 'defense', 'powerSuccess'),('away', 'defense', 'stuffRate'),('away', 'defense', 'lineYards'),('away', 'defense', 'lineYardsTotal', 'perPlay'),('away', 'defense', 'lineYardsTotal'),('away', 'defense', 'secondLevelYards'),('away', 'defense', 'secondLevelYardsTotal', 'perPlay'),('away', 'defense', 'secondLevelYardsTotal'),('away', 'defense', 'openFieldYards'),('away', 'defense', 'openFieldYardsTotal', 'perPlay'),('away', 'defense', 'openFieldYardsTotal'),('away', 'defense', 'totalOpportunies', 'perPlay'),('away', 'defense', 'totalOpportunies'),('away', 'defense', 'pointsPerOpportunity'),('away', 'defense', 'fieldPosition', 'averageStart'),('away', 'defense', 'fieldPosition', 'averagePredictedPoints'),('away', 'defense', 'havoc', 'total'),('away', 'defense', 'havoc', 'frontSeven'),('away', 'defense', 'havoc', 'db'),('away', 'defense', 'standardDowns', 'rate'),('away', 'defense', 'standardDowns', 'ppa'),('away', 'defense', 'standardDowns', 'successRate'),('away', 'defense', 'standardDowns', 'explosiveness'),('away', 'defense', 'passingDowns', 'rate'),('away', 'defense', 'passingDowns', 'ppa'),('away', 'defense', 'passingDowns', 'totalPPA', 'perPlay'),('away', 'defense', 'passingDowns', 'totalPPA'),('away', 'defense', 'passingDowns', 'successRate'),('away', 'defense', 'passingDowns', 'explosiveness'),('away', 'defense', 'rushingPlays', 'rate'),('away', 'defense', 'rushingPlays', 'ppa'),('away', 'defense', 'rushingPlays', 'totalPPA', 'perPlay'),('away', 'defense', 'rushingPlays', 'totalPPA'),('away', 'defense', 'rushingPlays', 'successRate'),('away', 'defense', 'rushingPlays', 'explosiveness'),('away', 'defense', 'passingPlays', 'rate'),('away', 'defense', 'passingPlays', 'ppa'),('away', 'defense', 'passingPlays', 'totalPPA', 'perPlay'),('away', 'defense', 'passingPlays', 'totalPPA'),('away', 'defense', 'passingPlays', 'successRate'),('away', 'defense', 'passingPlays', 'explosiveness'),('away', 'offense', 'plays', 'perPlay'),('away', 'offense', 'plays'),('away', 'offense', 'drives', 'perPlay'),('away', 'offense', 'drives'),('away', 'offense', 'ppa'),('away', 'offense', 'totalPPA', 'perPlay'),('away', 'offense', 'totalPPA'),('away', 'offense', 'successRate'),('away', 'offense', 'explosiveness'),('away', 'offense', 'powerSuccess'),('away', 'offense', 'stuffRate'),('away', 'offense', 'lineYards'),('away', 'offense', 'lineYardsTotal', 'perPlay'),('away', 'offense', 'lineYardsTotal'),('away', 'offense', 'secondLevelYards'),('away', 'offense', 'secondLevelYardsTotal', 'perPlay'),('away', 'offense', 'secondLevelYardsTotal'),('away', 'offense', 'openFieldYards'),('away', 'offense', 'openFieldYardsTotal', 'perPlay'),('away', 'offense', 'openFieldYardsTotal'),('away', 'offense', 'totalOpportunies', 'perPlay'),('away', 'offense', 'totalOpportunies'),('away', 'offense', 'pointsPerOpportunity'),('away', 'offense', 'fieldPosition', 'averageStart'),('away', 'offense', 'fieldPosition', 'averagePredictedPoints'),('away', 'offense', 'havoc', 'total'),('away', 'offense', 'havoc', 'frontSeven'),('away', 'offense', 'havoc', 'db'),('away', 'offense', 'standardDowns', 'rate'),('away', 'offense', 'standardDowns', 'ppa'),('away', 'offense', 'standardDowns', 'successRate'),('away', 'offense', 'standardDowns', 'explosiveness'),('away', 'offense', 'passingDowns', 'rate'),('away', 'offense', 'passingDowns', 'ppa'),('away', 'offense', 'passingDowns', 'successRate'),('away', 'offense', 'passingDowns', 'explosiveness'),('away', 'offense', 'rushingPlays', 'rate'),('away', 'offense', 'rushingPlays', 'ppa'),('away', 'offense', 'rushingPlays', 'totalPPA', 'perPlay'),('away', 'offense', 'rushingPlays', 'totalPPA'),('away', 'offense', 'rushingPlays', 'successRate'),('away', 'offense', 'rushingPlays', 'explosiveness'),('away', 'offense', 'passingPlays', 'rate'),('away', 'offense', 'passingPlays', 'ppa'),('away', 'offense', 'passingPlays', 'totalPPA', 'perPlay'),('away', 'offense', 'passingPlays', 'totalPPA'),('away', 'offense', 'passingPlays', 'successRate'),('away', 'offense', 'passingPlays', 'explosiveness')]
-    
-    for year in range(max_year_in_cache,max_year_in_games2+1):
-        print('Adding games to cache from ', year)
-        cached_games[year] = {}
-        max_week = max([games2[i]['week'] for i in range(len(games2)) if games2[i]['year']==year])
-        for week in range(0,max_week+1): # Possibly refilling old data, data gets updates for a few weeks after games
-            cached_games[year][week] = {}
-            for game in games2:
-                if game['week'] == week and game['year'] == year:
-                    # Some missing data checked below
-#                     for stat in stat_keys:
-#                         if stat not in game.keys() and stat not in do_not_impute_zeros:
-#                             game[stat] = 0
-
-                    cached_games[year][week][game['gid']] = {key:game[key] for key in game if key!='gid'} # Don't need ID data
-    
-    with open("CFBGameData.dat",'wb') as f:
-        pickle.dump(cached_games,f)
-        
-    return cached_games
+    start_year = first_unsettled_year(manifest, current_year)
+    latest_week = {} # Year to its latest played week, filled in as each season's games are fetched
+
+    # Games are fetched a season at a time and flow through processing a week at a time, each week saved as soon as
+    # its stats are filled in, so an interrupted run picks up after the last week it saved
+    games2 = iter_unsettled_games(cache, api_config, games_api, betting_api, range(start_year, current_year + 1), manifest, latest_week, provider_priority)
+    saved = set() # (year, week) of every week saved this run
+    with timer('process games'):
+        for year, week, week_games in iter_processed_weeks(games2, headers, cache=cache, rolling=rolling, base_url=configuration.host, seasons=seasons):
+            save_game_week(manifest, week_games, year, week, latest_week[year], restatement_weeks)
+            saved.add((year, week))
+    print('Response cache: ', cache.stats())
+    record('response_cache', cache.stats())
+    if len(saved) == 0:
+        print('All weeks are settled, nothing to update.')
+
+    with timer('save weeks'):
+        for year in sorted(latest_week):
+            print('Adding games to cache from ', year)
+            for week in range(0,latest_week[year]+1): # Possibly refilling old data, data gets updates for a few weeks after games
+                if not week_is_settled(manifest, year, week) and (year, week) not in saved: # Weeks without finished games are saved empty
+                    save_game_week(manifest, [], year, week, latest_week[year], restatement_weeks)
+
+    with timer('load games'):
+        return load_games()
 	
-def gather_new_game_data(configuration):
+@recorded_run('gather_new_game_data')
+def gather_new_game_data(configuration, cache=None, provider_priority=('consensus',), seasons=None):
     '''Takes in the configuration for the cfb data api and returns statistics organized by college football game for use
-    in predictions.'''
+    in predictions. Raw API responses go through a ResponseCache, and last season's stats come from the SeasonTable
+    once any run has extracted them. Spreads are taken from the betting providers in provider_priority order.'''
     
+    import cfbd
+    if cache is None:
+        cache = ResponseCache()
+    if seasons is None:
+        seasons = SeasonTable()
     api_config = cfbd.ApiClient(configuration)
     headers = {'Authorization': configuration.api_key_prefix['Authorization'] + ' ' + configuration.api_key['Authorization']} 
 
-    # Some useful shortcuts
-    teams_api = cfbd.TeamsApi(api_config)
-    ratings_api = cfbd.RatingsApi(api_config)
     games_api = cfbd.GamesApi(api_config)
-    stats_api = cfbd.StatsApi(api_config)
     betting_api = cfbd.BettingApi(api_config)
 
 
-    if os.path.isfile('CFBGameData.dat'):
-        with open("CFBGameData.dat",'rb') as f:
-            cached_games = pickle.load(f) # Multi-level dictionary. 
-                                        #Outer level is year of game, then week, then game id keying a dictionary of game data
-    else:
-        cached_games = {2013:{0:{}}}
+    partitions = cached_partitions() # Dictionary of year to the weeks stored in the game store
 
-    print(cached_games.keys())
+    print(partitions.keys())
     current_year = datetime.now().year
-    max_year_in_cache = max(cached_games.keys())
-    max_week_in_cache = max(cached_games[max_year_in_cache].keys())
+    max_year_in_cache = max(partitions.keys())
+    max_week_in_cache = max(partitions[max_year_in_cache])
 
     lines = []
     games = []
@@ -141,12 +95,13 @@ def gather_new_game_data(configuration):
     else:
         week = 1
         
-    print('Gathering games')
-    response = games_api.get_games(year=year, week=week)
-    games = [*games, *response]
+    with timer('fetch games and lines'):
+        print('Gathering games')
+        response = cached_api_call(cache, api_config, games_api.get_games, '/games', 'list[Game]', year=year, week=week)
+        games = [*games, *response]
 
-    response = betting_api.get_lines(year=year, week=week)
-    lines = [*lines, *response]
+        response = cached_api_call(cache, api_config, betting_api.get_lines, '/lines', 'list[GameLines]', year=year, week=week)
+        lines = [*lines, *response]
 
     games2 = [
         dict(
@@ -164,23 +119,13 @@ def gather_new_game_data(configuration):
             away_elo = g.away_pregame_elo
         ) for g in games if g.home_points is None and g.away_points is None]
 
-    for game in games2:
-        # This loop finds game betting data for games that have it
-        game_lines = [l for l in lines if l.id == game['gid']]
-        if len(game_lines) > 0:
-            game_line = [l for l in game_lines[0].lines if l.provider == 'consensus']
-            if len(game_line) == 0 or game_line[0].spread is None:
-                if len(game_lines[0].lines) > 0:
-                    game_line = [game_lines[0].lines[0]]
-            if len(game_line) > 0 and game_line[0].spread is not None:
-                game['spread'] = float(game_line[0].spread)
-
-    games2 = process_games(games2, headers)
-
-    max_year_in_games2 = max([games2[i]['year'] for i in range(len(games2))])
-    
-    stat_keys = ['year', 'week', 'neutral_site', 'home_team', 'home_conference', 'home_points', 'home_elo', 'away_team', 'away_conference', 'away_points', 'away_elo', 'margin', 'spread', ('home', 'rushingYards'), ('home', 'rushingTDs'), ('home', 'passAttempts'), ('home', 'passingTDs'), ('home', 'games'), ('home', 'puntReturnTDs'), ('home', 'firstDowns'), ('home', 'sacks'), ('home', 'interceptionTDs'), ('home', 'kickReturnTDs'), ('home', 'totalYards'), ('home', 'fourthDownConversions'),('home', 'rushingAttempts'),('home', 'possessionTime'),('home', 'fourthDowns'),('home', 'tacklesForLoss'),('home', 'puntReturnYards'),('home', 'passCompletions'),('home', 'puntReturns'),('home', 'kickReturns'),('home', 'thirdDownConversions'),('home', 'fumblesRecovered'),('home', 'passesIntercepted'),('home', 'thirdDowns'),('home', 'kickReturnYards'),('home', 'interceptions'),('home', 'turnovers'),('home', 'penaltyYards'),('home', 'fumblesLost'),('home', 'netPassingYards'),('home', 'penalties'),('home', 'interceptionYards'),('home', 'defense', 'plays', 'perPlay'),('home', 'defense', 'plays'),('home', 'defense', 'drives', 'perPlay'),('home', 'defense', 'drives'),('home', 'defense', 'ppa'),('home', 'defense', 'totalPPA', 'perPlay'),('home', 'defense', 'totalPPA'),('home', 'defense', 'successRate'),('home', 'defense', 'explosiveness'),('home', 'defense', 'powerSuccess'),('home', 'defense', 'stuffRate'),('home', 'defense', 'lineYards'),('home', 'defense', 'lineYardsTotal', 'perPlay'),('home', 'defense', 'lineYardsTotal'),('home', 'defense', 'secondLevelYards'),('home', 'defense', 'secondLevelYardsTotal', 'perPlay'),('home', 'defense', 'secondLevelYardsTotal'),('home', 'defense', 'openFieldYards'),('home', 'defense', 'openFieldYardsTotal', 'perPlay'),('home', 'defense', 'openFieldYardsTotal'),('home', 'defense', 'totalOpportunies', 'perPlay'),('home', 'defense', 'totalOpportunies'),('home', 'defense', 'pointsPerOpportunity'),('home', 'defense', 'fieldPosition', 'averageStart'),('home', 'defense', 'fieldPosition', 'averagePredictedPoints'),('home', 'defense', 'havoc', 'total'),('home', 'defense', 'havoc', 'frontSeven'),('home', 'defense', 'havoc', 'db'),('home', 'defense', 'standardDowns', 'rate'),('home', 'defense', 'standardDowns', 'ppa'),('home', 'defense', 'standardDowns', 'successRate'),('home', 'defense', 'standardDowns', 'explosiveness'),('home', 'defense', 'passingDowns', 'rate'),('home', 'defense', 'passingDowns', 'ppa'),('home', 'defense', 'passingDowns', 'totalPPA', 'perPlay'),('home', 'defense', 'passingDowns', 'totalPPA'),('home', 'defense', 'passingDowns', 'successRate'),('home', 'defense', 'passingDowns', 'explosiveness'),('home', 'defense', 'rushingPlays', 'rate'),('home', 'defense', 'rushingPlays', 'ppa'),('home', 'defense', 'rushingPlays', 'totalPPA', 'perPlay'),('home', 'defense', 'rushingPlays', 'totalPPA'),('home', 'defense', 'rushingPlays', 'successRate'),('home', 'defense', 'rushingPlays', 'explosiveness'),('home', 'defense', 'passingPlays', 'rate'),('home', 'defense', 'passingPlays', 'ppa'),('home', 'defense', 'passingPlays', 'totalPPA', 'perPlay'),('home', 'defense', 'passingPlays', 'totalPPA'),('home', 'defense', 'passingPlays', 'successRate'),('home', 'defense', 'passingPlays', 'explosiveness'),('home', 'offense', 'plays', 'perPlay'),('home', 'offense', 'plays'),('home', 'offense', 'drives', 'perPlay'),('home', 'offense', 'drives'),('home', 'offense', 'ppa'),('home', 'offense', 'totalPPA', 'perPlay'),('home', 'offense', 'totalPPA'),('home', 'offense', 'successRate'),('home', 'offense', 'explosiveness'),('home', 'offense', 'powerSuccess'),('home', 'offense', 'stuffRate'),('home', 'offense', 'lineYards'),('home', 'offense', 'lineYardsTotal', 'perPlay'),('home', 'offense', 'lineYardsTotal'),('home', 'offense', 'secondLevelYards'),('home', 'offense', 'secondLevelYardsTotal', 'perPlay'),('home', 'offense', 'secondLevelYardsTotal'),('home', 'offense', 'openFieldYards'),('home', 'offense', 'openFieldYardsTotal', 'perPlay'),('home', 'offense', 'openFieldYardsTotal'),('home', 'offense', 'totalOpportunies', 'perPlay'),('home', 'offense', 'totalOpportunies'),('home', 'offense', 'pointsPerOpportunity'),('home', 'offense', 'fieldPosition', 'averageStart'),('home', 'offense', 'fieldPosition', 'averagePredictedPoints'),('home', 'offense', 'havoc', 'total'),('home', 'offense', 'havoc', 'frontSeven'),('home', 'offense', 'havoc', 'db'),('home', 'offense', 'standardDowns', 'rate'),('home', 'offense', 'standardDowns', 'ppa'),('home', 'offense', 'standardDowns', 'successRate'),('home', 'offense', 'standardDowns', 'explosiveness'),('home', 'offense', 'passingDowns', 'rate'),('home', 'offense', 'passingDowns', 'ppa'),('home', 'offense', 'passingDowns', 'successRate'),('home', 'offense', 'passingDowns', 'explosiveness'),('home', 'offense', 'rushingPlays', 'rate'),('home', 'offense', 'rushingPlays', 'ppa'),('home', 'offense', 'rushingPlays', 'totalPPA', 'perPlay'),('home', 'offense', 'rushingPlays', 'totalPPA'),('home', 'offense', 'rushingPlays', 'successRate'),('home', 'offense', 'rushingPlays', 'explosiveness'),('home', 'offense', 'passingPlays', 'rate'),('home', 'offense', 'passingPlays', 'ppa'),('home', 'offense', 'passingPlays', 'totalPPA', 'perPlay'),('home', 'offense', 'passingPlays', 'totalPPA'),('home', 'offense', 'passingPlays', 'successRate'),('home', 'offense', 'passingPlays', 'explosiveness'),('away', 'rushingYards'),('away', 'rushingTDs'),('away', 'passAttempts'),('away', 'passingTDs'),('away', 'games'),('away', 'puntReturnTDs'),('away', 'firstDowns'),('away', 'sacks'),('away', 'interceptionTDs'),('away', 'kickReturnTDs'),('away', 'totalYards'),('away', 'fourthDownConversions'),('away', 'rushingAttempts'),('away', 'possessionTime'),('away', 'fourthDowns'),('away', 'tacklesForLoss'),('away', 'puntReturnYards'),('away', 'passCompletions'),('away', 'puntReturns'),('away', 'kickReturns'),('away', 'thirdDownConversions'),('away', 'fumblesRecovered'),('away', 'passesIntercepted'),('away', 'thirdDowns'),('away', 'kickReturnYards'),('away', 'interceptions'),('away', 'turnovers'),('away', 'penaltyYards'),('away', 'fumblesLost'),('away', 'netPassingYards'),('away', 'penalties'),('away', 'interceptionYards'),('away', 'defense', 'plays', 'perPlay'),('away', 'defense', 'plays'),('away', 'defense', 'drives', 'perPlay'),('away', 'defense', 'drives'),('away', 'defense', 'ppa'),('away', 'defense', 'totalPPA', 'perPlay'),('away', 'defense', 'totalPPA'),('away', 'defense', 'successRate'),('away', 'defense', 'explosiveness'),('away', 'defense', 'powerSuccess'),('away', 'defense', 'stuffRate'),('away', 'defense', 'lineYards'),('away', 'defense', 'lineYardsTotal', 'perPlay'),('away', 'defense', 'lineYardsTotal'),('away', 'defense', 'secondLevelYards'),('away', 'defense', 'secondLevelYardsTotal', 'perPlay'),('away', 'defense', 'secondLevelYardsTotal'),('away', 'defense', 'openFieldYards'),('away', 'defense', 'openFieldYardsTotal', 'perPlay'),('away', 'defense', 'openFieldYardsTotal'),('away', 'defense', 'totalOpportunies', 'perPlay'),('away', 'defense', 'totalOpportunies'),('away', 'defense', 'pointsPerOpportunity'),('away', 'defense', 'fieldPosition', 'averageStart'),('away', 'defense', 'fieldPosition', 'averagePredictedPoints'),('away', 'defense', 'havoc', 'total'),('away', 'defense', 'havoc', 'frontSeven'),('away', 'defense', 'havoc', 'db'),('away', 'defense', 'standardDowns', 'rate'),('away', 'defense', 'standardDowns', 'ppa'),('away', 'defense', 'standardDowns', 'successRate'),('away', 'defense', 'standardDowns', 'explosiveness'),('away', 'defense', 'passingDowns', 'rate'),('away', 'defense', 'passingDowns', 'ppa'),('away', 'defense', 'passingDowns', 'totalPPA', 'perPlay'),('away', 'defense', 'passingDowns', 'totalPPA'),('away', 'defense', 'passingDowns', 'successRate'),('away', 'defense', 'passingDowns', 'explosiveness'),('away', 'defense', 'rushingPlays', 'rate'),('away', 'defense', 'rushingPlays', 'ppa'),('away', 'defense', 'rushingPlays', 'totalPPA', 'perPlay'),('away', 'defense', 'rushingPlays', 'totalPPA'),('away', 'defense', 'rushingPlays', 'successRate'),('away', 'defense', 'rushingPlays', 'explosiveness'),('away', 'defense', 'passingPlays', 'rate'),('away', 'defense', 'passingPlays', 'ppa'),('away', 'defense', 'passingPlays', 'totalPPA', 'perPlay'),('away', 'defense', 'passingPlays', 'totalPPA'),('away', 'defense', 'passingPlays', 'successRate'),('away', 'defense', 'passingPlays', 'explosiveness'),('away', 'offense', 'plays', 'perPlay'),('away', 'offense', 'plays'),('away', 'offense', 'drives', 'perPlay'),('away', 'offense', 'drives'),('away', 'offense', 'ppa'),('away', 'offense', 'totalPPA', 'perPlay'),('away', 'offense', 'totalPPA'),('away', 'offense', 'successRate'),('away', 'offense', 'explosiveness'),('away', 'offense', 'powerSuccess'),('away', 'offense', 'stuffRate'),('away', 'offense', 'lineYards'),('away', 'offense', 'lineYardsTotal', 'perPlay'),('away', 'offense', 'lineYardsTotal'),('away', 'offense', 'secondLevelYards'),('away', 'offense', 'secondLevelYardsTotal', 'perPlay'),('away', 'offense', 'secondLevelYardsTotal'),('away', 'offense', 'openFieldYards'),('away', 'offense', 'openFieldYardsTotal', 'perPlay'),('away', 'offense', 'openFieldYardsTotal'),('away', 'offense', 'totalOpportunies', 'perPlay'),('away', 'offense', 'totalOpportunies'),('away', 'offense', 'pointsPerOpportunity'),('away', 'offense', 'fieldPosition', 'averageStart'),('away', 'offense', 'fieldPosition', 'averagePredictedPoints'),('away', 'offense', 'havoc', 'total'),('away', 'offense', 'havoc', 'frontSeven'),('away', 'offense', 'havoc', 'db'),('away', 'offense', 'standardDowns', 'rate'),('away', 'offense', 'standardDowns', 'ppa'),('away', 'offense', 'standardDowns', 'successRate'),('away', 'offense', 'standardDowns', 'explosiveness'),('away', 'offense', 'passingDowns', 'rate'),('away', 'offense', 'passingDowns', 'ppa'),('away', 'offense', 'passingDowns', 'successRate'),('away', 'offense', 'passingDowns', 'explosiveness'),('away', 'offense', 'rushingPlays', 'rate'),('away', 'offense', 'rushingPlays', 'ppa'),('away', 'offense', 'rushingPlays', 'totalPPA', 'perPlay'),('away', 'offense', 'rushingPlays', 'totalPPA'),('away', 'offense', 'rushingPlays', 'successRate'),('away', 'offense', 'rushingPlays', 'explosiveness'),('away', 'offense', 'passingPlays', 'rate'),('away', 'offense', 'passingPlays', 'ppa'),('away', 'offense', 'passingPlays', 'totalPPA', 'perPlay'),('away', 'offense', 'passingPlays', 'totalPPA'),('away', 'offense', 'passingPlays', 'successRate'),('away', 'offense', 'passingPlays', 'explosiveness')]
-    
+    add_spreads(games2, lines, provider_priority) # Finds game betting data for games that have it
+
+    with timer('process games'):
+        games2 = process_games(games2, headers, cache=cache, base_url=configuration.host, seasons=seasons)
+    print('Response cache: ', cache.stats())
+    record('response_cache', cache.stats())
+
     print('Adding games to output dictionary.')
     new_games = []
     for game in games2:
@@ -188,447 +133,168 @@ def gather_new_game_data(configuration):
         
     return new_games
 	
-def process_games(games, headers):
-    '''Takes in a list of games, where each game is a dictionary of game information. Populates that list with game stats. '''
-    
-    count = 0
-    curr_week_year = (0,0)
-    base_url = 'https://api.collegefootballdata.com'
-    total_stats = [('defense', 'plays'),('defense', 'drives'),('defense', 'totalPPA'),('defense', 'lineYardsTotal'),('defense', 'secondLevelYardsTotal'),
-             ('defense', 'openFieldYardsTotal'),('defense', 'totalOpportunies'),('defense','passingDowns', 'totalPPA'),('defense','rushingPlays', 'totalPPA'),
-              ('defense', 'passingPlays', 'totalPPA'),('offense', 'plays'),('offense', 'drives'),('offense', 'totalPPA'),('offense', 'lineYardsTotal'),
-              ('offense', 'secondLevelYardsTotal'),('offense', 'openFieldYardsTotal'),('offense', 'totalOpportunies'),('offense','passingDowns', 'totalPPA'),
-              ('offense','rushingPlays', 'totalPPA'),('offense', 'passingPlays', 'totalPPA')] # For normalizing advanced stats
-    
-    
-    for game in games:
-        year = game['year']
-        week = game['week']
-        home_team = game['home_team']
-        away_team = game['away_team']
-        
-        old_week, old_year = curr_week_year
-        if old_year != year and year > 2013 and old_year > 0:
-            old_season_stats = season_stats
-            old_advanced_stats = advanced_stats
-        elif old_year == 0 and year > 2013:
-            old_season_stats = [] # This will be all stats from the season endpoint
-            old_advanced_stats = [] # This will be all stats from the season/advanced endpoint
-            endpoint = "/stats/season"
-            params = {
-                        "year": year-1,
-                        "excludeGarbageTime" : True
-                    }
-            response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code != 200:
-                print('AHHHH', response)
-            old_season_stats = response.json()
-            endpoint = "/stats/season/advanced"
-            response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-            old_advanced_stats = response.json()
-        
-        if (week,year) != curr_week_year and (year != 2014 or week != 2): # Site has an error for 2014 week 2
-            season_stats = [] # This will be all stats from the season endpoint
-            advanced_stats = [] # This will be all stats from the season/advanced endpoint
-            print('Compiling games from week, year: ', week,year)
-            curr_week_year = (week,year)
-            if week > 1:
-                endpoint = "/stats/season"
-                params = {
-                            "year": year,
-                            "endWeek" : week - 1,
-                            "excludeGarbageTime" : True
-                        }
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-
-                # Check if the request was successful (status code 200)
-                if response.status_code != 200:
-                    print('AHHHH', response)
-                season_stats = response.json()
-                endpoint = "/stats/season/advanced"
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-                advanced_stats = response.json()
-                
-                endpoint = "/stats/season"
-                params = {
-                            "year": year,
-                            "startWeek": max(week-3,1),
-                            "endWeek" : week - 1,
-                            "excludeGarbageTime" : True
-                        }
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-
-                # Check if the request was successful (status code 200)
-                if response.status_code != 200:
-                    print('AHHHH', response)
-                season_stats_last_3 = response.json()
-                endpoint = "/stats/season/advanced"
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-                advanced_stats_last_3 = response.json()
-            else:
-                # Need placeholder data that contains all the statistics
-                endpoint = "/stats/season"
-                params = {
-                            "year": 2022,
-                            "endWeek" : 5,
-                            "team" : 'Texas',
-                            "excludeGarbageTime" : True
-                        }
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-                season_stats = response.json()
-                season_stats_last_3 = response.json()
-                endpoint = "/stats/season/advanced"
-                response = requests.get(f"{base_url}{endpoint}", params=params, headers=headers)
-                advanced_stats = response.json()
-                advanced_stats_last_3 = response.json()
-        
+def iter_unsettled_games(cache, api_config, games_api, betting_api, years, manifest, latest_week, provider_priority=('consensus',)):
+    '''Fetches games and lines one season at a time and yields that season's finished games in weeks that aren't
+    settled yet, ordered by week, with their margin and spread. Each season's latest played week is recorded in
+    latest_week, and its weeks entered in the manifest, before its games are yielded.'''
 
-        if week > 1:
-            stat_dict = {}
-
-            for location in ['home','away']:
-
-                if location == 'home':
-                    idx_team1 = [i for i in range(len(season_stats)) if season_stats[i]['team'] == home_team]
-                    idx_team2 = [i for i in range(len(advanced_stats)) if advanced_stats[i]['team'] == home_team]
-                else:
-                    idx_team1 = [i for i in range(len(season_stats)) if season_stats[i]['team'] == away_team]
-                    idx_team2 = [i for i in range(len(advanced_stats)) if advanced_stats[i]['team'] == away_team]
-
-                if len(idx_team1) > 0:
-                    team_stats = np.array(season_stats)[idx_team1]
-                else:
-                    team_stats = []
-                if len(idx_team2) > 0:
-                    team_advanced_stats = [advanced_stats[idx_team2[0]]]
-                else:
-                    team_advanced_stats = []
-                    
-                # Below block normalizes team_stats statistics by games played
-                
-                for stat_idx, stat in enumerate(team_stats):
-                    if stat['statName'] == 'games':
-                        num_games = stat['statValue']
-                        
-                for stat in team_stats:
-                    if stat['statName'] == 'games':
-                        stat_dict[location+'_'+stat['statName']] = stat['statValue']
-                    else:
-                        stat_dict[location+'_'+stat['statName']] = stat['statValue'] / num_games
-                        
-                if len(team_advanced_stats) > 0:
-                    defense_stats = team_advanced_stats[0]['defense']
-                    defense_drives = defense_stats['drives']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    if defense_stats[name][name2] is not None: 
-                                        stat_per_drive = defense_stats[name][name2] / defense_drives
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2] = defense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2] = None
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2] = defense_stats[name][name2]
-                        else:
-                            if ('defense',name) in total_stats:
-                                if defense_stats[name] is not None:
-                                    stat_per_drive = defense_stats[name] / defense_drives
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'defense'+'_'+name] = defense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'defense'+'_'+name] = None
-                            else:
-                                stat_dict[location+'_'+'defense'+'_'+name] = defense_stats[name]
-                    offense_stats = team_advanced_stats[0]['offense']
-                    offense_drives = offense_stats['drives']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    if offense_stats[name][name2] is not None:
-                                        stat_per_drive = offense_stats[name][name2] / offense_drives
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2] = offense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2] = None
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2] = offense_stats[name][name2]
-                        else:
-                            if ('offense',name) in total_stats:
-                                if offense_stats[name] is not None:
-                                    stat_per_drive = offense_stats[name] / offense_drives
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'offense'+'_'+name] = offense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'offense'+'_'+name] = None
-                            else:
-                                stat_dict[location+'_'+'offense'+'_'+name] = offense_stats[name]
-        else:
-            stat_dict = {}
-            for location in ['home','away']:
-                for stat in season_stats:
-                    stat_dict[location+'_'+stat['statName']] = 0
-                if len(advanced_stats) > 0:
-                    defense_stats = advanced_stats[0]['defense']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+name2] = 0
-                        else:
-                            if ('defense',name) in total_stats:
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'defense'+'_'+name] = 0
-                    offense_stats = advanced_stats[0]['offense']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+name2] = 0
-                        else:
-                            if ('offense',name) in total_stats:
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'offense'+'_'+name] = 0
-                            
-        # ------------------------------------Last season stats.--------------------------------------------
-        
+    for year in years:
+        print('Gathering games from ', year)
+        with timer('fetch games and lines'):
+            games = cached_api_call(cache, api_config, games_api.get_games, '/games', 'list[Game]', year=year)
+            lines = cached_api_call(cache, api_config, betting_api.get_lines, '/lines', 'list[GameLines]', year=year)
+
+        games2 = [
+            dict(
+                gid = g.id,
+                year = g.season,
+                week = g.week,
+                neutral_site = g.neutral_site,
+                home_team = g.home_team,
+                home_conference = g.home_conference,
+                home_points = g.home_points,
+                home_elo = g.home_pregame_elo,
+                away_team = g.away_team,
+                away_conference = g.away_conference,
+                away_points = g.away_points,
+                away_elo = g.away_pregame_elo
+            ) for g in games if g.home_points is not None and g.away_points is not None]
+        del games
+
+        for game in games2:
+            latest_week[year] = max(latest_week.get(year, 0), game['week'])
+        # The season's weeks go in the manifest as unsettled up front, so a run stopped partway through resumes here
+        for week in range(0, latest_week.get(year, -1) + 1):
+            manifest.setdefault(year, {}).setdefault(week, dict(hash=None, games=None, settled=False))
+        save_manifest(manifest)
+        # Only weeks that can still change get processed
+        games2 = sorted((game for game in games2 if not week_is_settled(manifest, game['year'], game['week'])), key=lambda game: game['week'])
+        for game in games2:
+            game['margin'] = game['away_points'] - game['home_points'] # Create margin of victory statistic
+        add_spreads(games2, lines, provider_priority) # Finds game betting data for games that have it
+        del lines
+        games2.reverse()
+        while len(games2) > 0:
+            yield games2.pop() # Dropped here so processed weeks aren't held until the season ends
+
+def save_game_week(manifest, games, year, week, latest_week, restatement_weeks=3):
+    '''Saves one week of processed games to the game store and records it in the manifest, which is rewritten after the
+    partition so a crash leaves the week marked unsettled. The week is settled once its season is over or it is more
+    than restatement_weeks behind latest_week.'''
+
+    entry = manifest.setdefault(year, {}).setdefault(week, dict(hash=None, games=None, settled=False))
+    entry['hash'] = save_week(games, year, week, previous_hash=entry['hash'])
+    entry['games'] = len(games)
+    entry['settled'] = season_is_complete(year) or week <= latest_week - restatement_weeks
+    save_manifest(manifest)
+
+def select_spread(game_lines, provider_priority=('consensus',)):
+    '''Picks the spread for one game from its betting lines. The first line from each provider in provider_priority
+    is tried in order, falling back to the first line listed. Returns None when no usable spread exists.'''
+
+    for provider in provider_priority:
+        game_line = next((l for l in game_lines.lines if l.provider == provider), None)
+        if game_line is not None and game_line.spread is not None:
+            return float(game_line.spread)
+    if len(game_lines.lines) > 0 and game_lines.lines[0].spread is not None:
+        return float(game_lines.lines[0].spread)
+    return None
+
+def add_spreads(games, lines, provider_priority=('consensus',)):
+    '''Joins betting lines onto games by game id, setting 'spread' on every game that has one. Lines are indexed by id
+    once, so this runs in linear time in the number of games plus lines.'''
+
+    lines_by_game = {}
+    for game_lines in lines:
+        lines_by_game.setdefault(game_lines.id, game_lines) # First entry wins, as before
 
-        if year > 2013:
-            for location in ['home','away']:
-
-                if location == 'home':
-                    idx_team1 = [i for i in range(len(old_season_stats)) if old_season_stats[i]['team'] == home_team]
-                    idx_team2 = [i for i in range(len(old_advanced_stats)) if old_advanced_stats[i]['team'] == home_team]
-                else:
-                    idx_team1 = [i for i in range(len(old_season_stats)) if old_season_stats[i]['team'] == away_team]
-                    idx_team2 = [i for i in range(len(old_advanced_stats)) if old_advanced_stats[i]['team'] == away_team]
-
-                if len(idx_team1) > 0:
-                    team_stats = np.array(old_season_stats)[idx_team1]
-                else:
-                    team_stats = []
-                if len(idx_team2) > 0:
-                    team_advanced_stats = [old_advanced_stats[idx_team2[0]]]
-                else:
-                    team_advanced_stats = []
-                    
-                # Below block normalizes team_stats statistics by games played
-                
-                for stat_idx, stat in enumerate(team_stats):
-                    if stat['statName'] == 'games':
-                        num_games = stat['statValue']
-                        
-                for stat in team_stats:
-                    if stat['statName'] == 'games':
-                        stat_dict[location+'_'+stat['statName']+'_'+'lastSeason'] = stat['statValue']
-                    else:
-                        stat_dict[location+'_'+stat['statName']+'_'+'lastSeason'] = stat['statValue'] / num_games
-                if len(team_advanced_stats) > 0:
-                    defense_stats = team_advanced_stats[0]['defense']
-                    defense_drives = defense_stats['drives']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    if defense_stats[name][name2] is not None: 
-                                        stat_per_drive = defense_stats[name][name2] / defense_drives
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'] = defense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'] = None
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'] = defense_stats[name][name2]
-                        else:
-                            if ('defense',name) in total_stats:
-                                if defense_stats[name] is not None:
-                                    stat_per_drive = defense_stats[name] / defense_drives
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'] = defense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'] = None
-                            else:
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'] = defense_stats[name]
-                    offense_stats = team_advanced_stats[0]['offense']
-                    offense_drives = offense_stats['drives']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    if offense_stats[name][name2] is not None:
-                                        stat_per_drive = offense_stats[name][name2] / offense_drives
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'] = offense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'] = None
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'] = offense_stats[name][name2]
-                        else:
-                            if ('offense',name) in total_stats:
-                                if offense_stats[name] is not None:
-                                    stat_per_drive = offense_stats[name] / offense_drives
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'] = offense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'] = None
-                            else:
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'] = offense_stats[name]
-        else:
-            for location in ['home','away']:
-                for stat in season_stats:
-                    stat_dict[location+'_'+stat['statName']+'_'+'lastSeason'] = 0
-                if len(advanced_stats) > 0:
-                    defense_stats = advanced_stats[0]['defense']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastSeason'] = 0
-                        else:
-                            if ('defense',name) in total_stats:
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastSeason'] = 0
-                    offense_stats = advanced_stats[0]['offense']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastSeason'] = 0
-                        else:
-                            if ('offense',name) in total_stats:
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastSeason'] = 0
-                            
-        #----------------------------------------Last 3 weeks stats------------------------------------------------
-        
-        if week > 1:
-            for location in ['home','away']:
-
-                if location == 'home':
-                    idx_team1 = [i for i in range(len(season_stats_last_3)) if season_stats_last_3[i]['team'] == home_team]
-                    idx_team2 = [i for i in range(len(advanced_stats_last_3)) if advanced_stats_last_3[i]['team'] == home_team]
-                else:
-                    idx_team1 = [i for i in range(len(season_stats_last_3)) if season_stats_last_3[i]['team'] == away_team]
-                    idx_team2 = [i for i in range(len(advanced_stats_last_3)) if advanced_stats_last_3[i]['team'] == away_team]
-
-                if len(idx_team1) > 0:
-                    team_stats = np.array(season_stats_last_3)[idx_team1]
-                else:
-                    team_stats = []
-                if len(idx_team2) > 0:
-                    team_advanced_stats = [advanced_stats_last_3[idx_team2[0]]]
-                else:
-                    team_advanced_stats = []
-                    
-                # Below block normalizes team_stats statistics by games played
-                
-                for stat_idx, stat in enumerate(team_stats):
-                    if stat['statName'] == 'games':
-                        num_games = stat['statValue']
-                        
-                for stat in team_stats:
-                    if stat['statName'] == 'games':
-                        stat_dict[location+'_'+stat['statName']+'_'+'lastThree'] = stat['statValue']
-                    else:
-                        stat_dict[location+'_'+stat['statName']+'_'+'lastThree'] = stat['statValue'] / num_games
-                if len(team_advanced_stats) > 0:
-                    defense_stats = team_advanced_stats[0]['defense']
-                    defense_drives = defense_stats['drives']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    if defense_stats[name][name2] is not None: 
-                                        stat_per_drive = defense_stats[name][name2] / defense_drives
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'] = defense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'] = None
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'] = defense_stats[name][name2]
-                        else:
-                            if ('defense',name) in total_stats:
-                                if defense_stats[name] is not None:
-                                    stat_per_drive = defense_stats[name] / defense_drives
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'] = defense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'] = None
-                            else:
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'] = defense_stats[name]
-                    offense_stats = team_advanced_stats[0]['offense']
-                    offense_drives = offense_stats['drives']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    if offense_stats[name][name2] is not None:
-                                        stat_per_drive = offense_stats[name][name2] / offense_drives
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = stat_per_drive
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'] = offense_stats[name][name2] / num_games
-                                    else:
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = None
-                                        stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'] = None
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'] = offense_stats[name][name2]
-                        else:
-                            if ('offense',name) in total_stats:
-                                if offense_stats[name] is not None:
-                                    stat_per_drive = offense_stats[name] / offense_drives
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = stat_per_drive
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'] = offense_stats[name] / num_games
-                                else:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = None
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'] = None
-                            else:
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'] = offense_stats[name]
-        else:
-            for location in ['home','away']:
-                for stat in season_stats:
-                    stat_dict[location+'_'+stat['statName']+'_'+'lastThree'] = 0
-                if len(advanced_stats) > 0:
-                    defense_stats = advanced_stats[0]['defense']
-                    for name in defense_stats.keys():
-                        if type(defense_stats[name]) == type({}):
-                            for name2 in defense_stats[name].keys():
-                                if ('defense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+name2+'_'+'lastThree'] = 0
-                        else:
-                            if ('defense',name) in total_stats:
-                                stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'defense'+'_'+name+'_'+'lastThree'] = 0
-                    offense_stats = advanced_stats[0]['offense']
-                    for name in offense_stats.keys():
-                        if type(offense_stats[name]) == type({}):
-                            for name2 in offense_stats[name].keys():
-                                if ('offense',name,name2) in total_stats:
-                                    stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'+'_'+'perDrive'] = 0
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+name2+'_'+'lastThree'] = 0
-                        else:
-                            if ('offense',name) in total_stats:
-                                stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'+'_'+'perDrive'] = 0
-                            stat_dict[location+'_'+'offense'+'_'+name+'_'+'lastThree'] = 0
-
-        for stat in stat_dict.keys():
-            game[stat] = stat_dict[stat]
-        count += 1
-        
+    for game in games:
+        if game['gid'] in lines_by_game:
+            spread = select_spread(lines_by_game[game['gid']], provider_priority)
+            if spread is not None:
+                game['spread'] = spread
     return games
+
+def process_games(games, headers, max_workers=8, retries=3, backoff=1.0, cache=None, rolling=False, base_url=BASE_URL, seasons=None):
+    '''Takes in a list of games, where each game is a dictionary of game information. Populates that list with game stats.
+    Stats requests are planned first and fetched concurrently with max_workers threads, retrying failed calls with backoff.
+    Responses are read from and saved to the optional ResponseCache, and fetched from base_url. With rolling,
+    season-to-date and last three week stats are derived from one request per week through RollingStats instead of a
+    full-league request per window. That only pays off when filling many weeks of history, and its rushing line stats
+    only approximate the API's, which the models were trained on, so it is off by default. Last season stats of
+    completed years come from the optional SeasonTable when it has them, and are added to it when it doesn't.'''
+    
+    processed = []
+    for year, week, week_games in iter_processed_weeks(games, headers, max_workers, retries, backoff, cache, rolling, base_url=base_url, seasons=seasons):
+        processed += week_games
+    return processed
+
+def iter_processed_weeks(games, headers, max_workers=8, retries=3, backoff=1.0, cache=None, rolling=False, lookahead=4, base_url=BASE_URL, seasons=None):
+    '''Streaming form of process_games. Takes an iterable of games ordered by year and week and yields (year, week,
+    games) one week at a time with the week's games populated with stats. Games are read lazily, so a season is only
+    pulled in once the weeks before it are done. Stats for lookahead weeks are fetched together to keep the thread pool
+    busy, and each chunk's responses are released once its weeks are yielded, so memory stays flat however many
+    seasons go through.'''
+
+    columns = {(location, suffix): feature_columns(location, suffix) for location in ['home','away'] for suffix in ['', '_lastSeason', '_lastThree']}
+    rolling_stats = {} # Year to RollingStats, kept only while a plan refers to that year
+    windows = {} # Stats pair to (team index, matrix), carried over for pairs the next chunk still uses
+
+    weeks = groupby(iter_stat_plans(games), key=lambda item: (item[0]['year'], item[0]['week']))
+    while True:
+        chunk = [(key, list(group)) for key, group in islice(weeks, lookahead)]
+        if len(chunk) == 0:
+            return
+        plans = [plan for _, group in chunk for _, plan in group]
+        pairs = {pair for plan in plans for pair in plan.values() if pair is not None}
+
+        # Only stats this chunk uses and doesn't already have get fetched
+        with timer('plan stats'):
+            windows = {pair: window for pair, window in windows.items() if pair in pairs}
+            last_seasons = {plan['last_season'] for plan in plans if seasons is not None and seasons.stores(plan['last_season'])}
+            for pair in last_seasons:
+                if pair not in windows and seasons.get(pair) is not None:
+                    windows[pair] = seasons.get(pair) # Completed seasons are read from the season table, not fetched
+            rolling_stats = {year: stats for year, stats in rolling_stats.items() if year in {pair[0].year for pair in pairs}}
+            needed = [pair for pair in pairs if pair not in windows]
+            increments = []
+            if rolling:
+                for year, year_weeks in plan_increments(needed).items():
+                    stats = rolling_stats.setdefault(year, RollingStats())
+                    increments += [(year, week, pair) for week, pair in sorted(year_weeks.items()) if week > stats.last_week]
+                needed = [pair for pair in needed if not is_rolling_pair(pair)]
+            stat_requests = list(dict.fromkeys([r for pair in needed for r in pair] + [r for _, _, pair in increments for r in pair]))
+        with timer('fetch stats'):
+            responses = fetch_stat_requests(stat_requests, headers, max_workers=max_workers, retries=retries, backoff=backoff, base_url=base_url, cache=cache)
+        with timer('rolling stats'):
+            for year, week, pair in increments:
+                rolling_stats[year].add_week(week, *[responses[r] for r in pair])
+
+        # Each window of stats becomes a team x feature matrix once, then games just pick out rows
+        with timer('assemble features'):
+            for pair in needed:
+                windows[pair] = extract_features(*[responses[r] for r in pair])
+            del responses
+            for (year, week), group in chunk:
+                print('Compiling games from week, year: ', week, year)
+                for game, plan in group:
+                    for slot, suffix, has_stats in [('current', '', week > 1), ('last_season', '_lastSeason', year > 2013), ('last_three', '_lastThree', week > 1)]:
+                        if has_stats:
+                            pair = plan[slot]
+                            if pair not in windows:
+                                windows[pair] = rolling_stats[pair[0].year].window(pair[0].start_week or 1, pair[0].end_week)
+                            team_index, matrix = windows[pair]
+                        for location in ['home','away']:
+                            if not has_stats:
+                                row = DEFAULT_ROW # No games played yet
+                            elif game[location+'_team'] in team_index:
+                                row = matrix[team_index[game[location+'_team']]]
+                            else:
+                                row = MISSING_ROW
+                            game.update(zip(columns[(location, suffix)], row.tolist()))
+            for pair in last_seasons:
+                if pair in windows and seasons.get(pair) is None:
+                    seasons.put(pair, windows[pair])
+        for (year, week), group in chunk:
+            count('games processed', len(group))
+            yield year, week, [game for game, _ in group]